@@ -0,0 +1,240 @@
+"""
+Coalescing, asynchronous dispatch of security alerts to Sentry.
+
+MaliciousActivityDetector.log_threat hands HIGH/CRITICAL detections to the
+dispatcher and returns at once. Detections are aggregated in memory by
+(IP, threat types, time window). A background thread sends one Sentry
+event per aggregate, carrying the number of hits and a sample of paths,
+once its window has closed. A budget caps the events sent per minute. It
+is counted in the default cache under a per-minute key, so on Redis it is
+shared by every worker (per process on LocMem, or while the cache is
+unreachable). Aggregates beyond the budget, or beyond the pending-aggregate
+cap, are dropped and counted in django_security_alerts_total.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+
+import sentry_sdk
+from django.conf import settings
+from django.core.cache import cache
+
+from .metrics import SECURITY_ALERTS
+
+logger = logging.getLogger(__name__)
+
+BUDGET_KEY_PREFIX = 'security-alerts:budget'
+SEVERITY_ORDER = {'LOW': 0, 'MEDIUM': 1, 'HIGH': 2, 'CRITICAL': 3}
+MAX_SAMPLE_PATHS = 5
+
+
+class AlertAggregate:
+    """Hits for one (IP, threat types, window) key."""
+
+    __slots__ = ('ip', 'types', 'window_start', 'count', 'severity', 'message',
+                 'detection_result', 'paths', 'first_seen', 'last_seen')
+
+    def __init__(self, ip, types, window_start, message, detection_result, severity, now):
+        self.ip = ip
+        self.types = types
+        self.window_start = window_start
+        self.count = 0
+        self.severity = severity
+        self.message = message
+        self.detection_result = detection_result
+        self.paths = []
+        self.first_seen = now
+        self.last_seen = now
+
+    def add(self, path, severity, now):
+        self.count += 1
+        self.last_seen = now
+        if SEVERITY_ORDER.get(severity, 0) > SEVERITY_ORDER.get(self.severity, 0):
+            self.severity = severity
+        if path and path not in self.paths and len(self.paths) < MAX_SAMPLE_PATHS:
+            self.paths.append(path)
+
+
+class SecurityAlertDispatcher:
+    """
+    Aggregates detections and sends them to Sentry from a daemon thread.
+
+    With ``asynchronous=False`` no thread is started and aggregates are only
+    sent by an explicit ``flush()``, which keeps tests deterministic.
+    """
+
+    def __init__(self, window=60, budget_per_minute=30, max_pending=1000, asynchronous=True):
+        self.window = window
+        self.budget_per_minute = budget_per_minute
+        self.max_pending = max_pending
+        self.asynchronous = asynchronous
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._sent_at = deque()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._atexit_registered = False
+
+    # ── request side ─────────────────────────────────────────────────
+
+    def submit(self, message: str, detection_result: dict, severity: str) -> bool:
+        """
+        Record a detection without blocking on Sentry.
+
+        Returns:
+            bool: False if it was dropped because too many aggregates are pending
+        """
+        now = time.time()
+        ip = detection_result.get('ip') or 'unknown'
+        types = tuple(sorted({t.get('type', 'unknown') for t in detection_result.get('threats', [])}))
+        window_start = int(now // self.window) * self.window
+        key = (ip, types, window_start)
+
+        with self._lock:
+            aggregate = self._pending.get(key)
+            if aggregate is None:
+                if len(self._pending) >= self.max_pending:
+                    SECURITY_ALERTS.labels(outcome='dropped').inc()
+                    return False
+                aggregate = AlertAggregate(ip, types, window_start, message, detection_result, severity, now)
+                self._pending[key] = aggregate
+                SECURITY_ALERTS.labels(outcome='queued').inc()
+            else:
+                SECURITY_ALERTS.labels(outcome='coalesced').inc()
+            aggregate.add(detection_result.get('path'), severity, now)
+
+        if self.asynchronous:
+            self._ensure_started()
+        return True
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # ── dispatch side ────────────────────────────────────────────────
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Send every aggregate whose window has closed (all of them if ``force``).
+
+        Returns:
+            int: Number of Sentry events sent
+        """
+        now = time.time()
+        with self._lock:
+            due = [
+                key for key, aggregate in self._pending.items()
+                if force or aggregate.window_start + self.window <= now
+            ]
+            ready = [self._pending.pop(key) for key in due]
+
+        sent = 0
+        for aggregate in sorted(ready, key=lambda a: -SEVERITY_ORDER.get(a.severity, 0)):
+            if not self._take_budget(now):
+                SECURITY_ALERTS.labels(outcome='suppressed').inc()
+                logger.warning(
+                    f"Security alert budget exhausted; suppressed {aggregate.count} "
+                    f"{'/'.join(aggregate.types)} hit(s) from {aggregate.ip}"
+                )
+                continue
+            try:
+                self.send(aggregate)
+                sent += 1
+                SECURITY_ALERTS.labels(outcome='sent').inc()
+            except Exception as e:
+                logger.error(f"Error sending security alert to Sentry: {e}", exc_info=True)
+        return sent
+
+    def send(self, aggregate: AlertAggregate):
+        """Capture one aggregate as a Sentry message."""
+        level = 'error' if aggregate.severity in ('HIGH', 'CRITICAL') else 'warning'
+        message = aggregate.message
+        if aggregate.count > 1:
+            message = f"{message} (x{aggregate.count} from {aggregate.ip} in {self.window}s)"
+
+        new_scope = getattr(sentry_sdk, 'new_scope', None) or sentry_sdk.push_scope
+        with new_scope() as scope:
+            scope.set_context('security_threat', {
+                'severity': aggregate.severity,
+                'threats': str(aggregate.detection_result.get('threats')),
+                'ip': aggregate.ip,
+                'path': aggregate.detection_result.get('path'),
+                'method': aggregate.detection_result.get('method'),
+                'count': aggregate.count,
+                'paths': aggregate.paths,
+                'first_seen': aggregate.first_seen,
+                'last_seen': aggregate.last_seen,
+            })
+            scope.set_level(level)
+
+            # Add tag for filtering in Sentry
+            scope.set_tag('security_threat', aggregate.severity.lower())
+            scope.set_tag('threat_detected', 'true')
+            # Same IP and threat types group into one Sentry issue
+            scope.fingerprint = ['security-threat', aggregate.ip, *aggregate.types]
+
+            sentry_sdk.capture_message(message, level=level)
+
+    def shutdown(self, timeout=5.0):
+        """Stop the dispatcher thread and send whatever is pending (worker exit)."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self.flush(force=True)
+
+    # ── internals ────────────────────────────────────────────────────
+
+    def _take_budget(self, now) -> bool:
+        key = f'{BUDGET_KEY_PREFIX}:{int(now // 60)}'
+        try:
+            try:
+                used = cache.incr(key)
+            except ValueError:
+                # First event this minute; another worker may race us to it
+                used = 1 if cache.add(key, 1, 120) else cache.incr(key)
+        except Exception as e:
+            logger.warning(f"Security alert budget unavailable in cache, counting per process: {e}")
+            return self._take_local_budget(now)
+        return used <= self.budget_per_minute
+
+    def _take_local_budget(self, now) -> bool:
+        while self._sent_at and self._sent_at[0] <= now - 60:
+            self._sent_at.popleft()
+        if len(self._sent_at) >= self.budget_per_minute:
+            return False
+        self._sent_at.append(now)
+        return True
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='security-alert-dispatcher', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _run(self):
+        # Wake a few times per window so closed windows go out promptly
+        interval = max(1.0, self.window / 4)
+        while not self._stopping.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error dispatching security alerts: {e}", exc_info=True)
+
+
+# Global instance
+alert_dispatcher = SecurityAlertDispatcher(
+    window=getattr(settings, 'SECURITY_ALERT_WINDOW', 60),
+    budget_per_minute=getattr(settings, 'SECURITY_ALERT_BUDGET_PER_MINUTE', 30),
+    asynchronous=getattr(settings, 'SECURITY_ALERT_ASYNC', True),
+)
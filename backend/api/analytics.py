@@ -0,0 +1,303 @@
+"""
+Visitor analytics rollups.
+
+VisitorDailyStats / VisitorDailyBreakdown hold per-day counters that are
+incremented as the visitor buffer writes each batch, and can be rebuilt
+from the raw Visitor table with `manage.py compact_visitor_stats`.
+VisitorSession rows are upserted from the same batches, and the per-day
+session, bounce and duration totals in VisitorDailyStats are adjusted as
+they are, so bounce rate and session duration are read from the rollups
+too. Unique-visitor figures come from the HyperLogLog sketches in
+api.uniques.
+"""
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Dimensions kept in VisitorDailyBreakdown (Visitor field names)
+BREAKDOWN_DIMENSIONS = ('path', 'device_type', 'browser', 'os')
+
+# Stats cover the same window as raw Visitor retention
+STATS_WINDOW_DAYS = 90
+
+
+def _increment(model, lookup: dict, deltas: dict):
+    """Add ``deltas`` to the row matching ``lookup``, creating it if needed."""
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    expressions = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**lookup).update(**expressions):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Another worker created the row first
+        model.objects.filter(**lookup).update(**expressions)
+
+
+def increment_rollups(visitors):
+    """
+    Fold a freshly inserted batch of Visitor rows into the daily rollups.
+
+    Args:
+        visitors: Visitor instances that were just written
+    """
+    from .models import VisitorDailyBreakdown, VisitorDailyStats
+
+    totals = {}
+    breakdowns = Counter()
+    for visitor in visitors:
+        day = visitor.visit_time.date()
+        day_totals = totals.setdefault(day, Counter())
+        day_totals['visits'] += 1
+        day_totals['unique_visitors'] += int(visitor.is_unique)
+        for dimension in BREAKDOWN_DIMENSIONS:
+            breakdowns[(day, dimension, getattr(visitor, dimension) or '')] += 1
+
+    for day, deltas in totals.items():
+        _increment(VisitorDailyStats, {'date': day}, deltas)
+    for (day, dimension, value), count in breakdowns.items():
+        _increment(
+            VisitorDailyBreakdown,
+            {'date': day, 'dimension': dimension, 'value': value},
+            {'count': count},
+        )
+
+
+def _session_totals(first_seen, last_seen, page_count):
+    """Return (start day, VisitorDailyStats deltas) one session contributes."""
+    return first_seen.date(), Counter(
+        sessions=1,
+        single_page_sessions=int(page_count == 1),
+        session_seconds=int((last_seen - first_seen).total_seconds()),
+    )
+
+
+def _upsert_session(session, rollups):
+    """
+    Fold one batch's view of a session into its row, and the change in the
+    session's totals into ``rollups`` ({start day: Counter}).
+
+    The row is locked while it is read and updated, so concurrent flushes of
+    the same session never overwrite each other's pages, times or totals.
+    """
+    from .models import VisitorSession
+
+    expressions = {
+        'page_count': F('page_count') + session.page_count,
+        'first_seen': Least(F('first_seen'), Value(session.first_seen)),
+        'last_seen': Greatest(F('last_seen'), Value(session.last_seen)),
+        # The right-hand sides all see the row as it was before the UPDATE
+        'entry_path': Case(
+            When(first_seen__gt=session.first_seen, then=Value(session.entry_path)),
+            default=F('entry_path'),
+        ),
+        'exit_path': Case(
+            When(last_seen__lte=session.last_seen, then=Value(session.exit_path)),
+            default=F('exit_path'),
+        ),
+    }
+    lookup = VisitorSession.objects.filter(session_key=session.session_key)
+    fields = ('first_seen', 'last_seen', 'page_count')
+    current = lookup.select_for_update().values_list(*fields).first()
+    if current is None:
+        try:
+            with transaction.atomic():
+                session.save(force_insert=True)
+            day, totals = _session_totals(session.first_seen, session.last_seen, session.page_count)
+            rollups[day].update(totals)
+            return
+        except IntegrityError:
+            # Another worker created the session first
+            current = lookup.select_for_update().values_list(*fields).get()
+    lookup.update(**expressions)
+
+    first_seen, last_seen, page_count = current
+    day, totals = _session_totals(first_seen, last_seen, page_count)
+    rollups[day].subtract(totals)
+    day, totals = _session_totals(
+        min(first_seen, session.first_seen),
+        max(last_seen, session.last_seen),
+        page_count + session.page_count,
+    )
+    rollups[day].update(totals)
+
+
+def upsert_sessions(visitors):
+    """
+    Create or extend VisitorSession rows for a freshly inserted batch, and
+    keep the session totals of VisitorDailyStats (by start day) in step.
+    """
+    from .models import VisitorDailyStats, VisitorSession
+
+    batch = {}
+    for visitor in sorted(visitors, key=lambda v: v.visit_time):
+        if not visitor.session_key:
+            continue
+        session = batch.get(visitor.session_key)
+        if session is None:
+            batch[visitor.session_key] = session = VisitorSession(
+                session_key=visitor.session_key,
+                first_seen=visitor.visit_time,
+                last_seen=visitor.visit_time,
+                entry_path=visitor.path or '',
+            )
+        session.page_count += 1
+        session.last_seen = visitor.visit_time
+        session.exit_path = visitor.path or ''
+    if not batch:
+        return
+
+    rollups = defaultdict(Counter)
+    with transaction.atomic():
+        # Lock rows in one order so concurrent batches cannot deadlock
+        for session_key in sorted(batch):
+            _upsert_session(batch[session_key], rollups)
+        for day in sorted(rollups):
+            _increment(VisitorDailyStats, {'date': day}, rollups[day])
+
+
+def get_session_stats(since=None) -> dict:
+    """
+    Bounce rate (% of single-page sessions) and average session duration in
+    seconds, optionally limited to sessions that started on or after the
+    date ``since``. Read from the VisitorDailyStats session totals.
+    """
+    from .models import VisitorDailyStats
+
+    days = VisitorDailyStats.objects.all()
+    if since is not None:
+        days = days.filter(date__gte=since)
+    stats = days.aggregate(
+        total=Sum('sessions'),
+        bounces=Sum('single_page_sessions'),
+        seconds=Sum('session_seconds'),
+    )
+    total = stats['total'] or 0
+    return {
+        'sessions': total,
+        'bounce_rate': round((stats['bounces'] / total) * 100, 2) if total else 0,
+        'average_session_duration': round(stats['seconds'] / total, 2) if total else 0,
+    }
+
+
+def rebuild_rollups(day):
+    """
+    Recompute the rollups for one day from the raw Visitor table.
+
+    Returns:
+        VisitorDailyStats: The rebuilt stats row
+    """
+    from .models import Visitor, VisitorDailyBreakdown, VisitorDailyStats, VisitorSession
+
+    visits = Visitor.objects.filter(visit_time__date=day)
+    totals = visits.aggregate(
+        visits=models.Count('id'),
+        unique_visitors=models.Count('id', filter=models.Q(is_unique=True)),
+    )
+    # Summed per session, exactly as upsert_sessions adds them
+    session_totals = Counter(sessions=0, single_page_sessions=0, session_seconds=0)
+    sessions = VisitorSession.objects.filter(first_seen__date=day).values_list(
+        'first_seen', 'last_seen', 'page_count'
+    )
+    for first_seen, last_seen, page_count in sessions.iterator(chunk_size=2000):
+        session_totals.update(_session_totals(first_seen, last_seen, page_count)[1])
+
+    with transaction.atomic():
+        stats, _ = VisitorDailyStats.objects.update_or_create(
+            date=day,
+            defaults={
+                'visits': totals['visits'],
+                'unique_visitors': totals['unique_visitors'],
+                **session_totals,
+            },
+        )
+        VisitorDailyBreakdown.objects.filter(date=day).delete()
+        rows = []
+        for dimension in BREAKDOWN_DIMENSIONS:
+            for row in visits.values(dimension).annotate(count=models.Count('id')):
+                rows.append(VisitorDailyBreakdown(
+                    date=day,
+                    dimension=dimension,
+                    value=row[dimension] or '',
+                    count=row['count'],
+                ))
+        VisitorDailyBreakdown.objects.bulk_create(rows)
+    return stats
+
+
+def _distribution(breakdowns, dimension):
+    """Return [(value, count)] for a dimension, most frequent first."""
+    rows = (
+        breakdowns.filter(dimension=dimension)
+        .values('value')
+        .annotate(total=Sum('count'))
+        .order_by('-total')
+    )
+    # '' stands for "no value", which Visitor stored as NULL
+    return [(row['value'] or None, row['total']) for row in rows]
+
+
+def get_visitor_stats(days: int = STATS_WINDOW_DAYS) -> dict:
+    """
+    Build the VisitorStatsView payload from the rollup tables.
+
+    Runs a fixed number of small queries regardless of Visitor table size.
+    """
+    from .models import VisitorDailyBreakdown, VisitorDailyStats
+
+    today = timezone.now().date()
+    since = today - timedelta(days=days - 1)
+
+    from .uniques import count_window_uniques
+
+    totals = VisitorDailyStats.objects.filter(date__gte=since).aggregate(visits=Sum('visits'))
+    total_visitors = totals['visits'] or 0
+    session_stats = get_session_stats(since=since)
+
+    breakdowns = VisitorDailyBreakdown.objects.filter(date__gte=since)
+    top_paths = _distribution(breakdowns, 'path')[:10]
+    uniques = count_window_uniques(since, today, paths=[path or '' for path, _count in top_paths])
+    popular_pages = [
+        {
+            'path': path,
+            'count': count,
+            'unique_visitors': uniques[path or ''],
+        }
+        for path, count in top_paths
+    ]
+
+    # Daily trend (last 7 days, oldest to newest)
+    week_start = today - timedelta(days=6)
+    visits_by_day = dict(
+        VisitorDailyStats.objects.filter(date__gte=week_start).values_list('date', 'visits')
+    )
+    daily_trend = []
+    for i in range(6, -1, -1):
+        date = today - timedelta(days=i)
+        daily_trend.append({
+            'date': date.strftime('%Y-%m-%d'),
+            'visits': visits_by_day.get(date, 0),
+        })
+
+    return {
+        'total_visitors': total_visitors,
+        'unique_visitors': uniques[None],
+        'page_views': total_visitors,
+        'bounce_rate': session_stats['bounce_rate'],
+        'average_session_duration': session_stats['average_session_duration'],
+        'popular_pages': popular_pages,
+        'device_distribution': dict(_distribution(breakdowns, 'device_type')),
+        'browser_distribution': dict(_distribution(breakdowns, 'browser')),
+        'os_distribution': dict(_distribution(breakdowns, 'os')),
+        'daily_trend': daily_trend,
+    }
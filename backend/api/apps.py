@@ -9,6 +9,27 @@ class ApiConfig(AppConfig):
         from django.db.models.signals import post_save
         from django.dispatch import receiver
 
+        # Prometheus business gauges fed by write-path counters
+        from .collectors import register as register_metrics_collector
+        register_metrics_collector()
+
+        # Trusted-proxy / metrics allow-lists are compiled once; SIGHUP rebuilds them
+        from .networks import install_reload_handler
+        install_reload_handler()
+
+        # Cached token authentication is invalidated on logout and user changes
+        from .authentication import connect_invalidation
+        connect_invalidation()
+
+        # Per-request query metrics (PrometheusMetricsMiddleware), on every thread's connection
+        from django.db.backends.signals import connection_created
+        from .middleware import install_query_recorder
+        connection_created.connect(install_query_recorder, dispatch_uid='api.install_query_recorder')
+
+        # Cloudinary's uploader and Admin API share one pooled connection manager
+        from .outbound import registry as outbound_http
+        outbound_http.install_cloudinary()
+
         @receiver(post_save, sender='api.SecurityAlert')
         def send_security_alert_email(sender, instance, created, **kwargs):
             """Send email to all admin users when a new SecurityAlert is created."""
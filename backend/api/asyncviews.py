@@ -0,0 +1,47 @@
+"""
+Async DRF views for endpoints that wait on outbound I/O.
+
+AsyncAPIView keeps APIView's request handling but awaits ``async def``
+handlers. Authentication, permission and throttle checks can hit the
+database, so ``initial()`` runs through sync_to_async. Handlers hop to a
+thread only for their own ORM work. Django serves these views natively under
+the uvicorn worker (SERVER_MODE=asgi). Under WSGI they still work, with each
+request run on its own event loop.
+
+Subclasses must make every handler except ``options`` async, since Django
+rejects views that mix sync and async handlers.
+"""
+from asgiref.sync import sync_to_async
+from rest_framework.views import APIView
+
+
+class AsyncAPIView(APIView):
+    """APIView whose dispatch is a coroutine."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers  # deprecate?
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            # Get the appropriate handler method
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(),
+                                  self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+            # options() and http_method_not_allowed() stay sync
+            if hasattr(response, '__await__'):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
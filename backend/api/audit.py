@@ -0,0 +1,258 @@
+"""
+Batched audit-log (ActivityLog) writer.
+
+SecurityLogger.log_activity and log_login_attempt turn each audit event into
+a plain record and queue it on ``audit_log``. The flusher thread writes
+queued records with one bulk_create per table and flush. That covers
+ActivityLoggingMiddleware and the login views, which used to do one INSERT
+per request.
+
+For crash safety, each queued record is also appended as a JSON line to a
+spool segment in AUDIT_LOG_SPOOL_DIR before enqueue returns. A segment is
+named after its process and holds an exclusive flock while the process is
+alive. On each flush the active segment is sealed, exactly the records it
+holds are written, and then the segment is deleted. If the write fails,
+the segment is unlocked and left on disk. Any process that can lock a
+segment therefore finds a dead owner or a failed write, and replays it on
+its next flush. Records reach the OS page cache before the request
+returns, so a killed worker loses nothing. A host crash can still lose the
+records written since the last page-cache writeback.
+
+When the queue is full, a record is appended to the process's overflow
+segment instead of being dropped. The next flush writes that segment the
+same way, and a crash leaves it for replay like any other.
+
+With ``asynchronous=False`` records are written inline and no spool is used.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from itertools import count
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from .buffering import BufferedWriter
+from .metrics import WRITE_BUFFER_DEPTH
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SPOOL_SUFFIX = '.spool'
+
+
+class AuditSpool:
+    """Append-only JSON-lines segments, one active segment per process."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._sequence = count()
+        self._active = None  # (path, fd)
+        self._overflow = None  # (path, fd), records that are not queued
+
+    def append(self, record: dict, overflow: bool = False):
+        if overflow:
+            if self._overflow is None:
+                self._overflow = self._open_segment()
+            fd = self._overflow[1]
+        else:
+            if self._active is None:
+                self._active = self._open_segment()
+            fd = self._active[1]
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        os.write(fd, line.encode())
+
+    def seal(self):
+        """Detach the active segment (still locked) and return it, or None."""
+        sealed, self._active = self._active, None
+        return sealed
+
+    def seal_overflow(self):
+        """Detach the overflow segment (still locked) and return it, or None."""
+        sealed, self._overflow = self._overflow, None
+        return sealed
+
+    def read(self, segment) -> list:
+        return self._read(segment[1])
+
+    def discard(self, segment):
+        """Delete a segment whose records have been written."""
+        path, fd = segment
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+    def release(self, segment):
+        """Unlock a segment whose write failed so a later flush replays it."""
+        os.close(segment[1])
+
+    def orphans(self):
+        """
+        Yield (segment, records) for every segment no live process holds:
+        left by a crashed worker or released after a failed write.
+        """
+        own = {segment[0] for segment in (self._active, self._overflow) if segment}
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(SPOOL_SUFFIX) or path in own:
+                continue
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            if os.fstat(fd).st_nlink == 0:
+                # Replayed and deleted by another process after our listdir
+                os.close(fd)
+                continue
+            yield (path, fd), self._read(fd)
+
+    def _open_segment(self):
+        name = f'audit-{os.getpid()}-{int(time.time() * 1000)}-{next(self._sequence)}{SPOOL_SUFFIX}'
+        path = os.path.join(self.directory, name)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return path, fd
+
+    @staticmethod
+    def _read(fd):
+        chunks, offset = [], 0
+        while True:
+            chunk = os.pread(fd, 1 << 20, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        records = []
+        for line in b''.join(chunks).splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Torn final line from a crash mid-write
+                continue
+        return records
+
+
+class AuditLogBuffer(BufferedWriter):
+    """
+    Batches audit records into ActivityLog rows (see SecurityLogger.log_activity),
+    or LoginActivity rows for records with ``'model': 'login'``
+    (SecurityLogger.log_login_attempt).
+    """
+
+    name = 'audit'
+
+    def __init__(self, spool_dir='', **kwargs):
+        super().__init__(**kwargs)
+        self._spool = None
+        self._spool_lock = threading.Lock()
+        if spool_dir and self.asynchronous and fcntl is not None:
+            try:
+                self._spool = AuditSpool(spool_dir)
+            except OSError as e:
+                logger.error(f"Audit spool disabled, cannot use {spool_dir}: {e}")
+
+    def enqueue(self, record) -> bool:
+        if self._spool is None:
+            return super().enqueue(record)
+        # Queue and spool together so a sealed segment holds exactly the
+        # records queued before it was sealed
+        with self._spool_lock:
+            if not super().enqueue(record):
+                return False
+            try:
+                self._spool.append(record)
+            except OSError as e:
+                logger.error(f"Error spooling audit record: {e}")
+        return True
+
+    def overflow(self, record) -> bool:
+        # Called from enqueue with the spool lock held
+        if self._spool is None:
+            return False
+        try:
+            self._spool.append(record, overflow=True)
+        except OSError as e:
+            logger.error(f"Error spooling overflowing audit record: {e}")
+            return False
+        return True
+
+    def flush(self) -> int:
+        if self._spool is None:
+            return super().flush()
+
+        with self._flush_lock:
+            self._replay_orphans()
+            with self._spool_lock:
+                segment = self._spool.seal()
+                overflow = self._spool.seal_overflow()
+                pending = self._queue.qsize()
+            records = self._drain(pending)
+            written = self._write(records) if records else True
+            if segment is not None:
+                if written:
+                    self._spool.discard(segment)
+                else:
+                    self._spool.release(segment)
+            if overflow is not None:
+                spilled = self._spool.read(overflow)
+                if not spilled or self._write(spilled):
+                    self._spool.discard(overflow)
+                    records.extend(spilled)
+                else:
+                    self._spool.release(overflow)
+        WRITE_BUFFER_DEPTH.labels(buffer=self.name).set(self._queue.qsize())
+        return len(records)
+
+    def write_batch(self, records):
+        from .models import ActivityLog, CustomUser, LoginActivity
+
+        # The user may have been deleted since the event was queued
+        user_ids = {r['user_id'] for r in records if r.get('user_id') is not None}
+        existing = set(CustomUser.objects.filter(pk__in=user_ids).values_list('pk', flat=True)) if user_ids else set()
+
+        rows = {ActivityLog: [], LoginActivity: []}
+        for record in records:
+            fields = dict(record)
+            model = LoginActivity if fields.pop('model', None) == 'login' else ActivityLog
+            if fields.get('user_id') not in existing:
+                fields['user_id'] = None
+            fields['created_at'] = parse_datetime(fields['created_at'])
+            rows[model].append(model(**fields))
+        with transaction.atomic():
+            for model, objs in rows.items():
+                if objs:
+                    model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def _replay_orphans(self):
+        for segment, records in self._spool.orphans():
+            if not records or self._write(records):
+                if records:
+                    logger.info(f"Replayed {len(records)} spooled audit records from {segment[0]}")
+                self._spool.discard(segment)
+            else:
+                self._spool.release(segment)
+
+
+# Global instance
+audit_log = AuditLogBuffer(
+    spool_dir=getattr(settings, 'AUDIT_LOG_SPOOL_DIR', ''),
+    max_size=getattr(settings, 'AUDIT_LOG_MAX_SIZE', 10000),
+    batch_size=getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 200),
+    flush_interval=getattr(settings, 'AUDIT_LOG_FLUSH_INTERVAL', 5.0),
+    asynchronous=getattr(settings, 'AUDIT_LOG_ASYNC', True),
+)
@@ -1,11 +1,70 @@
 """
 Custom authentication class to support HttpOnly cookie token authentication
+
+Token lookups are read through the default cache: the token key (hashed)
+maps to the user's field values for AUTH_TOKEN_CACHE_TTL seconds, so an
+authenticated request normally costs no database query. Unknown keys and
+inactive users are cached as failures for the same TTL. Entries are dropped
+when the token is deleted (logout, user deletion) and whenever the user is
+saved (password change/reset, admin updates, deactivation), once the
+change has committed; the TTL bounds
+staleness from writes that bypass signals (queryset.update()).
 """
+import hashlib
+
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.middleware.csrf import CsrfViewMiddleware
 
+TOKEN_CACHE_PREFIX = 'auth:token'
+
+# Never cached; loaded from the database if a request needs it
+UNCACHED_USER_FIELDS = {'password'}
+
+
+def token_cache_key(key: str) -> str:
+    # Hashed so bearer tokens never appear in cache keys
+    return f"{TOKEN_CACHE_PREFIX}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def invalidate_token(key: str):
+    cache.delete(token_cache_key(key))
+
+
+def invalidate_token_keys(keys):
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+def user_token_keys(user_id) -> list:
+    from rest_framework.authtoken.models import Token
+
+    return list(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+
+def _serialize(user, token) -> dict:
+    return {
+        'user': {
+            field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields
+            if field.attname not in UNCACHED_USER_FIELDS
+        },
+        'token_created': token.created,
+    }
+
+
+def _restore(key: str, state: dict):
+    from rest_framework.authtoken.models import Token
+
+    fields = state['user']
+    user = get_user_model().from_db(DEFAULT_DB_ALIAS, list(fields), list(fields.values()))
+    token = Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id', 'created'], [key, user.pk, state['token_created']])
+    token.user = user
+    return user, token
+
 
 class CookieTokenAuthentication(TokenAuthentication):
     """
@@ -36,6 +95,45 @@ class CookieTokenAuthentication(TokenAuthentication):
 
         return None
 
+    def authenticate_credentials(self, key):
+        ttl = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60)
+        if ttl <= 0:
+            return super().authenticate_credentials(key)
+
+        cache_key = token_cache_key(key)
+        state = cache.get(cache_key)
+        if state is not None:
+            if 'error' in state:
+                raise AuthenticationFailed(state['error'])
+            return _restore(key, state)
+
+        try:
+            user, token = super().authenticate_credentials(key)
+        except AuthenticationFailed as e:
+            cache.set(cache_key, {'error': str(e.detail)}, ttl)
+            raise
+        cache.set(cache_key, _serialize(user, token), ttl)
+        return user, token
+
+
+def connect_invalidation():
+    """Drop cached token lookups when tokens are deleted or users change."""
+    from django.db.models.signals import post_delete, post_save
+    from rest_framework.authtoken.models import Token
+
+    # After commit: invalidating inside the writer's transaction would let a
+    # concurrent request re-cache the old, still committed row
+    def on_token_delete(sender, instance, using, **kwargs):
+        key = instance.key
+        transaction.on_commit(lambda: invalidate_token(key), using=using)
+
+    def on_user_save(sender, instance, using, **kwargs):
+        keys = user_token_keys(instance.pk)
+        transaction.on_commit(lambda: invalidate_token_keys(keys), using=using)
+
+    post_delete.connect(on_token_delete, sender=Token, weak=False, dispatch_uid='auth_token_cache_delete')
+    post_save.connect(on_user_save, sender=settings.AUTH_USER_MODEL, weak=False, dispatch_uid='auth_token_cache_user')
+
 
 # Add this to REST_FRAMEWORK in settings.py:
 # 'DEFAULT_AUTHENTICATION_CLASSES': [
@@ -43,4 +141,3 @@ class CookieTokenAuthentication(TokenAuthentication):
 #     'rest_framework.authentication.SessionAuthentication',
 #     'rest_framework.authentication.TokenAuthentication',
 # ],
-
@@ -0,0 +1,173 @@
+"""
+In-process buffered writers for append-only tables.
+
+Request threads hand records to a bounded queue and return immediately.
+A daemon thread drains the queue in batches (when ``batch_size`` records
+are waiting or every ``flush_interval`` seconds) and persists them with
+``bulk_create``. When the queue is full, records are dropped and counted
+instead of blocking the request, unless the subclass can keep them
+elsewhere (``overflow``).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+from .metrics import (
+    WRITE_BUFFER_DEPTH,
+    WRITE_BUFFER_DROPPED,
+    WRITE_BUFFER_FLUSH_DURATION,
+    WRITE_BUFFER_WRITTEN,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedWriter:
+    """
+    Bounded queue + background flusher.
+
+    Subclasses implement ``write_batch(records)``. With ``asynchronous=False``
+    records are written inline, which keeps tests and management commands
+    deterministic.
+    """
+
+    name = 'buffer'
+
+    def __init__(self, max_size=10000, batch_size=200, flush_interval=5.0, asynchronous=True):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.asynchronous = asynchronous
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._atexit_registered = False
+
+    # ── producer side ────────────────────────────────────────────────
+
+    def enqueue(self, record) -> bool:
+        """
+        Queue a record for writing.
+
+        Returns:
+            bool: False if the record was dropped because the buffer is full
+        """
+        if not self.asynchronous:
+            self._write([record])
+            return True
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow(record):
+                self._wakeup.set()
+                return True
+            self.dropped += 1
+            WRITE_BUFFER_DROPPED.labels(buffer=self.name).inc()
+            return False
+
+        depth = self._queue.qsize()
+        WRITE_BUFFER_DEPTH.labels(buffer=self.name).set(depth)
+        if depth >= self.batch_size:
+            self._wakeup.set()
+        self._ensure_started()
+        return True
+
+    def overflow(self, record) -> bool:
+        """Keep a record the full queue cannot take; False drops it."""
+        return False
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    # ── consumer side ────────────────────────────────────────────────
+
+    def flush(self) -> int:
+        """
+        Write everything currently queued.
+
+        Returns:
+            int: Number of records handed to ``write_batch``
+        """
+        total = 0
+        with self._flush_lock:
+            while True:
+                batch = self._drain(self.batch_size)
+                if not batch:
+                    break
+                self._write(batch)
+                total += len(batch)
+        WRITE_BUFFER_DEPTH.labels(buffer=self.name).set(self._queue.qsize())
+        return total
+
+    def shutdown(self, timeout=10.0):
+        """Stop the flusher thread and drain whatever is left (worker exit)."""
+        self._stopping.set()
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
+        self.flush()
+
+    def write_batch(self, records):
+        raise NotImplementedError
+
+    # ── internals ────────────────────────────────────────────────────
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch) -> bool:
+        start = time.perf_counter()
+        try:
+            self.write_batch(batch)
+            WRITE_BUFFER_WRITTEN.labels(buffer=self.name).inc(len(batch))
+            return True
+        except Exception as e:
+            logger.error(f"Error flushing {len(batch)} {self.name} records: {e}", exc_info=True)
+            return False
+        finally:
+            WRITE_BUFFER_FLUSH_DURATION.labels(buffer=self.name).observe(time.perf_counter() - start)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run,
+                name=f'{self.name}-buffer-flusher',
+                daemon=True,
+            )
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                # The flusher owns its own DB connection; recycle it like a
+                # request would so CONN_MAX_AGE and dropped connections apply.
+                close_old_connections()
@@ -0,0 +1,235 @@
+"""
+Prometheus collector for the business gauges (projects, media, users, likes,
+visitors).
+
+A scrape never counts the large tables:
+- Object totals are cache counters that post_save/post_delete receivers
+  adjust as rows are created and deleted.
+- Visitor totals and distributions come from the daily rollup tables that
+  the visitor buffer maintains (api.analytics).
+- Unique visitors, bounce rate and session duration are computed by
+  reconcile(), which also resets the counters to exact counts to correct
+  any drift (bulk operations bypass signals). It runs on a background
+  thread every METRICS_RECONCILE_INTERVAL seconds once the metrics endpoint
+  is first hit, by one worker per interval (see Reconciler), and can be run
+  from cron with `manage.py reconcile_metrics`.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import REGISTRY, Collector
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'metrics:total'
+DERIVED_CACHE_KEY = 'metrics:derived'
+RECONCILE_LOCK_KEY = 'metrics:reconcile:lock'
+
+# Counter name -> (model label, metric name, help text)
+TOTALS = {
+    'projects': ('projects.Project', 'django_projects_count', 'Number of projects'),
+    'media': ('projects.MediaItem', 'django_media_count', 'Number of media items'),
+    'users': ('api.CustomUser', 'django_users_count', 'Number of users'),
+    'likes': ('interactions.Like', 'django_likes_count', 'Number of likes'),
+}
+
+# Derived value -> (metric name, help text), refreshed by reconcile()
+DERIVED = {
+    'unique_visitors': ('django_unique_visitors_count', 'Number of unique visitors'),
+    'bounce_rate': ('django_bounce_rate', 'Bounce rate percentage'),
+    'average_session_duration': (
+        'django_average_session_duration_seconds', 'Average visitor session duration in seconds'
+    ),
+}
+
+# Rollup dimension -> (metric name, help text, label name)
+DISTRIBUTIONS = {
+    'device_type': ('django_visitors_by_device', 'Number of visitors by device type', 'device_type'),
+    'browser': ('django_visitors_by_browser', 'Number of visitors by browser', 'browser'),
+    'os': ('django_visitors_by_os', 'Number of visitors by operating system', 'os'),
+    'path': ('django_page_views', 'Number of views per page', 'path'),
+}
+
+
+def _key(name: str) -> str:
+    return f'{CACHE_PREFIX}:{name}'
+
+
+def increment(name: str, delta: int = 1):
+    """Adjust a total counter; a missing counter waits for the next reconcile()."""
+    try:
+        cache.incr(_key(name), delta)
+    except ValueError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not update metrics counter {name}: {e}")
+
+
+def reconcile() -> dict:
+    """
+    Recount every total and recompute the derived visitor figures.
+
+    Run periodically by the reconciler thread or `manage.py
+    reconcile_metrics`; this is the only place the large tables are counted.
+    """
+    from .analytics import STATS_WINDOW_DAYS, get_session_stats
+    from .uniques import count_unique_visitors
+
+    totals = {
+        name: apps.get_model(label).objects.count()
+        for name, (label, _metric, _doc) in TOTALS.items()
+    }
+    cache.set_many({_key(name): value for name, value in totals.items()}, timeout=None)
+
+    now = timezone.now()
+    today = now.date()
+    since = today - timedelta(days=STATS_WINDOW_DAYS - 1)
+    session_stats = get_session_stats(since=since)
+    derived = {
+        'unique_visitors': count_unique_visitors(since, today),
+        'bounce_rate': session_stats['bounce_rate'],
+        'average_session_duration': session_stats['average_session_duration'],
+    }
+    cache.set(DERIVED_CACHE_KEY, derived, timeout=None)
+    return {**totals, **derived}
+
+
+class BusinessMetricsCollector(Collector):
+    """Yields the business gauges from counters and rollups on each scrape."""
+
+    def describe(self):
+        # Declared without values so registering does not hit the database
+        for _label, metric, doc in TOTALS.values():
+            yield GaugeMetricFamily(metric, doc)
+        for metric, doc in DERIVED.values():
+            yield GaugeMetricFamily(metric, doc)
+        yield GaugeMetricFamily('django_visitors_count', 'Number of visitors')
+        yield GaugeMetricFamily('django_page_views_count', 'Number of page views')
+        for metric, doc, label in DISTRIBUTIONS.values():
+            yield GaugeMetricFamily(metric, doc, labels=[label])
+
+    def collect(self):
+        try:
+            yield from self._collect_counters()
+            yield from self._collect_rollups()
+        except Exception as e:
+            # Never break the metrics endpoint over business gauges
+            logger.error(f"Error collecting business metrics: {e}", exc_info=True)
+
+    def _collect_counters(self):
+        values = cache.get_many([_key(name) for name in TOTALS])
+        for name, (_label, metric, doc) in TOTALS.items():
+            if _key(name) in values:
+                yield GaugeMetricFamily(metric, doc, value=values[_key(name)])
+        derived = cache.get(DERIVED_CACHE_KEY) or {}
+        for name, (metric, doc) in DERIVED.items():
+            if name in derived:
+                yield GaugeMetricFamily(metric, doc, value=derived[name])
+
+    def _collect_rollups(self):
+        from .analytics import STATS_WINDOW_DAYS
+        from .models import VisitorDailyBreakdown, VisitorDailyStats
+
+        since = timezone.now().date() - timedelta(days=STATS_WINDOW_DAYS - 1)
+        visits = VisitorDailyStats.objects.filter(date__gte=since).aggregate(total=Sum('visits'))['total'] or 0
+        yield GaugeMetricFamily('django_visitors_count', 'Number of visitors', value=visits)
+        yield GaugeMetricFamily('django_page_views_count', 'Number of page views', value=visits)
+
+        families = {
+            dimension: GaugeMetricFamily(metric, doc, labels=[label])
+            for dimension, (metric, doc, label) in DISTRIBUTIONS.items()
+        }
+        rows = (
+            VisitorDailyBreakdown.objects.filter(date__gte=since)
+            .values('dimension', 'value')
+            .annotate(total=Sum('count'))
+        )
+        for row in rows:
+            family = families.get(row['dimension'])
+            if family is not None:
+                family.add_metric([row['value'] or 'None'], row['total'])
+        yield from families.values()
+
+
+class Reconciler:
+    """
+    Daemon thread that calls reconcile() every ``interval`` seconds.
+
+    Every worker that serves /metrics/ runs one, but a shared cache lock
+    taken for ``interval`` seconds lets only the first of them reconcile in
+    each interval; the others skip that round.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='metrics-reconciler', daemon=True)
+                self._thread.start()
+
+    def run_once(self) -> bool:
+        """Reconcile unless another worker already did this interval."""
+        if not cache.add(RECONCILE_LOCK_KEY, True, timeout=self.interval):
+            return False
+        reconcile()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error reconciling metrics counters: {e}", exc_info=True)
+            finally:
+                close_old_connections()
+            time.sleep(self.interval)
+
+
+# Global instance
+reconciler = Reconciler(interval=getattr(settings, 'METRICS_RECONCILE_INTERVAL', 600))
+
+
+def _counter_receivers(name):
+    def on_save(sender, instance, created, **kwargs):
+        if created:
+            transaction.on_commit(lambda: increment(name, 1))
+
+    def on_delete(sender, instance, **kwargs):
+        transaction.on_commit(lambda: increment(name, -1))
+
+    return on_save, on_delete
+
+
+# Global instance
+business_collector = BusinessMetricsCollector()
+
+_registered = False
+
+
+def register():
+    """Connect the counter receivers and register the collector (once)."""
+    global _registered
+    if _registered:
+        return
+    _registered = True
+    for name, (label, _metric, _doc) in TOTALS.items():
+        on_save, on_delete = _counter_receivers(name)
+        post_save.connect(on_save, sender=label, weak=False, dispatch_uid=f'metrics_total_save_{name}')
+        post_delete.connect(on_delete, sender=label, weak=False, dispatch_uid=f'metrics_total_delete_{name}')
+    REGISTRY.register(business_collector)
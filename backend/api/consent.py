@@ -0,0 +1,83 @@
+"""
+Signed visitor-ID / consent cookie.
+
+When a visitor grants analytics consent they receive a first-party cookie
+carrying a random visitor ID, the accepted consent version and the consent
+expiry, signed with django.core.signing (HMAC over SECRET_KEY). The
+tracking middleware only verifies the signature and expiry, so no session
+or database lookup is needed per request. A VisitorConsent row is written
+once, when consent is granted, as the audit record.
+"""
+import time
+import uuid
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core import signing
+
+COOKIE_SALT = 'api.consent.visitor'
+
+
+class ConsentToken(NamedTuple):
+    visitor_id: str
+    consent_version: str
+    expires_at: datetime
+
+
+def _cookie_name() -> str:
+    return getattr(settings, 'VISITOR_CONSENT_COOKIE_NAME', 'visitor_consent')
+
+
+def current_version() -> str:
+    return getattr(settings, 'VISITOR_CONSENT_VERSION', '1.0')
+
+
+def consent_days() -> int:
+    return getattr(settings, 'VISITOR_CONSENT_DAYS', 90)
+
+
+def read_consent(request) -> Optional[ConsentToken]:
+    """
+    Return the visitor's consent token, or None if the cookie is missing,
+    tampered with, expired or for an older consent version.
+    """
+    value = request.COOKIES.get(_cookie_name())
+    if not value:
+        return None
+    try:
+        payload = signing.loads(value, salt=COOKIE_SALT)
+        visitor_id, version, expires = payload['v'], payload['cv'], int(payload['exp'])
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
+    if expires <= time.time() or version != current_version():
+        return None
+    return ConsentToken(visitor_id, version, datetime.fromtimestamp(expires, tz=dt_timezone.utc))
+
+
+def issue_consent(response, visitor_id: str = None) -> ConsentToken:
+    """Sign a fresh consent token for ``visitor_id`` and set it on ``response``."""
+    token = ConsentToken(
+        visitor_id=visitor_id or uuid.uuid4().hex,
+        consent_version=current_version(),
+        expires_at=datetime.now(tz=dt_timezone.utc).replace(microsecond=0) + timedelta(days=consent_days()),
+    )
+    value = signing.dumps(
+        {'v': token.visitor_id, 'cv': token.consent_version, 'exp': int(token.expires_at.timestamp())},
+        salt=COOKIE_SALT,
+    )
+    response.set_cookie(
+        _cookie_name(),
+        value,
+        max_age=consent_days() * 86400,
+        httponly=True,
+        secure=not settings.DEBUG,
+        samesite='None' if not settings.DEBUG else 'Lax',
+    )
+    return token
+
+
+def clear_consent(response):
+    """Remove the consent cookie (consent declined or withdrawn)."""
+    response.delete_cookie(_cookie_name(), samesite='None' if not settings.DEBUG else 'Lax')
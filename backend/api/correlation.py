@@ -0,0 +1,222 @@
+"""
+Streaming correlation of security events into SecurityAlerts.
+
+SecurityLogger and MaliciousActivityDetector report each event here
+(failed/successful login, audited activity, detected threat). The event is
+counted in sliding windows keyed by IP or user, and a SecurityAlert is raised
+when a rule's threshold is crossed. The database is not read per event.
+
+Counters live in the default cache, so they are shared across workers on
+Redis and per-process on LocMem. Each window is estimated from two fixed
+buckets: the previous bucket's count is weighted by how much of it still
+overlaps the window. That costs one INCR and one GET per rule. Each alert
+level is raised at most once per rule, subject and window, claimed
+atomically with cache.add. This replaces the old "open alert with this
+evidence IP" query.
+"""
+import logging
+import time
+from typing import NamedTuple, Optional
+
+from django.core.cache import cache
+
+from .metrics import SECURITY_CORRELATION_ALERTS
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'corr'
+
+# Countries a user logged in from recently (for unusual_location)
+KNOWN_COUNTRIES_TTL = 30 * 86400
+
+
+class CorrelationRule(NamedTuple):
+    name: str
+    event: str      # login_failed, login_success, activity or threat
+    subject: str    # 'ip' or 'user'
+    window: int     # seconds
+    levels: tuple   # ((threshold, severity), ...) ascending
+    alert_type: str  # SecurityAlert.alert_type
+    title: str      # formatted with subject=, count=, minutes=
+    description: str
+    actions: tuple = ()  # activity actions counted (evidence action=); empty counts every event
+
+
+RULES = (
+    CorrelationRule(
+        'brute_force_ip', 'login_failed', 'ip', 300, ((5, 'medium'), (10, 'high')), 'brute_force',
+        'Brute force attack from {subject}',
+        '{count} failed login attempts from {subject} in {minutes} minutes',
+    ),
+    CorrelationRule(
+        'brute_force_user', 'login_failed', 'user', 900, ((10, 'high'),), 'brute_force',
+        'Repeated failed logins for {subject}',
+        '{count} failed login attempts for {subject} in {minutes} minutes',
+    ),
+    CorrelationRule(
+        'mass_api_requests', 'activity', 'user', 300, ((100, 'medium'),), 'mass_api_requests',
+        'Mass API requests by {subject}',
+        '{count} audited API requests by {subject} in {minutes} minutes',
+        actions=('api_request',),
+    ),
+    CorrelationRule(
+        'threat_burst', 'threat', 'ip', 600, ((10, 'high'), (50, 'critical')), 'custom',
+        'Repeated attack traffic from {subject}',
+        '{count} malicious requests from {subject} in {minutes} minutes',
+    ),
+)
+
+
+class SlidingWindowCounter:
+    """Approximate sliding-window event counts on top of the Django cache."""
+
+    def __init__(self, prefix=KEY_PREFIX):
+        self.prefix = prefix
+
+    def _keys(self, key, window, now):
+        bucket = int(now // window)
+        return (
+            f'{self.prefix}:{key}:{bucket}',
+            f'{self.prefix}:{key}:{bucket - 1}',
+            (now - bucket * window) / window,
+        )
+
+    def hit(self, key: str, window: int) -> int:
+        """Count one event and return the events in the last ``window`` seconds."""
+        now = time.time()
+        current_key, previous_key, elapsed = self._keys(key, window, now)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            # First event in this bucket; another worker may race us to it
+            if cache.add(current_key, 1, window * 2):
+                current = 1
+            else:
+                current = cache.incr(current_key)
+        previous = cache.get(previous_key, 0)
+        return int(previous * (1 - elapsed) + current)
+
+    def count(self, key: str, window: int) -> int:
+        """Events in the last ``window`` seconds, without counting one."""
+        current_key, previous_key, elapsed = self._keys(key, window, time.time())
+        values = cache.get_many([current_key, previous_key])
+        return int(values.get(previous_key, 0) * (1 - elapsed) + values.get(current_key, 0))
+
+
+class SecurityCorrelator:
+    """Applies CorrelationRules to reported events."""
+
+    def __init__(self, rules=RULES, counter=None):
+        self.rules = tuple(rules)
+        self.counter = counter or SlidingWindowCounter()
+        self._by_event = {}
+        for rule in self.rules:
+            self._by_event.setdefault(rule.event, []).append(rule)
+
+    def record(self, event: str, ip: Optional[str] = None, user=None, **evidence) -> list:
+        """
+        Count an event against every rule that consumes it.
+
+        Args:
+            event: login_failed, login_success, activity or threat
+            ip: Client IP, for IP-keyed rules
+            user: User, for user-keyed rules (None for anonymous events)
+            evidence: Extra detail stored on raised alerts
+
+        Returns:
+            list: SecurityAlerts raised by this event
+        """
+        raised = []
+        try:
+            if event == 'login_success' and user is not None:
+                alert = self._check_location(user, ip, evidence.get('country'))
+                if alert is not None:
+                    raised.append(alert)
+            for rule in self._by_event.get(event, ()):
+                alert = self._apply(rule, ip, user, evidence)
+                if alert is not None:
+                    raised.append(alert)
+        except Exception as e:
+            logger.error(f"Error correlating {event} event: {e}", exc_info=True)
+        return raised
+
+    def count(self, rule_name: str, subject) -> int:
+        """Current windowed count of a rule for an IP or user id."""
+        rule = next(r for r in self.rules if r.name == rule_name)
+        return self.counter.count(f'{rule.name}:{subject}', rule.window)
+
+    def is_unusual_location(self, user) -> bool:
+        """Whether the user's last successful login came from a new country."""
+        return bool(cache.get(f'{KEY_PREFIX}:unusual_location:{user.pk}'))
+
+    # ── internals ────────────────────────────────────────────────────
+
+    def _apply(self, rule, ip, user, evidence):
+        if rule.actions and evidence.get('action') not in rule.actions:
+            return None
+        if rule.subject == 'user':
+            if user is None:
+                return None
+            subject_id, subject_label = user.pk, user.email
+        else:
+            if not ip:
+                return None
+            subject_id = subject_label = ip
+
+        count = self.counter.hit(f'{rule.name}:{subject_id}', rule.window)
+        severity = None
+        for threshold, level in rule.levels:
+            if count >= threshold:
+                severity = level
+        if severity is None:
+            return None
+
+        # Raise each level once per window; escalation raises the next level
+        if not cache.add(f'{KEY_PREFIX}:alerted:{rule.name}:{subject_id}:{severity}', True, rule.window):
+            return None
+
+        minutes = rule.window // 60
+        return self._raise(
+            rule.name, rule.alert_type, severity,
+            rule.title.format(subject=subject_label, count=count, minutes=minutes),
+            rule.description.format(subject=subject_label, count=count, minutes=minutes),
+            user=user,
+            evidence={'ip': ip, 'count': count, 'window': rule.window, 'rule': rule.name, **evidence},
+        )
+
+    def _check_location(self, user, ip, country):
+        if not country:
+            return None
+        known_key = f'{KEY_PREFIX}:countries:{user.pk}'
+        known = cache.get(known_key) or set()
+        unusual = bool(known) and country not in known
+        cache.set(known_key, known | {country}, KNOWN_COUNTRIES_TTL)
+        cache.set(f'{KEY_PREFIX}:unusual_location:{user.pk}', unusual, KNOWN_COUNTRIES_TTL)
+        if not unusual:
+            return None
+        return self._raise(
+            'unusual_location', 'unusual_location', 'medium',
+            f"Login from unusual location for {user.email}",
+            f"{user.email} logged in from {country}; recent logins came from {', '.join(sorted(known))}",
+            user=user,
+            evidence={'ip': ip, 'country': country, 'known_countries': sorted(known)},
+        )
+
+    def _raise(self, rule_name, alert_type, severity, title, description, user=None, evidence=None):
+        from .models import SecurityAlert
+
+        alert = SecurityAlert.objects.create(
+            user=user,
+            alert_type=alert_type,
+            severity=severity,
+            title=title,
+            description=description,
+            evidence=evidence or {},
+        )
+        SECURITY_CORRELATION_ALERTS.labels(rule=rule_name, severity=severity).inc()
+        logger.warning(f"Security alert raised ({rule_name}, {severity}): {title}")
+        return alert
+
+
+# Global instance
+correlator = SecurityCorrelator()
@@ -145,6 +145,22 @@ class InternalServerError(APIException):
         )
 
 
+class ServiceUnavailableError(APIException):
+    """Server is shedding load; the client should retry after ``retry_after`` seconds"""
+    def __init__(self, message: str = 'The server is busy. Please try again shortly.', retry_after: int = 1):
+        self.retry_after = retry_after
+        super().__init__(
+            message,
+            code='SERVICE_UNAVAILABLE',
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+    def to_response(self) -> Response:
+        response = super().to_response()
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+
 # ============= Error Handling Decorators & Context Managers =============
 
 def handle_errors(
@@ -261,16 +277,19 @@ def safe_external_request(
     """
     Safely make external HTTP request with error handling
     
+    Uses the shared keep-alive client from api.outbound.
+
     Returns:
         Tuple of (success, data, error_message)
     """
-    import requests
+    import httpx
+    from .outbound import client
     
     try:
         if method.upper() == 'GET':
-            response = requests.get(url, timeout=timeout, **kwargs)
+            response = client().get(url, timeout=timeout, **kwargs)
         elif method.upper() == 'POST':
-            response = requests.post(url, timeout=timeout, **kwargs)
+            response = client().post(url, timeout=timeout, **kwargs)
         else:
             raise ValueError(f"Unsupported HTTP method: {method}")
         
@@ -281,11 +300,11 @@ def safe_external_request(
             logger.warning(f"External request to {url} failed: {error}")
             return False, None, error
             
-    except requests.Timeout:
+    except httpx.TimeoutException:
         error = f"Request timeout (>{timeout}s)"
         logger.error(f"External request to {url} timed out: {error}")
         return False, None, error
-    except requests.ConnectionError as e:
+    except httpx.NetworkError as e:
         error = f"Connection error: {str(e)}"
         logger.error(f"External request to {url} failed: {error}")
         return False, None, error
@@ -0,0 +1,153 @@
+"""
+Password hashing offloaded to a bounded process pool.
+
+Argon2/PBKDF2 are CPU-bound for tens to hundreds of milliseconds, and a
+burst of logins on gunicorn's worker threads would leave none free for other
+requests. Each worker process therefore hashes on a small pool of its own
+(PASSWORD_HASH_WORKERS processes, started lazily after fork) and caps the
+jobs in flight at PASSWORD_HASH_MAX_PENDING. Past the cap, or when a result
+takes longer than PASSWORD_HASH_TIMEOUT, the request is shed with
+ServiceUnavailableError (503 + Retry-After) instead of queueing behind the
+burst; per-IP limits on the auth views still answer 429 first.
+
+check_password() also upgrades hashes transparently: when the stored hash
+uses a non-default hasher (PBKDF2 after the switch to Argon2) or outdated
+parameters, a correct password is re-hashed with the current default and
+saved. PASSWORD_HASH_WORKERS=0 hashes inline in the calling thread.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from .error_handling import ServiceUnavailableError
+from .metrics import PASSWORD_HASH_DURATION, PASSWORD_HASH_SHED
+
+logger = logging.getLogger(__name__)
+
+
+# ── pool worker side (runs in the hashing processes) ─────────────────
+
+def _init_worker(password_hashers):
+    # Hashing needs PASSWORD_HASHERS only; avoid a full django.setup()
+    if not settings.configured:
+        settings.configure(PASSWORD_HASHERS=password_hashers)
+
+
+def _verify(password, encoded):
+    """Return (valid, must_update) for a stored hash."""
+    valid = hashers.check_password(password, encoded)
+    if not valid:
+        return False, False
+    preferred = hashers.get_hasher('default')
+    hasher = hashers.identify_hasher(encoded)
+    return True, hasher.algorithm != preferred.algorithm or preferred.must_update(encoded)
+
+
+def _make(password):
+    return hashers.make_password(password)
+
+
+# ── request side ─────────────────────────────────────────────────────
+
+class PasswordHashPool:
+    """Bounded process pool for password hashing (one per worker process)."""
+
+    def __init__(self, workers=1, max_pending=4, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # forkserver: gunicorn workers are threaded, and fork()
+                    # from a threaded process can deadlock the child
+                    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(method),
+                        initializer=_init_worker,
+                        initargs=(list(settings.PASSWORD_HASHERS),),
+                    )
+        return self._executor
+
+    def run(self, operation: str, fn, *args):
+        """
+        Run ``fn(*args)`` on the pool and wait for the result.
+
+        Raises:
+            ServiceUnavailableError: too many hashes in flight, or the result
+                did not arrive within ``timeout``
+        """
+        with PASSWORD_HASH_DURATION.labels(operation=operation).time():
+            if self.workers <= 0:
+                return fn(*args)
+            if not self._slots.acquire(blocking=False):
+                PASSWORD_HASH_SHED.labels(reason='queue_full').inc()
+                raise ServiceUnavailableError(retry_after=1)
+            try:
+                future = self.executor.submit(fn, *args)
+                future.add_done_callback(lambda _: self._slots.release())
+            except Exception:
+                self._slots.release()
+                raise
+            try:
+                return future.result(timeout=self.timeout)
+            except FutureTimeout:
+                PASSWORD_HASH_SHED.labels(reason='timeout').inc()
+                logger.warning(f"Password {operation} exceeded {self.timeout}s; shedding request")
+                raise ServiceUnavailableError(retry_after=max(1, int(self.timeout)))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Global instance
+pool = PasswordHashPool(
+    workers=getattr(settings, 'PASSWORD_HASH_WORKERS', 1),
+    max_pending=getattr(settings, 'PASSWORD_HASH_MAX_PENDING', 4),
+    timeout=getattr(settings, 'PASSWORD_HASH_TIMEOUT', 10.0),
+)
+
+
+def make_password(password) -> str:
+    """Hash a password with the default hasher on the pool."""
+    return pool.run('make', _make, password)
+
+
+def set_password(user, password):
+    """user.set_password() with the hashing done on the pool (caller saves)."""
+    user.password = make_password(password)
+    # Lets password validators see the change on save, as set_password does
+    user._password = password
+
+
+def check_password(user, password) -> bool:
+    """
+    user.check_password() with the hashing done on the pool. A correct
+    password stored with an outdated hasher is re-hashed and saved.
+    """
+    if not user.has_usable_password():
+        return False
+    valid, must_update = pool.run('check', _verify, password, user.password)
+    if valid and must_update:
+        try:
+            set_password(user, password)
+            user.save(update_fields=['password'])
+            logger.info(f"Upgraded password hash for user {user.pk} to {hashers.get_hasher('default').algorithm}")
+        except ServiceUnavailableError:
+            # The login itself succeeded; upgrade on a later one
+            pass
+    return valid
@@ -0,0 +1,238 @@
+"""
+Local verification of Google ID tokens against a cached JWKS.
+
+A Google ID token is an RS256-signed JWT. It is checked here, without calling
+Google, for its signature, ``iss``, ``aud``, ``exp``/``iat`` and email
+verification. The caller (api.oauth) checks the ``nonce`` against OAuthState.
+
+Google's signing keys (GOOGLE_JWKS_URL) are cached at two levels:
+
+- per process, in memory, so the common sign-in makes no network call and
+  no cache round trip;
+- in the default cache, shared by every worker, for as long as Google's
+  Cache-Control max-age allows.
+
+A refresh is single-flight. Within a process, concurrent verifications on
+the same event loop await one fetch. Across workers, a cache.add lock elects
+one fetcher and the others wait briefly for the keys it publishes. The
+shared cache is used through its async methods (aget, aadd, aset,
+adelete), so a Redis round trip does not block the event loop. An
+unknown ``kid`` (key rotation) forces a refresh at most once per
+FORCED_REFRESH_INTERVAL, so made-up key ids cannot be used to hammer Google.
+If a refresh fails, keys past their max-age are still used.
+"""
+import asyncio
+import base64
+import json
+import logging
+import re
+import time
+import weakref
+from typing import Optional
+
+import httpx
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+JWKS_CACHE_KEY = 'oauth:google:jwks'
+JWKS_LOCK_KEY = 'oauth:google:jwks:lock'
+
+# Bounds on the Cache-Control max-age honored for the key set (seconds)
+MIN_JWKS_TTL = 60
+MAX_JWKS_TTL = 86400
+DEFAULT_JWKS_TTL = 3600
+FORCED_REFRESH_INTERVAL = 60
+
+# How long a worker that lost the refresh lock waits for the winner's keys
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class InvalidIDToken(ValueError):
+    """The token is malformed, badly signed, expired or not for us."""
+
+
+def looks_like_jwt(token: str) -> bool:
+    """ID tokens are JWTs; access tokens are opaque strings."""
+    return token.count('.') == 2
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _b64int(segment: str) -> int:
+    return int.from_bytes(_b64decode(segment), 'big')
+
+
+def _ttl(cache_control: str) -> int:
+    match = _MAX_AGE_RE.search(cache_control or '')
+    ttl = int(match.group(1)) if match else DEFAULT_JWKS_TTL
+    return max(MIN_JWKS_TTL, min(MAX_JWKS_TTL, ttl))
+
+
+def parse_jwks(jwks: dict) -> dict:
+    """{kid: RSAPublicKey} for the RS256 signing keys in a JWK set."""
+    keys = {}
+    for jwk in jwks.get('keys', []):
+        if jwk.get('kty') != 'RSA' or jwk.get('alg', 'RS256') != 'RS256' or jwk.get('use', 'sig') != 'sig':
+            continue
+        try:
+            keys[jwk['kid']] = rsa.RSAPublicNumbers(_b64int(jwk['e']), _b64int(jwk['n'])).public_key()
+        except (KeyError, ValueError) as e:
+            logger.warning(f"Skipping unusable JWK {jwk.get('kid')!r}: {e}")
+    return keys
+
+
+class GoogleKeySet:
+    """Google's ID-token signing keys, cached in memory and in the default cache."""
+
+    def __init__(self, url: Optional[str] = None):
+        self._url = url
+        self._keys = {}          # kid -> RSAPublicKey
+        self._expires_at = 0.0   # time.time() when the keys go stale
+        self._last_forced = 0.0
+        self._inflight = weakref.WeakKeyDictionary()  # event loop -> refresh task
+
+    @property
+    def url(self) -> str:
+        return self._url or settings.GOOGLE_JWKS_URL
+
+    async def get(self, kid: str):
+        """The public key for ``kid``, refreshing the set if needed."""
+        now = time.time()
+        if now >= self._expires_at or not self._keys:
+            await self.refresh()
+        key = self._keys.get(kid)
+        if key is None and now - self._last_forced >= FORCED_REFRESH_INTERVAL:
+            # Google rotated its keys before our copy expired
+            self._last_forced = now
+            await self.refresh(force=True)
+            key = self._keys.get(kid)
+        if key is None:
+            raise InvalidIDToken(f'unknown signing key {kid!r}')
+        return key
+
+    async def refresh(self, force: bool = False):
+        """Reload the keys: one fetch per event loop at a time."""
+        loop = asyncio.get_running_loop()
+        task = self._inflight.get(loop)
+        if task is None or task.done():
+            task = loop.create_task(self._refresh(force))
+            self._inflight[loop] = task
+        await asyncio.shield(task)
+
+    async def _refresh(self, force):
+        # A forced refresh only accepts keys fetched after ours
+        newer_than = self._expires_at if force else 0
+        if await self._load_shared(newer_than):
+            return
+        if await cache.aadd(JWKS_LOCK_KEY, True, LOCK_TIMEOUT):
+            try:
+                await self._fetch()
+            finally:
+                await cache.adelete(JWKS_LOCK_KEY)
+            return
+        # Another worker is fetching; use its result if it lands soon
+        deadline = time.time() + LOCK_WAIT
+        while time.time() < deadline:
+            await asyncio.sleep(0.05)
+            if await self._load_shared(newer_than):
+                return
+        await self._fetch()
+
+    async def _load_shared(self, newer_than: float = 0) -> bool:
+        entry = await cache.aget(JWKS_CACHE_KEY)
+        if not entry or entry['expires_at'] <= max(time.time(), newer_than):
+            return False
+        keys = parse_jwks(entry['jwks'])
+        if not keys:
+            return False
+        self._keys, self._expires_at = keys, entry['expires_at']
+        return True
+
+    async def _fetch(self):
+        from .outbound import async_client
+
+        try:
+            response = await async_client().get(self.url)
+            response.raise_for_status()
+            jwks = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            if self._keys:
+                logger.warning(f"Google JWKS refresh failed, keeping cached keys: {e}")
+                self._expires_at = time.time() + MIN_JWKS_TTL
+                return
+            raise InvalidIDToken(f'signing keys unavailable: {e}') from e
+
+        keys = parse_jwks(jwks)
+        if not keys:
+            raise InvalidIDToken('no usable signing keys in JWKS')
+        ttl = _ttl(response.headers.get('cache-control', ''))
+        expires_at = time.time() + ttl
+        await cache.aset(JWKS_CACHE_KEY, {'jwks': jwks, 'expires_at': expires_at}, ttl)
+        self._keys, self._expires_at = keys, expires_at
+        logger.info(f"Loaded {len(keys)} Google signing keys (max-age {ttl}s)")
+
+
+async def verify_google_id_token(token: str, client_id: str, key_set: Optional[GoogleKeySet] = None) -> dict:
+    """
+    Verify a Google ID token locally and return its claims.
+
+    Raises:
+        InvalidIDToken: bad format, algorithm or signature, wrong issuer or
+            audience, expired, or an unverified email
+    """
+    try:
+        header_b64, payload_b64, signature_b64 = token.split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except ValueError as e:
+        raise InvalidIDToken(f'malformed token: {e}') from e
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise InvalidIDToken('malformed token')
+
+    if header.get('alg') != 'RS256':
+        raise InvalidIDToken(f"unsupported algorithm {header.get('alg')!r}")
+
+    key = await (key_set or google_keys).get(header.get('kid'))
+    try:
+        key.verify(
+            signature, f'{header_b64}.{payload_b64}'.encode('ascii'),
+            padding.PKCS1v15(), hashes.SHA256(),
+        )
+    except (InvalidSignature, UnicodeEncodeError) as e:
+        raise InvalidIDToken('bad signature') from e
+
+    leeway = getattr(settings, 'GOOGLE_ID_TOKEN_LEEWAY', 60)
+    now = time.time()
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise InvalidIDToken(f"unexpected issuer {claims.get('iss')!r}")
+    if claims.get('aud') != client_id:
+        raise InvalidIDToken(f"audience mismatch: token_aud={claims.get('aud')!r}")
+    try:
+        expires, issued = float(claims['exp']), float(claims.get('iat', now))
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidIDToken('missing or invalid exp/iat') from e
+    if expires + leeway < now:
+        raise InvalidIDToken('token expired')
+    if issued - leeway > now:
+        raise InvalidIDToken('token issued in the future')
+    # Accounts are matched by email, so only a Google-verified one counts
+    if claims.get('email') and claims.get('email_verified') not in (True, 'true'):
+        raise InvalidIDToken('email not verified by Google')
+    return claims
+
+
+# Global instance
+google_keys = GoogleKeySet()
@@ -9,8 +9,12 @@ This should be run as a scheduled task (e.g., via celery beat or cron):
 """
 
 from django.core.management.base import BaseCommand
+from datetime import timedelta
+
 from django.utils import timezone
-from api.models import Visitor, VisitorConsent
+from api.models import UniqueVisitorSketch, Visitor, VisitorConsent, VisitorSession
+from api.partitioning import delete_in_batches, purge_before
+from api.tracking import RETENTION_DAYS
 
 
 class Command(BaseCommand):
@@ -39,6 +43,18 @@ class Command(BaseCommand):
         )
         consent_count = expired_consents.count()
         
+        # Count sessions whose last visit is past the retention window
+        expired_sessions = VisitorSession.objects.filter(
+            last_seen__lte=now - timedelta(days=RETENTION_DAYS)
+        )
+        session_count = expired_sessions.count()
+        
+        # Count unique-visitor sketches for days past the retention window
+        expired_sketches = UniqueVisitorSketch.objects.filter(
+            date__lte=(now - timedelta(days=RETENTION_DAYS)).date()
+        )
+        sketch_count = expired_sketches.count()
+        
         if dry_run:
             self.stdout.write(
                 self.style.WARNING(
@@ -50,14 +66,28 @@ class Command(BaseCommand):
                     f'DRY RUN: Would delete {consent_count} expired consent records'
                 )
             )
+            self.stdout.write(
+                self.style.WARNING(
+                    f'DRY RUN: Would delete {session_count} expired session records'
+                )
+            )
+            self.stdout.write(
+                self.style.WARNING(
+                    f'DRY RUN: Would delete {sketch_count} expired unique-visitor sketches'
+                )
+            )
             return
         
-        # Delete expired visitor records
+        # Delete expired visitor records: whole monthly partitions are
+        # dropped on PostgreSQL, the rest is deleted in small batches
         if visitor_count > 0:
-            expired_visitors.delete()
+            result = purge_before(
+                Visitor, now - timedelta(days=RETENTION_DAYS), queryset=expired_visitors
+            )
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'✓ Deleted {visitor_count} expired visitor records'
+                    f'✓ Deleted {visitor_count} expired visitor records '
+                    f"({len(result['partitions'])} partitions dropped)"
                 )
             )
         else:
@@ -65,7 +95,7 @@ class Command(BaseCommand):
         
         # Delete expired consents
         if consent_count > 0:
-            expired_consents.delete()
+            delete_in_batches(expired_consents)
             self.stdout.write(
                 self.style.SUCCESS(
                     f'✓ Deleted {consent_count} expired consent records'
@@ -74,6 +104,28 @@ class Command(BaseCommand):
         else:
             self.stdout.write('No expired consent records to delete')
         
+        # Delete expired sessions
+        if session_count > 0:
+            delete_in_batches(expired_sessions)
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'✓ Deleted {session_count} expired session records'
+                )
+            )
+        else:
+            self.stdout.write('No expired session records to delete')
+        
+        # Delete expired sketches
+        if sketch_count > 0:
+            expired_sketches.delete()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'✓ Deleted {sketch_count} expired unique-visitor sketches'
+                )
+            )
+        else:
+            self.stdout.write('No expired unique-visitor sketches to delete')
+        
         self.stdout.write(
             self.style.SUCCESS(
                 '✓ GDPR cleanup completed successfully'
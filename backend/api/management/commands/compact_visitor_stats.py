@@ -0,0 +1,56 @@
+"""
+Management command to rebuild the daily visitor rollups and unique-visitor
+sketches from raw Visitor rows.
+
+The visitor buffer keeps the rollups up to date incrementally; run this to
+backfill history after deploying the rollup tables or to correct drift.
+
+Usage:
+    python manage.py compact_visitor_stats              # last 2 days
+    python manage.py compact_visitor_stats --days 90    # full retention window
+    python manage.py compact_visitor_stats --date 2026-03-01
+
+Schedule: 30 2 * * * python manage.py compact_visitor_stats
+"""
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.analytics import rebuild_rollups
+from api.uniques import rebuild_sketches
+
+
+class Command(BaseCommand):
+    help = 'Rebuild VisitorDailyStats/VisitorDailyBreakdown and unique-visitor sketches from the Visitor table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=2,
+            help='Number of days to rebuild, ending today (default: 2)',
+        )
+        parser.add_argument(
+            '--date',
+            help='Rebuild a single day (YYYY-MM-DD)',
+        )
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                days = [date.fromisoformat(options['date'])]
+            except ValueError:
+                raise CommandError(f"Invalid date: {options['date']}")
+        else:
+            today = timezone.now().date()
+            days = [today - timedelta(days=i) for i in range(options['days'])]
+
+        for day in sorted(days):
+            stats = rebuild_rollups(day)
+            rebuild_sketches(day)
+            self.stdout.write(f'  {day}: {stats.visits} visits, {stats.unique_visitors} unique, {stats.sessions} sessions')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ Rebuilt visitor rollups for {len(days)} day(s)')
+        )
@@ -0,0 +1,217 @@
+"""
+Management command comparing the WSGI and ASGI serving modes under load.
+
+For each SERVER_MODE it starts gunicorn with gunicorn.conf.py on a free local
+port, then keeps ``--concurrency`` Google sign-ins in flight against
+/api/auth/social/ for ``--duration`` seconds. The sign-ins carry opaque
+access tokens, the kind that still needs Google's userinfo endpoint (ID
+tokens are verified locally). Google is replaced by a local stand-in that
+rejects every token after ``--upstream-latency`` ms. Every sign-in is
+therefore one provider round trip followed by a 400 and no database writes,
+which isolates how many waiting requests a worker can hold. Expect WSGI
+throughput to cap at workers x threads / latency, and ASGI throughput to
+grow with concurrency.
+
+The servers run with --server-settings (dev by default, where
+ratelimit_or_exempt is off), so the per-IP sign-in limit does not cut the
+run short.
+
+Usage: python manage.py loadtest [--modes wsgi asgi] [--concurrency 50] [--duration 10]
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+CLIENT_ID = 'loadtest-client.apps.googleusercontent.com'
+# What userinfo answers for an invalid access token
+REJECTION = json.dumps({'error': 'invalid_request', 'error_description': 'Invalid Credentials'}).encode()
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class StandInGoogle:
+    """Minimal keep-alive HTTP server rejecting every request after a delay."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.port = _free_port()
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loadtest-upstream', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(5)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(asyncio.start_server(self._serve, '127.0.0.1', self.port))
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _serve(self, reader, writer):
+        try:
+            while await reader.readuntil(b'\r\n\r\n'):
+                await asyncio.sleep(self.latency)
+                writer.write(
+                    b'HTTP/1.1 401 Unauthorized\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: %d\r\n\r\n%s' % (len(REJECTION), REJECTION)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+async def _drive(base_url, concurrency, duration):
+    """Keep ``concurrency`` sign-ins in flight; return (latencies, statuses, elapsed)."""
+    latencies, statuses = [], Counter()
+    body = {'provider': 'google', 'provider_token': 'loadtest-token'}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        deadline = start + duration
+
+        async def user():
+            while time.perf_counter() < deadline:
+                sent = time.perf_counter()
+                try:
+                    response = await client.post('/api/auth/social/', json=body)
+                    statuses[response.status_code] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                    continue
+                latencies.append(time.perf_counter() - sent)
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return sorted(latencies), statuses, elapsed
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent sign-in capacity of the WSGI and ASGI gunicorn modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+        parser.add_argument('--concurrency', type=int, default=50, help='Sign-ins kept in flight')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode')
+        parser.add_argument('--upstream-latency', type=float, default=200.0, help='Stand-in Google latency (ms)')
+        parser.add_argument('--workers', type=int, default=1, help='gunicorn workers per mode')
+        parser.add_argument(
+            '--server-settings', default='portfolio.settings.dev', help='DJANGO_SETTINGS_MODULE for the servers'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] <= 0 or options['duration'] <= 0 or options['workers'] <= 0:
+            raise CommandError('--concurrency, --duration and --workers must be positive')
+
+        upstream = StandInGoogle(options['upstream_latency'] / 1000).start()
+        self.stdout.write(
+            f"{options['concurrency']} concurrent sign-ins for {options['duration']:g}s per mode, "
+            f"{options['workers']} worker(s), upstream latency {options['upstream_latency']:g} ms"
+        )
+        results = {}
+        try:
+            for mode in options['modes']:
+                results[mode] = self._run_mode(mode, upstream, options)
+        finally:
+            upstream.stop()
+
+        baseline = next(iter(results.values()))['rate']
+        for mode, result in results.items():
+            speedup = result['rate'] / baseline if baseline else float('inf')
+            failed = sum(n for status, n in result['statuses'].items() if status != 400)
+            self.stdout.write(
+                f"  {mode:<5} {result['rate']:10.1f} req/s  p50 {result['p50'] * 1e3:8.1f} ms  "
+                f"p95 {result['p95'] * 1e3:8.1f} ms  p99 {result['p99'] * 1e3:8.1f} ms  "
+                f"{failed:6d} failed  ({speedup:.1f}x)"
+            )
+            if failed:
+                self.stdout.write(f"        statuses: {dict(result['statuses'])}")
+        self.stdout.write(self.style.SUCCESS('✓ Load test complete'))
+
+    def _run_mode(self, mode, upstream, options):
+        port = _free_port()
+        upstream_url = f'http://127.0.0.1:{upstream.port}'
+        env = {
+            **os.environ,
+            'SERVER_MODE': mode,
+            'DJANGO_SETTINGS_MODULE': options['server_settings'],
+            'GOOGLE_OAUTH2_CLIENT_ID': CLIENT_ID,
+            'GOOGLE_USERINFO_URL': f'{upstream_url}/userinfo',
+            # on_starting() empties this directory; keep clear of a live server's
+            'PROMETHEUS_MULTIPROC_DIR': tempfile.mkdtemp(prefix='loadtest-metrics-'),
+        }
+        log = tempfile.NamedTemporaryFile(prefix=f'loadtest-{mode}-', suffix='.log', delete=False)
+        server = subprocess.Popen(
+            [
+                sys.executable, '-m', 'gunicorn', '-c', str(settings.BASE_DIR / 'gunicorn.conf.py'),
+                '-b', f'127.0.0.1:{port}', '-w', str(options['workers']), '--access-logfile', '/dev/null',
+            ],
+            cwd=settings.BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            self._wait_until_up(server, base_url, log.name)
+            # Warm up: imports, DB connections, keep-alive to the upstream
+            asyncio.run(_drive(base_url, min(options['concurrency'], 4), 1.0))
+            latencies, statuses, elapsed = asyncio.run(
+                _drive(base_url, options['concurrency'], options['duration'])
+            )
+        finally:
+            server.terminate()
+            try:
+                server.wait(30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            log.close()
+
+        return {
+            'rate': len(latencies) / elapsed,
+            'p50': _percentile(latencies, 0.50),
+            'p95': _percentile(latencies, 0.95),
+            'p99': _percentile(latencies, 0.99),
+            'statuses': statuses,
+        }
+
+    @staticmethod
+    def _wait_until_up(server, base_url, log_path, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited with {server.returncode}; see {log_path}')
+            try:
+                if httpx.get(f'{base_url}/health/', timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise CommandError(f'gunicorn did not answer /health/ within {timeout}s; see {log_path}')
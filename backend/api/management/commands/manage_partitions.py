@@ -0,0 +1,76 @@
+"""
+Management command to maintain the monthly partitions of the event tables
+(Visitor, ActivityLog, LoginActivity) on PostgreSQL.
+
+Creates the partitions for the current and upcoming months so inserts never
+fall into the default partition. With --purge it also drops ActivityLog and
+LoginActivity rows past ACTIVITY_LOG_RETENTION_DAYS /
+LOGIN_ACTIVITY_RETENTION_DAYS. Both are unset by default, and then the
+audit trail is kept. Visitor retention is applied by
+cleanup_expired_visitors.
+
+Usage:
+    python manage.py manage_partitions                    # current + 3 months
+    python manage.py manage_partitions --months-ahead 6
+    python manage.py manage_partitions --purge
+
+Runs with --purge on every deploy (entrypoint.sh for Docker/Railway, the
+start command in render.yaml). Between deploys:
+Schedule: 0 1 * * * python manage.py manage_partitions --purge
+"""
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.partitioning import PARTITIONED_MODELS, ensure_partitions, is_supported, purge_before
+
+
+class Command(BaseCommand):
+    help = 'Pre-create monthly partitions for the event tables and drop expired ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead',
+            type=int,
+            default=3,
+            help='Number of upcoming months to create partitions for (default: 3)',
+        )
+        parser.add_argument(
+            '--purge',
+            action='store_true',
+            help='Drop ActivityLog/LoginActivity data older than their retention, if one is set',
+        )
+
+    def handle(self, *args, **options):
+        models = [apps.get_model(label) for label in PARTITIONED_MODELS]
+
+        if is_supported():
+            names = ensure_partitions(models, months_ahead=options['months_ahead'])
+            self.stdout.write(
+                self.style.SUCCESS(f'✓ {len(names)} monthly partitions present')
+            )
+        else:
+            self.stdout.write('Database does not support partitioning; skipping partition creation')
+
+        if not options['purge']:
+            return
+
+        now = timezone.now()
+        retention = {
+            'api.ActivityLog': getattr(settings, 'ACTIVITY_LOG_RETENTION_DAYS', 0),
+            'api.LoginActivity': getattr(settings, 'LOGIN_ACTIVITY_RETENTION_DAYS', 0),
+        }
+        for label, days in retention.items():
+            if days <= 0:
+                self.stdout.write(f'{label}: no retention configured; keeping all rows')
+                continue
+            result = purge_before(apps.get_model(label), now - timedelta(days=days))
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"✓ {label}: dropped {len(result['partitions'])} partitions, "
+                    f"deleted {result['rows']} rows older than {days} days"
+                )
+            )
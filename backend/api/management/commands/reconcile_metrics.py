@@ -0,0 +1,24 @@
+"""
+Management command to reconcile the Prometheus business counters.
+
+The counters behind django_projects_count, django_likes_count, etc. are
+adjusted by signals as rows change; this recounts them exactly (bulk
+operations bypass signals) and refreshes the unique-visitor, bounce-rate
+and session-duration gauges. Scrapes never run these queries themselves.
+
+Usage: python manage.py reconcile_metrics
+Schedule: */10 * * * * python manage.py reconcile_metrics
+"""
+from django.core.management.base import BaseCommand
+
+from api.collectors import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recount the Prometheus business counters and refresh derived visitor gauges'
+
+    def handle(self, *args, **options):
+        values = reconcile()
+        for name, value in values.items():
+            self.stdout.write(f'  {name}: {value}')
+        self.stdout.write(self.style.SUCCESS('✓ Metrics counters reconciled'))
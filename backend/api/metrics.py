@@ -5,6 +5,9 @@ from django.http import HttpResponse, HttpResponseForbidden
 from django.core.cache import cache
 from prometheus_client import (
     generate_latest,
+    multiprocess,
+    CollectorRegistry,
+    REGISTRY,
     Counter,
     Histogram,
     Gauge,
@@ -13,9 +16,9 @@ from prometheus_client import (
 from django.conf import settings
 import time
 import os
-import ipaddress
 import logging
-from django.db import models
+
+from .networks import is_metrics_allowed, is_trusted_proxy
 
 logger = logging.getLogger(__name__)
 
@@ -23,92 +26,176 @@ logger = logging.getLogger(__name__)
 METRICS_CACHE_KEY = 'prometheus_metrics_data'
 METRICS_CACHE_TTL = 300  # Cache metrics for 5 minutes (typical Prometheus scrape interval)
 
-# Request metrics
+# Under gunicorn every worker has its own registry, so gunicorn.conf.py sets
+# PROMETHEUS_MULTIPROC_DIR: each process then writes its samples to mmap'd
+# files there and metrics_view merges them. Gauges declare how the per-worker
+# values combine (multiprocess_mode); set_function gauges are not supported.
+
+
+def multiprocess_dir():
+    """Shared metrics directory when running in multiprocess mode, else None."""
+    return os.environ.get('PROMETHEUS_MULTIPROC_DIR') or None
+
+
+# Request metrics, labelled by URL route template (e.g. api/projects/<slug:slug>/)
+# rather than the raw path so series stay bounded; unresolved URLs share
+# the UNMATCHED_ROUTE label
+UNMATCHED_ROUTE = 'unmatched'
+
 REQUEST_COUNT = Counter(
     'django_http_requests_total',
     'Total HTTP requests',
-    ['method', 'path', 'status']
+    ['method', 'route', 'status']
 )
 
 REQUEST_DURATION = Histogram(
     'django_http_request_duration_seconds',
     'HTTP request duration',
-    ['method', 'path']
+    ['method', 'route']
 )
 
-# Database metrics
+RESPONSE_SIZE = Histogram(
+    'django_http_response_size_bytes',
+    'HTTP response body size',
+    ['method', 'route'],
+    buckets=(100, 1000, 10000, 50000, 100000, 500000, 1000000, 5000000, float('inf'))
+)
+
+REQUEST_DB_QUERIES = Histogram(
+    'django_http_request_db_queries',
+    'Database queries executed per HTTP request',
+    ['method', 'route'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, float('inf'))
+)
+
+REQUEST_DB_DURATION = Histogram(
+    'django_http_request_db_duration_seconds',
+    'Total database time per HTTP request',
+    ['method', 'route']
+)
+
+# Database metrics, recorded per request by api.middleware.QueryRecorder;
+# operation is SELECT, INSERT, UPDATE, DELETE or OTHER
 DB_QUERY_COUNT = Counter(
     'django_db_queries_total',
     'Total database queries',
-    ['operation']
+    ['route', 'operation']
 )
 
-# Custom metrics
-PROJECT_COUNT = Gauge(
-    'django_projects_count',
-    'Number of projects'
+DB_QUERY_DURATION = Histogram(
+    'django_db_query_duration_seconds',
+    'Database query duration',
+    ['route', 'operation'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, float('inf'))
 )
 
-MEDIA_COUNT = Gauge(
-    'django_media_count',
-    'Number of media items'
+# Business gauges (projects, media, users, likes, visitors) are exposed by
+# api.collectors.BusinessMetricsCollector, registered in ApiConfig.ready().
+
+
+# Buffered write pipeline metrics (api.buffering)
+WRITE_BUFFER_DEPTH = Gauge(
+    'django_write_buffer_queue_depth',
+    'Records waiting in an in-process write buffer',
+    ['buffer'],
+    multiprocess_mode='livesum'
+)
+
+WRITE_BUFFER_FLUSH_DURATION = Histogram(
+    'django_write_buffer_flush_duration_seconds',
+    'Time spent writing one batch from a write buffer',
+    ['buffer']
+)
+
+WRITE_BUFFER_WRITTEN = Counter(
+    'django_write_buffer_records_written_total',
+    'Records handed to the database by a write buffer',
+    ['buffer']
+)
+
+WRITE_BUFFER_DROPPED = Counter(
+    'django_write_buffer_records_dropped_total',
+    'Records dropped because a write buffer was full',
+    ['buffer']
 )
 
-USER_COUNT = Gauge(
-    'django_users_count',
-    'Number of users'
+# Rate limiter decisions (api.ratelimit); policy is a view name, throttle
+# scope or 'detector', decision is allowed or denied
+RATE_LIMIT_DECISIONS = Counter(
+    'django_ratelimit_decisions_total',
+    'Rate limiter decisions',
+    ['policy', 'decision']
 )
 
-LIKE_COUNT = Gauge(
-    'django_likes_count',
-    'Number of likes'
+# Security alert dispatch (api.alerts); outcome is queued (new aggregate),
+# coalesced, sent, suppressed (over budget) or dropped (too many pending)
+SECURITY_ALERTS = Counter(
+    'django_security_alerts_total',
+    'Security alerts by dispatch outcome',
+    ['outcome']
 )
 
-# Visitor metrics
-VISITOR_COUNT = Gauge(
-    'django_visitors_count',
-    'Number of visitors'
+# Password hashing on the process pool (api.hashing); operation is check or
+# make, reason is queue_full or timeout
+PASSWORD_HASH_DURATION = Histogram(
+    'django_password_hash_duration_seconds',
+    'Password hash time including pool queueing',
+    ['operation'],
+    buckets=(.01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, float('inf'))
 )
 
-UNIQUE_VISITOR_COUNT = Gauge(
-    'django_unique_visitors_count',
-    'Number of unique visitors'
+PASSWORD_HASH_SHED = Counter(
+    'django_password_hash_shed_total',
+    'Password hash requests rejected with 503',
+    ['reason']
 )
 
-PAGE_VIEW_COUNT = Gauge(
-    'django_page_views_count',
-    'Number of page views'
+# SecurityAlerts raised by the event correlator (api.correlation)
+SECURITY_CORRELATION_ALERTS = Counter(
+    'django_security_correlation_alerts_total',
+    'Security alerts raised by correlation rules',
+    ['rule', 'severity']
 )
 
-BOUNCE_RATE = Gauge(
-    'django_bounce_rate',
-    'Bounce rate percentage'
+# Threat scans cut short by MaliciousActivityDetector (api.security); reason
+# is field_length (value truncated) or time_budget (fields skipped)
+SECURITY_SCAN_LIMITED = Counter(
+    'django_security_scan_limited_total',
+    'Threat scans truncated by the field length cap or time budget',
+    ['reason']
 )
 
-# Visitor distribution metrics
-DEVICE_TYPE_COUNT = Gauge(
-    'django_visitors_by_device',
-    'Number of visitors by device type',
-    ['device_type']
+# User-agent LRU caches (api.user_agent); stat is hits, misses, size or
+# maxsize, summed over live worker processes
+USER_AGENT_CACHE = Gauge(
+    'django_user_agent_cache',
+    'User-agent memoization cache statistics',
+    ['cache', 'stat'],
+    multiprocess_mode='livesum'
 )
 
-BROWSER_COUNT = Gauge(
-    'django_visitors_by_browser',
-    'Number of visitors by browser',
-    ['browser']
+# Outbound HTTP through the shared clients (api.outbound); client is oauth,
+# default or cloudinary, outcome is the status class (2xx..5xx), timeout or
+# error. Pool state is active (in use), idle (kept alive) or max, summed
+# over live worker processes.
+OUTBOUND_HTTP_REQUESTS = Counter(
+    'django_outbound_http_requests_total',
+    'Outbound HTTP requests made through the shared clients',
+    ['client', 'host', 'outcome']
 )
 
-OS_COUNT = Gauge(
-    'django_visitors_by_os',
-    'Number of visitors by operating system',
-    ['os']
+OUTBOUND_HTTP_DURATION = Histogram(
+    'django_outbound_http_request_duration_seconds',
+    'Outbound HTTP request latency, headers received',
+    ['client', 'host'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
 )
 
-# Page popularity metrics
-PAGE_VIEWS = Gauge(
-    'django_page_views',
-    'Number of views per page',
-    ['path']
+OUTBOUND_HTTP_POOL = Gauge(
+    'django_outbound_http_pool_connections',
+    'Connections in the shared outbound HTTP pools',
+    ['client', 'state'],
+    multiprocess_mode='livesum'
 )
 
 
@@ -126,19 +213,19 @@ def _get_client_ip(request):
     
     # Check if request comes from a trusted proxy
     # In Docker/Kubernetes, internal proxies typically use private IP ranges
-    if _is_trusted_proxy(remote_addr):
-        # Check X-Forwarded-For header
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR', '')
-        if x_forwarded_for:
-            # X-Forwarded-For format: client, proxy1, proxy2, ...
-            # Take the first (leftmost) IP which is the original client
-            ips = [ip.strip() for ip in x_forwarded_for.split(',')]
-            if ips:
-                return ips[0]
+    if not _is_trusted_proxy(remote_addr):
+        return remote_addr
+
+    # Check X-Forwarded-For header
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    if x_forwarded_for:
+        # X-Forwarded-For format: client, proxy1, proxy2, ...
+        # Take the first (leftmost) IP which is the original client
+        return x_forwarded_for.split(',', 1)[0].strip()
     
     # Also check X-Real-IP header (used by nginx)
     x_real_ip = request.META.get('HTTP_X_REAL_IP', '')
-    if x_real_ip and _is_trusted_proxy(remote_addr):
+    if x_real_ip:
         return x_real_ip
     
     return remote_addr
@@ -147,109 +234,30 @@ def _get_client_ip(request):
 def _is_trusted_proxy(ip: str) -> bool:
     """
     Check if the IP is a trusted proxy (internal load balancer, nginx, etc.)
-    Uses the same IP ranges as metrics allowed IPs.
+
+    Ranges come from TRUSTED_PROXY_IPS, precompiled by api.networks.
     """
-    if not ip:
-        return False
-    
-    # Trusted proxies are typically internal Docker/K8s networks
-    # Same ranges as allowed for metrics access
-    trusted_proxy_ranges = os.environ.get(
-        'TRUSTED_PROXY_IPS',
-        '127.0.0.1,::1,172.16.0.0/12,10.0.0.0/8,192.168.0.0/16'
-    )
-    
-    ranges = [r.strip() for r in trusted_proxy_ranges.split(',') if r.strip()]
-    
-    try:
-        ip_obj = ipaddress.ip_address(ip)
-        for ip_range in ranges:
-            try:
-                if '/' in ip_range:
-                    network = ipaddress.ip_network(ip_range, strict=False)
-                    if ip_obj in network:
-                        return True
-                else:
-                    if ip_obj == ipaddress.ip_address(ip_range):
-                        return True
-            except ValueError:
-                continue
-    except ValueError:
-        pass
-    
-    return False
+    return is_trusted_proxy(ip)
 
 
-def _update_metrics():
+def get_registry():
     """
-    Update all custom metrics with current database values.
-    This function is cached to avoid excessive database queries.
+    Registry to expose on /metrics/.
+
+    In multiprocess mode this is a fresh registry merging every worker's
+    samples from the shared directory, plus the business gauges, which are
+    read once per scrape from the shared cache and rollup tables rather than
+    reported by each worker.
     """
-    try:
-        # Lazy imports to avoid circular import issues during Django app loading
-        from projects.models import Project, MediaItem
-        from api.models import CustomUser, Visitor
-        from interactions.models import Like
-
-        # Update basic metrics
-        PROJECT_COUNT.set(Project.objects.count())
-        MEDIA_COUNT.set(MediaItem.objects.count())
-        USER_COUNT.set(CustomUser.objects.count())
-        LIKE_COUNT.set(Like.objects.count())
-        
-        # Visitor metrics (optimized single query approach)
-        visitor_stats = Visitor.objects.aggregate(
-            total_visits=models.Count('id'),
-            unique_visitors=models.Count('id', filter=models.Q(is_unique=True)),
-        )
-        
-        VISITOR_COUNT.set(visitor_stats['total_visits'])  # Total page views/visits
-        UNIQUE_VISITOR_COUNT.set(visitor_stats['unique_visitors'])  # Unique visitors
-        PAGE_VIEW_COUNT.set(visitor_stats['total_visits'])  # Each visitor entry is a page view
-        
-        # Bounce rate calculation - optimized with single aggregation
-        # Count sessions with only one page view vs total unique sessions
-        from django.db.models import Count, Q
-        
-        # Single query to get both counts efficiently
-        session_stats = Visitor.objects.values('session_key').annotate(
-            visit_count=Count('id')
-        ).aggregate(
-            total_sessions=Count('session_key', distinct=True),
-            single_page_sessions=Count('session_key', filter=Q(visit_count=1))
-        )
-        
-        total_sessions = session_stats['total_sessions'] or 0
-        single_page_sessions = session_stats['single_page_sessions'] or 0
-        
-        bounce_rate = (single_page_sessions / total_sessions) * 100 if total_sessions else 0
-        BOUNCE_RATE.set(round(bounce_rate, 2))
-        
-        # Device, browser, and OS distribution (using single queries per distribution)
-        device_distribution = Visitor.objects.values('device_type').annotate(count=models.Count('id'))
-        for device in device_distribution:
-            DEVICE_TYPE_COUNT.labels(device_type=device['device_type']).set(device['count'])
-        
-        browser_distribution = Visitor.objects.values('browser').annotate(count=models.Count('id'))
-        for browser in browser_distribution:
-            BROWSER_COUNT.labels(browser=browser['browser']).set(browser['count'])
-        
-        os_distribution = Visitor.objects.values('os').annotate(count=models.Count('id'))
-        for os in os_distribution:
-            OS_COUNT.labels(os=os['os']).set(os['count'])
-        
-        # Page views per path
-        page_views = Visitor.objects.values('path').annotate(count=models.Count('id'))
-        for page in page_views:
-            PAGE_VIEWS.labels(path=page['path']).set(page['count'])
-    except Exception as e:
-        # Log error but don't crash the metrics endpoint
-        logger.error(f"Error updating metrics: {e}", exc_info=True)
-        # Set metrics to safe defaults to avoid stale data
-        VISITOR_COUNT.set(0)
-        UNIQUE_VISITOR_COUNT.set(0)
-        PAGE_VIEW_COUNT.set(0)
-        BOUNCE_RATE.set(0)
+    path = multiprocess_dir()
+    if not path:
+        return REGISTRY
+
+    from api.collectors import business_collector
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path)
+    registry.register(business_collector)
+    return registry
 
 
 def metrics_view(request):
@@ -286,11 +294,13 @@ def metrics_view(request):
     except Exception as e:
         logger.warning(f"Cache get error, generating fresh metrics: {e}")
 
-    # Update metrics with current database values
-    _update_metrics()
+    # Business gauges come from counters and rollups (api.collectors); the
+    # reconciler thread keeps them exact without scanning tables on scrape
+    from api.collectors import reconciler
+    reconciler.start()
 
     # Generate metrics output
-    metrics_output = generate_latest()
+    metrics_output = generate_latest(get_registry())
 
     # Cache the metrics output
     try:
@@ -317,44 +327,8 @@ def _is_ip_allowed(ip: str) -> bool:
     - 10.0.0.0/8 (Private network - common in cloud)
     - 192.168.0.0/16 (Private network)
     
-    Can be customized via METRICS_ALLOWED_IPS environment variable.
+    Can be customized via METRICS_ALLOWED_IPS environment variable
+    (comma-separated, e.g. 127.0.0.1,10.0.0.0/8,172.17.0.0/16). The list is
+    compiled once by api.networks and reloaded on SIGHUP.
     """
-    if not ip:
-        return False
-    
-    # Get allowed IP ranges from environment or use defaults
-    # Format: comma-separated CIDR notations
-    # Example: METRICS_ALLOWED_IPS=127.0.0.1,10.0.0.0/8,172.17.0.0/16
-    allowed_ranges_str = os.environ.get(
-        'METRICS_ALLOWED_IPS',
-        '127.0.0.1,::1,172.17.0.0/16,172.18.0.0/16,172.19.0.0/16,172.20.0.0/16,'
-        '172.21.0.0/16,172.22.0.0/16,172.23.0.0/16,172.24.0.0/16,172.25.0.0/16,'
-        '172.26.0.0/16,172.27.0.0/16,172.28.0.0/16,172.29.0.0/16,172.30.0.0/16,'
-        '172.31.0.0/16,10.0.0.0/8,192.168.0.0/16'
-    )
-    
-    allowed_ranges = [r.strip() for r in allowed_ranges_str.split(',') if r.strip()]
-    
-    try:
-        client_ip_obj = ipaddress.ip_address(ip)
-        
-        for ip_range in allowed_ranges:
-            try:
-                # Handle both single IPs and CIDR ranges
-                if '/' in ip_range:
-                    network = ipaddress.ip_network(ip_range, strict=False)
-                    if client_ip_obj in network:
-                        return True
-                else:
-                    # Single IP address
-                    if client_ip_obj == ipaddress.ip_address(ip_range):
-                        return True
-            except ValueError as e:
-                logger.warning(f"Invalid IP range in METRICS_ALLOWED_IPS: {ip_range} - {e}")
-                continue
-                
-    except ValueError:
-        logger.warning(f"Invalid client IP address: {ip}")
-        return False
-    
-    return False
+    return is_metrics_allowed(ip)
@@ -1,14 +1,23 @@
 """
 Middleware for request tracking and metrics collection
 """
+import contextvars
 import time
 import re
 import logging
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject, empty
 from django.core.cache import cache
 from prometheus_client import Counter, Histogram
-from .metrics import REQUEST_COUNT, REQUEST_DURATION, _get_client_ip
-from .models import Visitor
+from whitenoise.middleware import WhiteNoiseMiddleware
+from .metrics import (
+    DB_QUERY_COUNT, DB_QUERY_DURATION, REQUEST_COUNT, REQUEST_DB_DURATION, REQUEST_DB_QUERIES,
+    REQUEST_DURATION, RESPONSE_SIZE, UNMATCHED_ROUTE, _get_client_ip, multiprocess_dir,
+)
+from .consent import read_consent
+from .tracking import visitor_buffer
+from .user_agent import classify, publish_cache_stats
 from django.utils import timezone
 from django.conf import settings
 
@@ -31,14 +40,14 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
     
     # Cache keys for performance optimization
     CACHE_PREFIX = 'visitor_tracking'
-    CACHE_TTL = 300  # 5 minutes
+    CACHE_TTL = 300  # 5 minutes between recorded views of one page
     
     def process_response(self, request, response):
         """
-        Track visitor information when response is returned (with GDPR compliance).
+        Queue visitor information when response is returned (with GDPR compliance).
 
         GDPR Compliance:
-        - Only tracks visitors who gave consent
+        - Only tracks visitors who gave consent (signed cookie, see api.consent)
         - Anonymizes IP addresses (last octet = 0)
         - Auto-deletes records after 90 days
         - Stores consent record reference for audit trail
@@ -61,59 +70,42 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
         if response.status_code >= 400:
             return response
         
-        # Track visitor with GDPR compliance
+        # Track visitor with GDPR compliance. The request thread only builds
+        # the event; uniqueness and the insert happen in batches on the
+        # visitor buffer's flusher thread (see api.tracking).
         try:
-            from .models import VisitorConsent
-            
-            # Get session key for consent tracking
-            session_key = request.session.session_key if hasattr(request, 'session') and request.session.session_key else None
-            if not session_key:
-                return response  # Can't track without session
+            # Only visitors holding a valid signed consent cookie are tracked;
+            # verifying it is an HMAC check, no session or DB lookup
+            consent = read_consent(request)
+            if consent is None:
+                return response
             
             # Get visitor information from request
             ip_address = self.get_ip_address(request)
-            user_agent = self.sanitize_user_agent(request.META.get('HTTP_USER_AGENT', ''))
-            referrer = self.sanitize_referrer(request.META.get('HTTP_REFERER', ''))
-            user = request.user if request.user.is_authenticated else None
-            
-            # Get or create consent record
-            consent = VisitorConsent.get_or_create_consent(
-                session_key=session_key,
-                ip_address=ip_address,
-                consent_given=request.COOKIES.get('tracking_consent') == 'accepted'
-            )
             
-            # Only track if user gave consent
-            if not consent.is_valid():
-                # User didn't give consent or consent expired
+            # Skip repeat views of the same page by the same visitor (reloads,
+            # API refetches). Keyed per visitor and path rather than per IP, so
+            # navigating between pages within a session is still recorded.
+            cache_key = f"{self.CACHE_PREFIX}:view:{consent.visitor_id}:{path}"
+            if not cache.add(cache_key, True, self.CACHE_TTL):
                 return response
             
-            # Rate limiting: Skip tracking if this IP was tracked recently
-            cache_key = f"{self.CACHE_PREFIX}:ip:{ip_address}"
-            if cache.get(cache_key):
-                return response
-            
-            # Set cache to prevent tracking same IP too frequently
-            cache.set(cache_key, True, self.CACHE_TTL)
-            
-            # Anonymize IP address (zero out last octet)
-            anonymized_ip = self._anonymize_ip(ip_address)
+            user_agent = self.sanitize_user_agent(request.META.get('HTTP_USER_AGENT', ''))
+            user = request.user if request.user.is_authenticated else None
+            ua_info = classify(user_agent)
             
-            # Create visitor record
-            Visitor.objects.create(
-                anonymized_ip=anonymized_ip,     # Use anonymized IP, not raw
-                user_agent=user_agent,
-                referrer=referrer,
-                path=path,
-                session_key=session_key,
-                user=user,
-                visit_time=timezone.now(),
-                is_unique=self.is_unique_visitor(anonymized_ip, session_key),
-                device_type=self.get_device_type(user_agent),
-                browser=self.get_browser(user_agent),
-                os=self.get_os(user_agent),
-                consent_record=consent,  # Reference the consent record
-            )
+            visitor_buffer.enqueue({
+                'visitor_id': consent.visitor_id,
+                'anonymized_ip': self._anonymize_ip(ip_address),  # Use anonymized IP, not raw
+                'user_agent': user_agent,
+                'referrer': self.sanitize_referrer(request.META.get('HTTP_REFERER', '')),
+                'path': path,
+                'user_id': user.pk if user else None,
+                'visit_time': timezone.now(),
+                'device_type': ua_info.device_type,
+                'browser': ua_info.browser,
+                'os': ua_info.os,
+            })
         except Exception as e:
             # Log error but don't break response
             logger.error(f"Error tracking visitor: {e}", exc_info=True)
@@ -183,113 +175,203 @@ class VisitorTrackingMiddleware(MiddlewareMixin):
         which only trusts X-Forwarded-For headers from trusted proxies.
         """
         return _get_client_ip(request)
-    
-    def is_unique_visitor(self, ip_address, session_key):
-        """Check if visitor is unique (for the current day)"""
-        today = timezone.now().date()
-        # Use cache to avoid database query on every tracked request
-        cache_key = f"{self.CACHE_PREFIX}:unique:{ip_address}:{today}"
-        cached = cache.get(cache_key)
-        if cached is not None:
-            return cached
-        # Check if there's already a unique visitor record for this IP address today
-        is_unique = not Visitor.objects.filter(
-            anonymized_ip=ip_address,
-            visit_time__date=today,
-            is_unique=True
-        ).exists()
-        # Cache for 24 hours (until the date changes)
-        cache.set(cache_key, is_unique, 86400)
-        return is_unique
-    
-    def get_device_type(self, user_agent):
-        """Determine device type from user agent"""
-        if not user_agent:
-            return 'Unknown'
-        
-        user_agent = user_agent.lower()
-        if any(keyword in user_agent for keyword in ['mobile', 'android', 'iphone', 'ipad', 'ipod']):
-            return 'Mobile'
-        elif 'tablet' in user_agent:
-            return 'Tablet'
-        else:
-            return 'Desktop'
-    
-    def get_browser(self, user_agent):
-        """Determine browser from user agent"""
-        if not user_agent:
-            return 'Unknown'
-        
-        user_agent = user_agent.lower()
-        if 'chrome' in user_agent:
-            return 'Chrome'
-        elif 'firefox' in user_agent:
-            return 'Firefox'
-        elif 'safari' in user_agent and 'chrome' not in user_agent:
-            return 'Safari'
-        elif 'edge' in user_agent:
-            return 'Edge'
-        elif 'opera' in user_agent:
-            return 'Opera'
-        else:
-            return 'Unknown'
-    
-    def get_os(self, user_agent):
-        """Determine operating system from user agent"""
-        if not user_agent:
-            return 'Unknown'
-        
-        user_agent = user_agent.lower()
-        if 'windows' in user_agent:
-            return 'Windows'
-        elif 'mac' in user_agent:
-            return 'macOS'
-        elif 'linux' in user_agent:
-            return 'Linux'
-        elif 'android' in user_agent:
-            return 'Android'
-        elif 'ios' in user_agent or 'iphone' in user_agent or 'ipad' in user_agent:
-            return 'iOS'
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, async-capable.
+
+    WhiteNoiseMiddleware is sync-only, so under the ASGI worker Django would
+    run everything below it (the async views included) through
+    async_to_sync from a worker thread, and each in-flight request would
+    hold a thread again. Here, lookups stay on the event loop unless
+    autorefresh (DEBUG) has to hit the filesystem.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
         else:
-            return 'Unknown'
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
 
 
-class PrometheusMetricsMiddleware(MiddlewareMixin):
+class PrometheusMetricsMiddleware:
     """
-    Middleware to collect Prometheus metrics for HTTP requests
+    Middleware to collect Prometheus metrics for HTTP requests.
+
+    Series are labelled by the resolved URL route template, so project slugs,
+    ids and probed URLs do not create new series; anything that did not
+    resolve is counted under ``unmatched``.
+
+    Every query the request runs goes through a QueryRecorder (see
+    record_query), which feeds the per-request query count and DB time
+    histograms and the per-operation query counters. In DEBUG, or for staff
+    users, the figures are also returned as X-DB-Queries and Server-Timing
+    headers to make N+1 regressions visible from the browser. Queries run
+    while a streaming response is consumed are not included.
+
+    In multiprocess mode it also republishes this worker's in-memory stats
+    (user-agent caches) every PROCESS_STATS_INTERVAL seconds, since gauges
+    there cannot be read lazily at scrape time.
+
+    The middleware is async-capable, so under the ASGI worker async views
+    are awaited directly rather than through a thread.
     """
-    
-    def process_request(self, request):
-        """
-        Store request start time in request.META
-        """
-        request.META['_start_time'] = time.time()
-        return None  # Explicit return for clarity
-    
-    def process_response(self, request, response):
-        """
-        Collect metrics when response is returned
-        """
-        # Calculate request duration
-        duration = time.time() - request.META.get('_start_time', time.time())
-        
-        # Get request path without query parameters
-        path = request.path_info
-        
-        # Collect metrics
-        REQUEST_COUNT.labels(
-            method=request.method,
-            path=path,
-            status=response.status_code
-        ).inc()
-        
-        REQUEST_DURATION.labels(
-            method=request.method,
-            path=path
-        ).observe(duration)
-        
+
+    PROCESS_STATS_INTERVAL = 15
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.multiprocess = bool(multiprocess_dir())
+        self._next_stats_publish = 0
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start_time = time.time()
+        queries = QueryRecorder()
+        token = current_queries.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        return self.observe(request, response, queries, start_time, load_user=True)
+
+    async def __acall__(self, request):
+        start_time = time.time()
+        queries = QueryRecorder()
+        token = current_queries.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        return self.observe(request, response, queries, start_time, load_user=False)
+
+    def observe(self, request, response, queries, start_time, load_user):
+        duration = time.time() - start_time
+
+        route = self.get_route(request)
+        REQUEST_COUNT.labels(method=request.method, route=route, status=response.status_code).inc()
+        REQUEST_DURATION.labels(method=request.method, route=route).observe(duration)
+        REQUEST_DB_QUERIES.labels(method=request.method, route=route).observe(queries.count)
+        REQUEST_DB_DURATION.labels(method=request.method, route=route).observe(queries.duration)
+        for operation, durations in queries.durations.items():
+            DB_QUERY_COUNT.labels(route=route, operation=operation).inc(len(durations))
+            histogram = DB_QUERY_DURATION.labels(route=route, operation=operation)
+            for query_duration in durations:
+                histogram.observe(query_duration)
+
+        size = self.get_response_size(response)
+        if size is not None:
+            RESPONSE_SIZE.labels(method=request.method, route=route).observe(size)
+
+        if self.show_timing(request, load_user):
+            response['X-DB-Queries'] = str(queries.count)
+            response['Server-Timing'] = (
+                f'db;dur={queries.duration * 1000:.1f};desc="{queries.count} queries", '
+                f'total;dur={duration * 1000:.1f}'
+            )
+
+        if self.multiprocess and start_time >= self._next_stats_publish:
+            self._next_stats_publish = start_time + self.PROCESS_STATS_INTERVAL
+            publish_cache_stats()
+
         return response
 
+    @staticmethod
+    def show_timing(request, load_user=True) -> bool:
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        if not load_user and isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            # Nothing authenticated the request; loading the user now would
+            # block the event loop on a query
+            return False
+        return bool(user is not None and user.is_authenticated and user.is_staff)
+
+    @staticmethod
+    def get_route(request) -> str:
+        """URL route template of the matched pattern, or 'unmatched'."""
+        match = getattr(request, 'resolver_match', None)
+        if match is None:
+            return UNMATCHED_ROUTE
+        return match.route or match.view_name or UNMATCHED_ROUTE
+
+    @staticmethod
+    def get_response_size(response):
+        if response.streaming:
+            length = response.get('Content-Length')
+            return int(length) if length and length.isdigit() else None
+        return len(response.content)
+
+
+class QueryRecorder:
+    """Execute wrapper that times the queries it sees, by operation."""
+
+    OPERATIONS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.durations = {}  # operation -> [seconds per query]
+
+    @classmethod
+    def operation(cls, sql: str) -> str:
+        keyword = sql.lstrip()[:6].upper()
+        return keyword if keyword in cls.OPERATIONS else 'OTHER'
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            self.durations.setdefault(self.operation(sql), []).append(elapsed)
+
+
+# The recorder of the request being handled. A context variable rather than
+# connection.execute_wrapper(): DB connections are per thread, and the ORM
+# work of async views runs in sync_to_async threads, which inherit the
+# request's context but not the event loop thread's connection.
+current_queries = contextvars.ContextVar('current_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper on every connection feeding the current request's recorder."""
+    queries = current_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver adding record_query to each new connection."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
 
 class SecurityHeadersMiddleware(MiddlewareMixin):
     """
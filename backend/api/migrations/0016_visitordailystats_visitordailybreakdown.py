@@ -0,0 +1,110 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0015_mediaupload_file_max_length_500"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VisitorDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(unique=True)),
+                ("visits", models.PositiveIntegerField(default=0)),
+                ("unique_visitors", models.PositiveIntegerField(default=0)),
+                (
+                    "sessions",
+                    models.PositiveIntegerField(
+                        default=0, help_text="Sessions that started on this day"
+                    ),
+                ),
+                (
+                    "single_page_sessions",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="Sessions started on this day with a single page view (bounces)",
+                    ),
+                ),
+                (
+                    "session_seconds",
+                    models.PositiveBigIntegerField(
+                        default=0,
+                        help_text="Summed duration of the sessions started on this day, in whole seconds",
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Visitor Daily Stats",
+                "verbose_name_plural": "Visitor Daily Stats",
+                "ordering": ["-date"],
+            },
+        ),
+        migrations.CreateModel(
+            name="VisitorDailyBreakdown",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField()),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[
+                            ("path", "Path"),
+                            ("device_type", "Device Type"),
+                            ("browser", "Browser"),
+                            ("os", "Operating System"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "value",
+                    models.CharField(
+                        blank=True,
+                        help_text="Dimension value ('' when the visit had none)",
+                        max_length=500,
+                    ),
+                ),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Visitor Daily Breakdown",
+                "verbose_name_plural": "Visitor Daily Breakdowns",
+                "ordering": ["-date", "dimension", "-count"],
+                "indexes": [
+                    models.Index(
+                        fields=["dimension", "date"],
+                        name="api_visitor_dimensi_cbde54_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="visitordailybreakdown",
+            constraint=models.UniqueConstraint(
+                fields=("date", "dimension", "value"),
+                name="unique_visitor_breakdown_per_day",
+            ),
+        ),
+    ]
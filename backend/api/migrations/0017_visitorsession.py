@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0016_visitordailystats_visitordailybreakdown"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VisitorSession",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "session_key",
+                    models.CharField(
+                        help_text="Django session key (matches Visitor.session_key)",
+                        max_length=64,
+                        unique=True,
+                    ),
+                ),
+                ("first_seen", models.DateTimeField(db_index=True)),
+                ("last_seen", models.DateTimeField(db_index=True)),
+                ("page_count", models.PositiveIntegerField(default=0)),
+                ("entry_path", models.CharField(blank=True, max_length=500)),
+                ("exit_path", models.CharField(blank=True, max_length=500)),
+            ],
+            options={
+                "verbose_name": "Visitor Session",
+                "verbose_name_plural": "Visitor Sessions",
+                "ordering": ["-first_seen"],
+            },
+        ),
+    ]
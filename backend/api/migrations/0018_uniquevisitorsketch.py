@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0017_visitorsession"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UniqueVisitorSketch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "key",
+                    models.CharField(
+                        help_text="Counter key, e.g. day:2026-03-01 or path:2026-03-01:/work",
+                        max_length=600,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "date",
+                    models.DateField(db_index=True, help_text="Day the counter covers"),
+                ),
+                (
+                    "registers",
+                    models.BinaryField(
+                        help_text="HyperLogLog registers, one byte each"
+                    ),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Unique Visitor Sketch",
+                "verbose_name_plural": "Unique Visitor Sketches",
+                "ordering": ["-date", "key"],
+            },
+        ),
+    ]
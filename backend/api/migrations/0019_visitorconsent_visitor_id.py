@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-16 23:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0018_uniquevisitorsketch"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="visitorconsent",
+            name="session_key",
+            field=models.CharField(
+                db_index=True,
+                help_text="Visitor ID from the signed consent cookie",
+                max_length=64,
+                unique=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+"""
+Convert Visitor, ActivityLog and LoginActivity into monthly range-partitioned
+tables on PostgreSQL (see api.partitioning). No-op on other databases.
+"""
+from django.db import migrations
+
+from api.partitioning import PARTITIONED_MODELS, is_partitioned, partition_table
+
+
+def partition_event_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for label, field_name in PARTITIONED_MODELS.items():
+        model = apps.get_model(label)
+        table = model._meta.db_table
+        if is_partitioned(table, schema_editor.connection):
+            continue
+        partition_table(schema_editor, table, model._meta.get_field(field_name).column)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0019_visitorconsent_visitor_id"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_event_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0021_activitylog_created_at_default"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="visitor",
+            name="session_key",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                help_text="Visit session: visitor ID plus session start (see api.tracking)",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="visitorsession",
+            name="session_key",
+            field=models.CharField(
+                help_text="Visitor ID plus session start, ended by inactivity (matches Visitor.session_key)",
+                max_length=64,
+                unique=True,
+            ),
+        ),
+    ]
@@ -199,6 +199,20 @@ class OAuthState(models.Model):
         except OAuthState.DoesNotExist:
             return None
     
+    @staticmethod
+    def consume_nonce(nonce, provider):
+        """
+        Consume the state whose nonce an ID token carries (one-time use).
+        
+        Returns: True if an unexpired state held this nonce
+        """
+        deleted, _ = OAuthState.objects.filter(
+            nonce=nonce,
+            provider=provider,
+            expires_at__gt=timezone.now()
+        ).delete()
+        return deleted > 0
+    
     class Meta:
         indexes = [
             models.Index(fields=['state', 'provider']),
@@ -339,6 +353,8 @@ class VisitorConsent(models.Model):
     
     Strategy:
     - Visitors can opt-in to be tracked
+    - One row is written when consent is granted (audit trail); per-request
+      checks use the signed consent cookie instead (see api.consent)
     - Consent stored for 90 days then auto-deleted
     - Only track IP (anonymized), user agent if consent given
     - All visitor records reference the consent record
@@ -347,7 +363,7 @@ class VisitorConsent(models.Model):
         max_length=64,
         unique=True,
         db_index=True,
-        help_text="Unique session identifier"
+        help_text="Visitor ID from the signed consent cookie"
     )
     ip_address = models.GenericIPAddressField(
         null=True,
@@ -389,7 +405,7 @@ class VisitorConsent(models.Model):
         Get existing consent or create new one.
         
         Args:
-            session_key: Django session key
+            session_key: Visitor ID from the signed consent cookie
             ip_address: Visitor IP address
             consent_given: Whether user consented
             
@@ -446,7 +462,7 @@ class Visitor(models.Model):
         null=True,
         blank=True,
         db_index=True,
-        help_text="Django session key for this visitor"
+        help_text="Visit session: visitor ID plus session start (see api.tracking)"
     )
     user = models.ForeignKey(
         CustomUser,
@@ -522,6 +538,134 @@ class Visitor(models.Model):
             self.will_delete_at = timezone.now() + timezone.timedelta(days=90)
         super().save(*args, **kwargs)
 
+
+class VisitorSession(models.Model):
+    """
+    One row per tracked session, upserted by the visitor buffer.
+
+    Bounce rate and average session duration are aggregates over this table
+    instead of GROUP BYs over every Visitor row.
+    """
+    session_key = models.CharField(
+        max_length=64,
+        unique=True,
+        help_text="Visitor ID plus session start, ended by inactivity (matches Visitor.session_key)"
+    )
+    first_seen = models.DateTimeField(db_index=True)
+    last_seen = models.DateTimeField(db_index=True)
+    page_count = models.PositiveIntegerField(default=0)
+    entry_path = models.CharField(max_length=500, blank=True)
+    exit_path = models.CharField(max_length=500, blank=True)
+
+    class Meta:
+        ordering = ['-first_seen']
+        verbose_name = 'Visitor Session'
+        verbose_name_plural = 'Visitor Sessions'
+
+    def __str__(self):
+        return f"Session {self.session_key[:8]} ({self.page_count} pages)"
+
+    @property
+    def duration(self):
+        return self.last_seen - self.first_seen
+
+
+class VisitorDailyStats(models.Model):
+    """
+    Per-day visitor totals, maintained incrementally by the visitor buffer
+    (api.tracking) and rebuilt by `compact_visitor_stats`.
+
+    VisitorStatsView reads these rows instead of scanning Visitor, so the
+    dashboard cost depends on the number of days, not the number of visits.
+    """
+    date = models.DateField(unique=True)
+    visits = models.PositiveIntegerField(default=0)
+    unique_visitors = models.PositiveIntegerField(default=0)
+    sessions = models.PositiveIntegerField(
+        default=0,
+        help_text="Sessions that started on this day"
+    )
+    single_page_sessions = models.PositiveIntegerField(
+        default=0,
+        help_text="Sessions started on this day with a single page view (bounces)"
+    )
+    session_seconds = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Summed duration of the sessions started on this day, in whole seconds"
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Visitor Daily Stats'
+        verbose_name_plural = 'Visitor Daily Stats'
+
+    def __str__(self):
+        return f"{self.date}: {self.visits} visits"
+
+
+class VisitorDailyBreakdown(models.Model):
+    """
+    Per-day visit counts for one dimension value (path, device, browser, OS).
+    """
+    DIMENSION_CHOICES = [
+        ('path', 'Path'),
+        ('device_type', 'Device Type'),
+        ('browser', 'Browser'),
+        ('os', 'Operating System'),
+    ]
+
+    date = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    value = models.CharField(
+        max_length=500,
+        blank=True,
+        help_text="Dimension value ('' when the visit had none)"
+    )
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date', 'dimension', '-count']
+        verbose_name = 'Visitor Daily Breakdown'
+        verbose_name_plural = 'Visitor Daily Breakdowns'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'dimension', 'value'],
+                name='unique_visitor_breakdown_per_day'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['dimension', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.dimension}={self.value}: {self.count}"
+
+
+class UniqueVisitorSketch(models.Model):
+    """
+    HyperLogLog register array for one unique-visitor counter.
+
+    Only used when Redis is not configured; with Redis the same sketches
+    live in PFADD/PFCOUNT keys (see api.uniques).
+    """
+    key = models.CharField(
+        max_length=600,
+        unique=True,
+        help_text="Counter key, e.g. day:2026-03-01 or path:2026-03-01:/work"
+    )
+    date = models.DateField(db_index=True, help_text="Day the counter covers")
+    registers = models.BinaryField(help_text="HyperLogLog registers, one byte each")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date', 'key']
+        verbose_name = 'Unique Visitor Sketch'
+        verbose_name_plural = 'Unique Visitor Sketches'
+
+    def __str__(self):
+        return self.key
+
 # ============================================================================
 # SECURITY & LOGGING MODELS
 # ============================================================================
@@ -591,7 +735,8 @@ class LoginActivity(models.Model):
         default=False,
         help_text="True if login is from unusual location"
     )
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Set at the attempt, not when the audit buffer writes the row (see ActivityLog)
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
     
     class Meta:
         ordering = ['-created_at']
@@ -683,7 +828,9 @@ class ActivityLog(models.Model):
     success = models.BooleanField(default=True)
     error_message = models.TextField(blank=True)
     
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Set when the action happens, not when the audit buffer writes the row
+    # (bulk_create would overwrite an auto_now_add value with the flush time)
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
     
     class Meta:
         ordering = ['-created_at']
@@ -0,0 +1,138 @@
+"""
+Precompiled IP allow-lists (trusted proxies, metrics ACL).
+
+Each list comes from a comma-separated environment variable of addresses
+and CIDR ranges. It is compiled once into a CIDRMatcher: the ranges are
+merged into sorted integer intervals per address family, so a lookup is one
+ip_address() parse plus a binary search. Matchers are immutable. reload()
+rebuilds them from the environment and swaps them in; it runs on SIGHUP once
+install_reload_handler() has been called (ApiConfig.ready).
+"""
+import ipaddress
+import logging
+import os
+import signal
+import threading
+from bisect import bisect_right
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+TRUSTED_PROXIES = 'TRUSTED_PROXY_IPS'
+METRICS_ALLOWED = 'METRICS_ALLOWED_IPS'
+
+# Environment variable -> default ranges
+DEFAULTS = {
+    TRUSTED_PROXIES: '127.0.0.1,::1,172.16.0.0/12,10.0.0.0/8,192.168.0.0/16',
+    METRICS_ALLOWED: (
+        '127.0.0.1,::1,172.17.0.0/16,172.18.0.0/16,172.19.0.0/16,172.20.0.0/16,'
+        '172.21.0.0/16,172.22.0.0/16,172.23.0.0/16,172.24.0.0/16,172.25.0.0/16,'
+        '172.26.0.0/16,172.27.0.0/16,172.28.0.0/16,172.29.0.0/16,172.30.0.0/16,'
+        '172.31.0.0/16,10.0.0.0/8,192.168.0.0/16'
+    ),
+}
+
+
+def _merge(intervals):
+    """Sort and merge overlapping/adjacent (first, last) intervals."""
+    merged = []
+    for first, last in sorted(intervals):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return tuple(i[0] for i in merged), tuple(i[1] for i in merged)
+
+
+class CIDRMatcher:
+    """Immutable set of IPv4/IPv6 ranges with O(log n) membership tests."""
+
+    __slots__ = ('spec', '_v4', '_v6')
+
+    def __init__(self, entries: Iterable[str], source: str = ''):
+        intervals = {4: [], 6: []}
+        valid = []
+        for entry in entries:
+            entry = entry.strip()
+            if not entry:
+                continue
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+            except ValueError as e:
+                logger.warning(f"Invalid IP range in {source or 'allow-list'}: {entry} - {e}")
+                continue
+            valid.append(entry)
+            intervals[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+        self.spec = tuple(valid)
+        self._v4 = _merge(intervals[4])
+        self._v6 = _merge(intervals[6])
+
+    @classmethod
+    def parse(cls, value: str, source: str = '') -> 'CIDRMatcher':
+        return cls(value.split(','), source=source)
+
+    def __contains__(self, ip) -> bool:
+        if not ip:
+            return False
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        starts, ends = self._v4 if address.version == 4 else self._v6
+        value = int(address)
+        index = bisect_right(starts, value) - 1
+        return index >= 0 and value <= ends[index]
+
+    def __repr__(self):
+        return f'CIDRMatcher({",".join(self.spec)!r})'
+
+
+def _build() -> dict:
+    return {
+        name: CIDRMatcher.parse(os.environ.get(name, default), source=name)
+        for name, default in DEFAULTS.items()
+    }
+
+
+_matchers = _build()
+
+
+def get_matcher(name: str) -> CIDRMatcher:
+    return _matchers[name]
+
+
+def reload():
+    """Rebuild every matcher from the environment."""
+    global _matchers
+    _matchers = _build()
+    logger.info(f"Reloaded IP allow-lists: {', '.join(_matchers)}")
+
+
+def install_reload_handler():
+    """Reload the matchers on SIGHUP (main thread only; chains any previous handler)."""
+    if not hasattr(signal, 'SIGHUP') or threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGHUP)
+    if getattr(previous, '_reloads_networks', False):
+        return
+
+    def handle_sighup(signum, frame):
+        reload()
+        if callable(previous):
+            previous(signum, frame)
+
+    handle_sighup._reloads_networks = True
+    signal.signal(signal.SIGHUP, handle_sighup)
+
+
+def is_trusted_proxy(ip: Optional[str]) -> bool:
+    return ip in _matchers[TRUSTED_PROXIES]
+
+
+def is_metrics_allowed(ip: Optional[str]) -> bool:
+    return ip in _matchers[METRICS_ALLOWED]
@@ -0,0 +1,180 @@
+"""
+OAuth token verification, without blocking a worker.
+
+Google ID tokens are verified locally against cached signing keys
+(api.idtokens), so the usual Google sign-in makes no outbound call. Access
+tokens and other providers are checked with the provider's API.
+
+verify_oauth_token() is a coroutine on the shared async client
+(api.outbound). SocialAuthView awaits it directly, so under the ASGI worker
+(SERVER_MODE=asgi, see gunicorn.conf.py) a sign-in waiting on Google is a
+suspended task and not an occupied thread. SocialAuthSerializer falls back
+to running it with async_to_sync when it is used outside an async view.
+
+Under uvicorn the client is one long-lived, keep-alive AsyncClient per worker.
+Under WSGI each async view runs on a loop of its own, so requests go through
+the pooled sync client on a worker thread instead (see api.outbound).
+"""
+import logging
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from . import outbound
+from .idtokens import InvalidIDToken, looks_like_jwt, verify_google_id_token
+
+logger = logging.getLogger(__name__)
+
+
+async def _check_nonce(nonce) -> bool:
+    """Consume the OAuthState nonce an ID token carries (one-time use)."""
+    from .models import OAuthState
+
+    if not nonce:
+        if getattr(settings, 'GOOGLE_ID_TOKEN_REQUIRE_NONCE', False):
+            logger.warning("Google ID token without nonce rejected")
+            return False
+        return True
+    if not await sync_to_async(OAuthState.consume_nonce)(nonce, 'google'):
+        logger.warning("Google ID token nonce unknown, expired or already used")
+        return False
+    return True
+
+
+def _google_user_info(data: dict) -> dict:
+    return {
+        'provider_id': data.get('sub'),
+        'email': data.get('email'),
+        'first_name': data.get('given_name'),
+        'last_name': data.get('family_name'),
+        'profile_image': data.get('picture')
+    }
+
+
+async def verify_oauth_token(provider, token, expected_id=None, expected_email=None):
+    """
+    Verify OAuth token with the provider.
+    Returns (True, user_info) if verified, (False, None) otherwise.
+
+    Uses safe URL parameter passing to prevent injection issues.
+    - Google ID tokens: verified locally (api.idtokens), nonce checked
+      against OAuthState
+    - Google access tokens: https://www.googleapis.com/oauth2/v3/userinfo
+    - Facebook: https://graph.facebook.com/debug_token
+    """
+    from api.security import OAuthSecurityManager, AuditLogger
+
+    client = outbound.async_client()
+    try:
+        if provider == 'google':
+            # SECURITY: Client ID is REQUIRED - fail closed if not configured
+            client_id = OAuthSecurityManager.get_oauth_client_id('google')
+            if not client_id:
+                AuditLogger.log_security_event(
+                    'oauth_verification_failed',
+                    'high',
+                    {'provider': 'google', 'reason': 'client_id_not_configured'}
+                )
+                return False, None
+
+            clean_client_id = client_id.strip()
+
+            # ID token (GoogleLogin component): verified locally, no round trip
+            if looks_like_jwt(token):
+                try:
+                    data = await verify_google_id_token(token, clean_client_id)
+                except InvalidIDToken as e:
+                    logger.warning(f"Google ID token rejected: {e}")
+                    return False, None
+                if not await _check_nonce(data.get('nonce')):
+                    return False, None
+                if expected_id and data.get('sub') != expected_id:
+                    logger.warning("Google token user ID mismatch")
+                    return False, None
+                if expected_email and data.get('email') != expected_email:
+                    logger.warning("Google token email mismatch")
+                    return False, None
+                return True, _google_user_info(data)
+
+            # Access token (useGoogleLogin): only Google can tell us who it belongs to
+            userinfo_response = await client.get(
+                settings.GOOGLE_USERINFO_URL,
+                headers={'Authorization': f'Bearer {token}'},
+            )
+            if userinfo_response.status_code == 200:
+                data = userinfo_response.json()
+                if expected_id and data.get('sub') != expected_id:
+                    logger.warning("Google access_token user ID mismatch")
+                    return False, None
+                if expected_email and data.get('email') != expected_email:
+                    logger.warning("Google access_token email mismatch")
+                    return False, None
+                return True, _google_user_info(data)
+
+            logger.warning(f"Google access_token verification failed: {userinfo_response.status_code}")
+            return False, None
+
+        elif provider == 'facebook':
+            # Verify Facebook access token
+            app_id = getattr(settings, 'FACEBOOK_APP_ID', None)
+            app_secret = getattr(settings, 'FACEBOOK_APP_SECRET', None)
+
+            if not app_id or not app_secret:
+                logger.error("Facebook app credentials not configured - OAuth verification FAILED")
+                # Always fail closed - never bypass OAuth verification
+                return False, None
+
+            # Build app access token safely to prevent logging of secrets
+            # Facebook requires app access token in format: app_id|app_secret
+            app_access_token = f"{app_id}|{app_secret}"
+
+            response = await client.get(
+                'https://graph.facebook.com/debug_token',
+                params={
+                    'input_token': token,
+                    'access_token': app_access_token
+                },
+            )
+            if response.status_code == 200:
+                data = response.json().get('data', {})
+                if data.get('is_valid', False):
+                    # Verify the user ID matches
+                    if expected_id and str(data.get('user_id')) != str(expected_id):
+                        logger.warning("Facebook token user ID mismatch")
+                        return False, None
+                    # For Facebook, the user's email comes from the graph API
+                    user_response = await client.get(
+                        'https://graph.facebook.com/me',
+                        params={
+                            'fields': 'email,name,first_name,last_name,picture',
+                            'access_token': token
+                        },
+                    )
+                    if user_response.status_code == 200:
+                        user_data = user_response.json()
+                        if expected_email and user_data.get('email') != expected_email:
+                            logger.warning("Facebook token email mismatch")
+                            return False, None
+                        return True, {
+                            'provider_id': str(data.get('user_id')),
+                            'email': user_data.get('email'),
+                            'first_name': user_data.get('first_name'),
+                            'last_name': user_data.get('last_name'),
+                            'profile_image': user_data.get('picture', {}).get('data', {}).get('url')
+                        }
+                    logger.warning(f"Facebook email verification failed: {user_response.status_code}")
+                    return False, None
+            logger.warning(f"Facebook token verification failed: {response.status_code}")
+            return False, None
+
+    except httpx.HTTPError as e:
+        logger.error(f"OAuth verification request failed: {e}")
+        # Security: Always fail closed on network errors - never bypass OAuth verification
+        return False, None
+    except Exception as e:
+        # Never allow unexpected OAuth parsing/provider issues to bubble up as 500.
+        logger.error(f"OAuth verification unexpected error: {e}", exc_info=True)
+        return False, None
+
+    return False, None
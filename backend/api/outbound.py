@@ -0,0 +1,307 @@
+"""
+Shared outbound HTTP clients, pooled per worker process.
+
+Calls to third parties go through these clients, so TCP and TLS connections
+are kept alive and reused instead of being opened for every request:
+
+- client(): a thread-safe httpx.Client for sync callers
+  (error_handling.safe_external_request).
+- async_client(): the async client used by OAuth verification (api.oauth)
+  and the Google JWKS refresh (api.idtokens). httpx connections are tied to
+  the event loop that opened them, so pooling them only pays off on a loop
+  that lives as long as the worker. portfolio.asgi turns on one
+  httpx.AsyncClient per loop (use_event_loop_clients()) for the uvicorn
+  worker. Under WSGI, every async view runs on a loop of its own that ends
+  with the request. There the async client is a ThreadedAsyncClient: it
+  sends through client() on a worker thread, so connections are reused
+  across requests and nothing is left open when the loop goes away.
+- Cloudinary's uploader and Admin API share one urllib3 pool manager.
+  install_cloudinary() swaps it in from ApiConfig.ready. The SDK's own
+  managers keep a single connection per host and set no timeout.
+
+Pools hold up to OUTBOUND_HTTP_MAX_CONNECTIONS connections per client and
+keep OUTBOUND_HTTP_MAX_KEEPALIVE of them idle for OUTBOUND_HTTP_KEEPALIVE_EXPIRY
+seconds. Requests that do not pass a timeout get their host's
+(OUTBOUND_HTTP_HOST_TIMEOUTS), since Cloudinary uploads can take minutes
+while Google should answer in seconds. Other hosts get
+OUTBOUND_HTTP_TIMEOUT. Every request is counted and timed per client and
+host, and the pool gauges are sampled after each one.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+import urllib3
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .metrics import OUTBOUND_HTTP_DURATION, OUTBOUND_HTTP_POOL, OUTBOUND_HTTP_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def _outcome(status_code: int) -> str:
+    return f'{status_code // 100}xx'
+
+
+def _httpcore_pool_state(transport):
+    # httpx.HTTPTransport keeps its httpcore pool private; tolerate its absence
+    pool = getattr(transport, '_pool', None)
+    connections = list(getattr(pool, 'connections', ()))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return len(connections) - idle, idle
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """httpx transport adding per-host timeouts and metrics."""
+
+    def __init__(self, name, registry, transport):
+        self.name = name
+        self.registry = registry
+        self._transport = transport
+
+    def handle_request(self, request):
+        host = request.url.host
+        self.registry.apply_timeout(request)
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = self._transport.handle_request(request)
+            outcome = _outcome(response.status_code)
+            return response
+        except httpx.TimeoutException:
+            outcome = 'timeout'
+            raise
+        finally:
+            self.registry.record(self.name, host, outcome, started, _httpcore_pool_state(self._transport))
+
+    def close(self):
+        self._transport.close()
+
+
+class InstrumentedAsyncTransport(httpx.AsyncBaseTransport):
+    """Async counterpart of InstrumentedTransport."""
+
+    def __init__(self, name, registry, transport):
+        self.name = name
+        self.registry = registry
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        self.registry.apply_timeout(request)
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = await self._transport.handle_async_request(request)
+            outcome = _outcome(response.status_code)
+            return response
+        except httpx.TimeoutException:
+            outcome = 'timeout'
+            raise
+        finally:
+            self.registry.record(self.name, host, outcome, started, _httpcore_pool_state(self._transport))
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class InstrumentedPoolManager:
+    """
+    urllib3 PoolManager wrapper (for the Cloudinary SDK) adding per-host
+    default timeouts and metrics. A ``timeout`` passed by the caller, set
+    from Cloudinary's own ``timeout`` config, still wins.
+    """
+
+    def __init__(self, name, registry, manager):
+        self.name = name
+        self.registry = registry
+        self._manager = manager
+
+    def request(self, method, url, **kwargs):
+        host = urlsplit(url).hostname or ''
+        kwargs.setdefault('timeout', self.registry.timeout_for(host))
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            response = self._manager.request(method, url, **kwargs)
+            outcome = _outcome(response.status)
+            return response
+        except urllib3.exceptions.TimeoutError:
+            outcome = 'timeout'
+            raise
+        finally:
+            self.registry.record(self.name, host, outcome, started, self.pool_state())
+
+    def pool_state(self):
+        """(checked out, idle) connections over all host pools."""
+        active = idle = 0
+        for key in list(self._manager.pools.keys()):
+            pool = self._manager.pools.get(key)
+            queue = getattr(pool, 'pool', None)
+            if queue is None:
+                continue
+            # The queue is pre-filled with None placeholders up to maxsize
+            waiting = list(queue.queue)
+            idle += sum(1 for connection in waiting if connection is not None)
+            active += max(0, pool.pool.maxsize - len(waiting))
+        return active, idle
+
+    def clear(self):
+        self._manager.clear()
+
+    def __getattr__(self, name):
+        return getattr(self._manager, name)
+
+
+class ThreadedAsyncClient:
+    """
+    Awaitable requests through the pooled sync client, run on a worker
+    thread (for event loops that live for a single call).
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    async def request(self, method, url, **kwargs) -> httpx.Response:
+        send = sync_to_async(self.registry.client().request, thread_sensitive=False)
+        return await send(method, url, **kwargs)
+
+    async def get(self, url, **kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+
+
+class HTTPClientRegistry:
+    """Per-process outbound HTTP clients sharing pool limits and host timeouts."""
+
+    def __init__(self, max_connections=20, max_keepalive=10, keepalive_expiry=30.0,
+                 timeout=10.0, host_timeouts=None):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.host_timeouts = dict(host_timeouts or {})
+        self._lock = threading.Lock()
+        self._client = None
+        self._event_loop_clients = False
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncClient
+        self._threaded = ThreadedAsyncClient(self)
+        self._cloudinary = None
+
+    # ── configuration ────────────────────────────────────────────────
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def timeout_for(self, host: str) -> float:
+        return self.host_timeouts.get(host, self.timeout)
+
+    def apply_timeout(self, request: httpx.Request):
+        """Give requests to a configured host that host's timeout, unless the caller set one."""
+        timeout = self.host_timeouts.get(request.url.host)
+        # httpx fills in the client default when the caller passes nothing
+        if timeout is not None and request.extensions.get('timeout') == httpx.Timeout(self.timeout).as_dict():
+            request.extensions['timeout'] = httpx.Timeout(timeout).as_dict()
+
+    # ── clients ──────────────────────────────────────────────────────
+
+    def client(self) -> httpx.Client:
+        """The shared sync client (thread-safe)."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    transport = httpx.HTTPTransport(limits=self.limits)
+                    self._client = httpx.Client(
+                        transport=InstrumentedTransport('default', self, transport),
+                        timeout=self.timeout,
+                    )
+        return self._client
+
+    def use_event_loop_clients(self):
+        """Keep one AsyncClient per event loop (servers whose loop lives as long as the worker)."""
+        self._event_loop_clients = True
+
+    def async_client(self):
+        """The AsyncClient for the running event loop, or the ThreadedAsyncClient."""
+        if not self._event_loop_clients:
+            return self._threaded
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None or client.is_closed:
+            transport = httpx.AsyncHTTPTransport(limits=self.limits)
+            client = httpx.AsyncClient(
+                transport=InstrumentedAsyncTransport('oauth', self, transport),
+                timeout=self.timeout,
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def install_cloudinary(self) -> Optional[InstrumentedPoolManager]:
+        """Route the Cloudinary SDK's uploader and Admin API through one shared pool."""
+        try:
+            import cloudinary
+            import cloudinary.uploader
+            from cloudinary.api_client import call_api
+            from cloudinary.utils import get_http_connector
+        except ImportError:  # pragma: no cover - cloudinary is a hard dependency
+            return None
+
+        # get_http_connector keeps the SDK's proxy and TCP keep-alive handling.
+        # block=False: bursts past maxsize open extra connections, not queue
+        manager = get_http_connector(cloudinary.config(), {
+            **cloudinary.CERT_KWARGS, 'maxsize': self.max_keepalive, 'block': False,
+        })
+        self._cloudinary = InstrumentedPoolManager('cloudinary', self, manager)
+        cloudinary.uploader._http = self._cloudinary
+        call_api._http = self._cloudinary
+        logger.info(f"Cloudinary requests pooled (maxsize {self.max_keepalive})")
+        return self._cloudinary
+
+    def close(self):
+        """Close the sync client and Cloudinary pools (worker exit)."""
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._cloudinary is not None:
+            self._cloudinary.clear()
+
+    # ── metrics ──────────────────────────────────────────────────────
+
+    def record(self, name, host, outcome, started, pool_state):
+        OUTBOUND_HTTP_REQUESTS.labels(client=name, host=host, outcome=outcome).inc()
+        OUTBOUND_HTTP_DURATION.labels(client=name, host=host).observe(time.perf_counter() - started)
+        active, idle = pool_state
+        OUTBOUND_HTTP_POOL.labels(client=name, state='active').set(active)
+        OUTBOUND_HTTP_POOL.labels(client=name, state='idle').set(idle)
+        OUTBOUND_HTTP_POOL.labels(client=name, state='max').set(self.max_connections)
+
+
+# Global instance
+registry = HTTPClientRegistry(
+    max_connections=getattr(settings, 'OUTBOUND_HTTP_MAX_CONNECTIONS', 20),
+    max_keepalive=getattr(settings, 'OUTBOUND_HTTP_MAX_KEEPALIVE', 10),
+    keepalive_expiry=getattr(settings, 'OUTBOUND_HTTP_KEEPALIVE_EXPIRY', 30.0),
+    timeout=getattr(settings, 'OUTBOUND_HTTP_TIMEOUT', 10.0),
+    host_timeouts=getattr(settings, 'OUTBOUND_HTTP_HOST_TIMEOUTS', {}),
+)
+
+
+def client() -> httpx.Client:
+    return registry.client()
+
+
+def async_client():
+    return registry.async_client()
@@ -0,0 +1,297 @@
+"""
+Monthly range partitioning for the append-only event tables.
+
+On PostgreSQL, Visitor, ActivityLog and LoginActivity are declaratively
+partitioned by month on their timestamp column (migration
+0020_partition_event_tables). Partitions are named ``<table>_pYYYYMM``, plus
+a ``<table>_default`` catch-all. `manage.py manage_partitions` creates
+upcoming months ahead of time, and retention detaches and drops whole
+months instead of running large DELETEs.
+
+Other databases (SQLite in tests and local development) keep plain tables.
+There, retention falls back to deleting rows in small batches.
+"""
+import logging
+import re
+from datetime import date, datetime
+from datetime import timezone as dt_timezone
+
+from django.db import connection as default_connection
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Model label -> timestamp field the table is partitioned on
+PARTITIONED_MODELS = {
+    'api.Visitor': 'visit_time',
+    'api.ActivityLog': 'created_at',
+    'api.LoginActivity': 'created_at',
+}
+
+DELETE_BATCH_SIZE = 5000
+
+_PARTITION_SUFFIX = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def is_supported(connection=None) -> bool:
+    connection = connection or default_connection
+    return connection.vendor == 'postgresql'
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_p{month.year:04d}{month.month:02d}'
+
+
+def _as_datetime(month: date) -> datetime:
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+
+
+def _bound(month: date) -> str:
+    return _as_datetime(month).isoformat()
+
+
+def is_partitioned(table: str, connection=None) -> bool:
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)',
+            [table],
+        )
+        return cursor.fetchone() is not None
+
+
+def _partition_column(table: str, cursor) -> str:
+    cursor.execute(
+        'SELECT a.attname FROM pg_partitioned_table p '
+        'JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0] '
+        'WHERE p.partrelid = to_regclass(%s)',
+        [table],
+    )
+    return cursor.fetchone()[0]
+
+
+def create_partition(table: str, month: date, connection=None) -> str:
+    """
+    Create the partition holding ``month`` if it does not exist yet.
+
+    PostgreSQL refuses to create a partition for rows the default partition
+    already holds (inserted before the month was created), so those rows are
+    moved: the default is detached, the partition created, the month's rows
+    moved over and the default re-attached, in one transaction. Inserts wait
+    on the table lock meanwhile.
+    """
+    connection = connection or default_connection
+    qn = connection.ops.quote_name
+    name = partition_name(table, month)
+    default = f'{table}_default'
+    lower, upper = _bound(month), _bound(add_months(month, 1))
+    create = (
+        f'CREATE TABLE IF NOT EXISTS {qn(name)} PARTITION OF {qn(table)} '
+        f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s), to_regclass(%s)', [name, default])
+        existing, has_default = cursor.fetchone()
+        if existing or not has_default:
+            cursor.execute(create)
+            return name
+
+        with transaction.atomic(using=connection.alias):
+            cursor.execute(f'LOCK TABLE {qn(table)} IN SHARE ROW EXCLUSIVE MODE')
+            column = qn(_partition_column(table, cursor))
+            in_month = f'{column} >= %s AND {column} < %s'
+            cursor.execute(f'SELECT COUNT(*) FROM {qn(default)} WHERE {in_month}', [lower, upper])
+            stranded = cursor.fetchone()[0]
+            if not stranded:
+                cursor.execute(create)
+                return name
+            cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(default)}')
+            cursor.execute(create)
+            cursor.execute(f'INSERT INTO {qn(name)} SELECT * FROM {qn(default)} WHERE {in_month}', [lower, upper])
+            cursor.execute(f'DELETE FROM {qn(default)} WHERE {in_month}', [lower, upper])
+            cursor.execute(f'ALTER TABLE {qn(table)} ATTACH PARTITION {qn(default)} DEFAULT')
+    logger.warning(f"Moved {stranded} rows of {table} from the default partition into {name}")
+    return name
+
+
+def list_partitions(table: str, connection=None) -> dict:
+    """Return {month: partition name} for the monthly partitions of ``table``."""
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)',
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        match = _PARTITION_SUFFIX.search(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def ensure_partitions(models, months_ahead: int = 3, today: date = None, connection=None) -> list:
+    """
+    Create partitions for the current month and ``months_ahead`` upcoming
+    months for every partitioned model. Returns the names created or kept.
+
+    A table that fails is logged and skipped so the others (and the
+    retention that follows in manage_partitions) still run.
+    """
+    connection = connection or default_connection
+    if not is_supported(connection):
+        return []
+    current = month_start(today or date.today())
+    names = []
+    for model in models:
+        table = model._meta.db_table
+        if not is_partitioned(table, connection):
+            continue
+        try:
+            with transaction.atomic(using=connection.alias):
+                created = [
+                    create_partition(table, add_months(current, offset), connection)
+                    for offset in range(months_ahead + 1)
+                ]
+        except Exception as e:
+            logger.error(f"Could not create partitions for {table}: {e}", exc_info=True)
+            continue
+        names.extend(created)
+    return names
+
+
+def drop_partitions_before(table: str, cutoff, connection=None) -> list:
+    """
+    Detach and drop every monthly partition of ``table`` that only holds rows
+    older than ``cutoff`` (an aware datetime). Returns the dropped names.
+    """
+    connection = connection or default_connection
+    qn = connection.ops.quote_name
+    dropped = []
+    for month, name in sorted(list_partitions(table, connection).items()):
+        if _as_datetime(add_months(month, 1)) > cutoff:
+            continue
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {qn(table)} DETACH PARTITION {qn(name)}')
+                cursor.execute(f'DROP TABLE {qn(name)}')
+        logger.info(f"Dropped partition {name} (rows before {cutoff})")
+        dropped.append(name)
+    return dropped
+
+
+def delete_in_batches(queryset, batch_size: int = DELETE_BATCH_SIZE) -> int:
+    """
+    Delete ``queryset`` a batch of primary keys at a time so no single
+    DELETE (or cascade collection) grows with the table.
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        count, _ = model.objects.filter(pk__in=pks).delete()
+        deleted += count
+
+
+def purge_before(model, cutoff, queryset=None) -> dict:
+    """
+    Apply retention to a partitioned model: drop whole months older than
+    ``cutoff``, then batch-delete what is left of the boundary month.
+
+    Args:
+        model: One of PARTITIONED_MODELS
+        cutoff: Rows with a timestamp before this datetime expire
+        queryset: Expired rows to delete row by row (defaults to
+            timestamp < cutoff)
+
+    Returns:
+        dict: {'partitions': [dropped names], 'rows': rows deleted}
+    """
+    field = PARTITIONED_MODELS[model._meta.label]
+    if queryset is None:
+        queryset = model.objects.filter(**{f'{field}__lt': cutoff})
+    partitions = []
+    if is_partitioned(model._meta.db_table):
+        partitions = drop_partitions_before(model._meta.db_table, cutoff)
+    return {'partitions': partitions, 'rows': delete_in_batches(queryset.order_by())}
+
+
+def partition_table(schema_editor, table: str, column: str, months_ahead: int = 3):
+    """
+    Convert an existing plain PostgreSQL table into one range-partitioned by
+    month on ``column``, keeping its data, indexes and constraints.
+
+    The primary key becomes (id, column), as PostgreSQL requires the
+    partition key in every unique constraint; ``id`` stays unique through
+    its sequence and Django keeps treating it as the primary key.
+    """
+    connection = schema_editor.connection
+    qn = schema_editor.quote_name
+    legacy = f'{table}_unpartitioned'
+    sequence = f'{table}_id_seq'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes '
+            'WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s',
+            [table, f'{table}_pkey'],
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype IN ('f', 'c')",
+            [table],
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(f'SELECT MIN({qn(column)}) FROM {qn(table)}')
+        oldest = cursor.fetchone()[0]
+
+    current = month_start(date.today())
+    first = month_start(oldest) if oldest else current
+
+    schema_editor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(legacy)}')
+    # LIKE copies columns, NOT NULL and defaults but not the identity,
+    # indexes or constraints, which are recreated below
+    schema_editor.execute(
+        f'CREATE TABLE {qn(table)} (LIKE {qn(legacy)} INCLUDING DEFAULTS) '
+        f'PARTITION BY RANGE ({qn(column)})'
+    )
+    month = first
+    while month <= add_months(current, months_ahead):
+        create_partition(table, month, connection)
+        month = add_months(month, 1)
+    schema_editor.execute(
+        f'CREATE TABLE IF NOT EXISTS {qn(table + "_default")} PARTITION OF {qn(table)} DEFAULT'
+    )
+    schema_editor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {qn(legacy)}')
+    schema_editor.execute(f'DROP TABLE {qn(legacy)}')
+
+    schema_editor.execute(f'CREATE SEQUENCE {qn(sequence)} OWNED BY {qn(table)}.{qn("id")}')
+    schema_editor.execute(
+        f"ALTER TABLE {qn(table)} ALTER COLUMN {qn('id')} SET DEFAULT nextval('{sequence}')"
+    )
+    schema_editor.execute(
+        f"SELECT setval('{sequence}', COALESCE((SELECT MAX({qn('id')}) FROM {qn(table)}), 0) + 1, false)"
+    )
+    schema_editor.execute(
+        f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(table + "_pkey")} PRIMARY KEY ({qn("id")}, {qn(column)})'
+    )
+    for _name, definition in indexes:
+        schema_editor.execute(definition)
+    for name, definition in constraints:
+        schema_editor.execute(f'ALTER TABLE {qn(table)} ADD CONSTRAINT {qn(name)} {definition}')
@@ -0,0 +1,305 @@
+"""
+Unified rate limiting for view decorators, DRF throttles and the detector.
+
+Every limit is a GCRA (generic cell rate algorithm) token bucket. A rate of
+N requests per period allows bursts of up to N and refills continuously.
+The only state per key is one timestamp, the "theoretical arrival time",
+which is read, checked and updated atomically in a single operation:
+
+- RedisBackend, when the cache is django-redis: one EVALSHA of a Lua script
+  per decision, using the Redis server clock.
+- SharedMemoryBackend otherwise: a fixed-size hash table in an mmap'd file
+  (RATELIMIT_SHARED_FILE), guarded by flock, so every gunicorn worker on
+  the host shares the same buckets.
+- LocalBackend as the last resort (no fcntl, e.g. Windows): per-process.
+
+Adapters: ratelimit_or_exempt (api.utils) for views, RateLimitThrottle for
+DRF, and MaliciousActivityDetector._check_rate_limit. Each decision
+increments django_ratelimit_decisions_total{policy, decision}.
+"""
+import hashlib
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import RATE_LIMIT_DECISIONS
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'rl'
+
+_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_PERIOD_RE = re.compile(r'(\d*)\s*([smhd])')
+
+
+class Rate(NamedTuple):
+    limit: int
+    period: float  # seconds
+
+    @property
+    def interval(self) -> float:
+        """Seconds between tokens."""
+        return self.period / self.limit
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    remaining: int
+    retry_after: float  # seconds until the next request would be allowed
+
+
+def parse_rate(rate) -> Rate:
+    """
+    Parse '10/m', '5/15m' (django-ratelimit) or '1000/hour' (DRF) into a Rate.
+    Rate instances are returned unchanged.
+    """
+    if isinstance(rate, Rate):
+        return rate
+    count, _, period = str(rate).partition('/')
+    match = _PERIOD_RE.match(period.strip().lower())
+    if not count.strip().isdigit() or not match or int(count) <= 0:
+        raise ValueError(f'Invalid rate: {rate!r}')
+    multiplier = int(match.group(1) or 1)
+    return Rate(int(count), multiplier * _PERIODS[match.group(2)])
+
+
+def _gcra(tat: float, now: float, rate: Rate):
+    """One GCRA step: return (decision, new tat or None when denied)."""
+    tat = max(tat, now)
+    new_tat = tat + rate.interval
+    allow_at = new_tat - rate.period
+    if allow_at > now:
+        return Decision(False, 0, allow_at - now), None
+    remaining = int((rate.period - (new_tat - now)) / rate.interval + 1e-9)
+    return Decision(True, remaining, 0.0), new_tat
+
+
+# KEYS[1] bucket; ARGV[1] interval, ARGV[2] period (seconds).
+# Returns {allowed, remaining, retry_after as string}.
+GCRA_SCRIPT = """
+pcall(redis.replicate_commands)
+local interval = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then tat = now end
+local new_tat = tat + interval
+local allow_at = new_tat - period
+if allow_at > now then
+  return {0, 0, tostring(allow_at - now)}
+end
+redis.call('SET', KEYS[1], string.format('%.6f', new_tat), 'PX', math.ceil(period * 1000))
+return {1, math.floor((period - (new_tat - now)) / interval + 1e-9), '0'}
+"""
+
+
+class RedisBackend:
+    """GCRA in a Lua script: one atomic round trip per decision."""
+
+    def __init__(self, client):
+        self._client = client
+        self._script = client.register_script(GCRA_SCRIPT)
+
+    def hit(self, key: str, rate: Rate) -> Decision:
+        allowed, remaining, retry_after = self._script(keys=[key], args=[rate.interval, rate.period])
+        return Decision(bool(allowed), int(remaining), float(retry_after))
+
+    def clear(self):
+        for key in self._client.scan_iter(f'{KEY_PREFIX}:*'):
+            self._client.delete(key)
+
+
+class LocalBackend:
+    """Per-process GCRA table (fallback when no shared store is available)."""
+
+    def __init__(self, max_keys: int = 65536):
+        self.max_keys = max_keys
+        self._tats = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, rate: Rate) -> Decision:
+        now = time.time()
+        with self._lock:
+            decision, new_tat = _gcra(self._tats.get(key, now), now, rate)
+            if new_tat is not None:
+                if len(self._tats) >= self.max_keys:
+                    self._tats = {k: t for k, t in self._tats.items() if t > now}
+                self._tats[key] = new_tat
+        return decision
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class SharedMemoryBackend:
+    """
+    GCRA table shared by every process on the host through an mmap'd file.
+
+    The file is an open-addressing hash table of (64-bit key hash, tat)
+    slots. A slot whose tat has passed is a full bucket, so it is free for
+    reuse. If every probed slot is still active, the one that refills soonest
+    is evicted. Updates hold flock on the file (across processes) and a
+    thread lock (within one).
+    """
+
+    SLOT = struct.Struct('<Qd')
+    PROBES = 16
+
+    def __init__(self, path: str, slots: int = 65536):
+        self.path = path
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def hit(self, key: str, rate: Rate) -> Decision:
+        key_hash = self._hash(key)
+        start = key_hash % self.slots
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                chosen, chosen_tat, tat = None, None, None
+                for probe in range(self.PROBES):
+                    offset = ((start + probe) % self.slots) * self.SLOT.size
+                    slot_hash, slot_tat = self.SLOT.unpack_from(self._map, offset)
+                    if slot_hash == key_hash:
+                        chosen, tat = offset, slot_tat
+                        break
+                    if chosen_tat is None or slot_tat < chosen_tat:
+                        chosen, chosen_tat = offset, slot_tat
+                decision, new_tat = _gcra(tat if tat is not None else now, now, rate)
+                if new_tat is not None:
+                    self.SLOT.pack_into(self._map, chosen, key_hash, new_tat)
+                return decision
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def clear(self):
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._map[:] = bytes(len(self._map))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+def _default_backend():
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if 'django_redis' in backend:
+        from django_redis import get_redis_connection
+        return RedisBackend(get_redis_connection('default'))
+    path = getattr(settings, 'RATELIMIT_SHARED_FILE', '')
+    if path and fcntl is not None:
+        return SharedMemoryBackend(path)
+    return LocalBackend()
+
+
+class RateLimiter:
+    """Front end for the backends; the backend is created on first use."""
+
+    def __init__(self, backend=None):
+        self._backend = backend
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._backend = _default_backend()
+        return self._backend
+
+    def hit(self, policy: str, identity: str, rate) -> Decision:
+        """
+        Take one token from ``identity``'s bucket under ``policy``.
+
+        Args:
+            policy: Bounded name of the limit (view name, throttle scope,
+                'detector'), used as the metrics label
+            identity: Who is limited (IP address, user id)
+            rate: Rate or rate string such as '10/m'
+        """
+        rate = parse_rate(rate)
+        key = f'{KEY_PREFIX}:{policy}:{rate.limit}/{rate.period:g}:{identity}'
+        decision = self.backend.hit(key, rate)
+        RATE_LIMIT_DECISIONS.labels(
+            policy=policy, decision='allowed' if decision.allowed else 'denied'
+        ).inc()
+        return decision
+
+    def reset(self):
+        """Forget every bucket (used between tests)."""
+        self.backend.clear()
+
+
+# Global instance
+limiter = RateLimiter()
+
+
+def request_identity(request, key: str) -> str:
+    """
+    Identity for a django-ratelimit style key: 'ip', or 'user' (the user id,
+    falling back to the IP for anonymous requests).
+    """
+    from .metrics import _get_client_ip
+
+    if key == 'user':
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+    elif key != 'ip':
+        raise ValueError(f'Unsupported rate limit key: {key!r}')
+    return f'ip:{_get_client_ip(request)}'
+
+
+class RateLimitThrottle(BaseThrottle):
+    """
+    DRF throttle backed by the shared limiter. It replaces the
+    AnonRateThrottle + UserRateThrottle pair with one decision per request:
+    authenticated users get the 'user' rate, keyed by id, and anonymous
+    requests get the 'anon' rate, keyed by client IP.
+    """
+
+    def allow_request(self, request, view):
+        from rest_framework.settings import api_settings
+
+        scope = 'user' if request.user and request.user.is_authenticated else 'anon'
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+        self.decision = limiter.hit(f'throttle:{scope}', request_identity(request, 'user'), rate)
+        return self.decision.allowed
+
+    def wait(self):
+        decision = getattr(self, 'decision', None)
+        return math.ceil(decision.retry_after) if decision and not decision.allowed else None
@@ -4,11 +4,19 @@ Provides validation, sanitization, and protection utilities
 """
 import re
 import logging
+import time
 from functools import wraps
 from django.conf import settings
 from rest_framework.response import Response
 from rest_framework import status
 
+from .alerts import alert_dispatcher
+from .correlation import correlator
+from .metrics import SECURITY_SCAN_LIMITED
+from .ratelimit import Rate, limiter
+from .threats import CATEGORIES as THREAT_CATEGORIES, scanner as threat_scanner
+from .user_agent import user_agent_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -187,31 +195,21 @@ class OAuthSecurityManager:
 
 def rate_limit_by_ip(rate: str = '10/m'):
     """
-    Decorator to rate limit by IP address using django-ratelimit.
+    Decorator to rate limit by IP address using the shared limiter (api.ratelimit).
     Usage: @rate_limit_by_ip('10/m')
     """
-    from django_ratelimit.decorators import ratelimit
-    from django_ratelimit.exceptions import Ratelimited
+    from .ratelimit import limiter, request_identity
 
     def decorator(func):
         @wraps(func)
         def wrapper(request, *args, **kwargs):
-            limited = getattr(request, 'limited', False)
-            if not limited:
-                # Apply ratelimit check inline
-                decorated = ratelimit(key='ip', rate=rate, block=False)(func)
-                result = decorated(request, *args, **kwargs)
-                if getattr(request, 'limited', False):
-                    from rest_framework.response import Response as DRFResponse
-                    return DRFResponse(
-                        {'error': 'Too many requests. Please try again later.'},
-                        status=429
-                    )
-                return result
-            return Response(
-                {'error': 'Too many requests. Please try again later.'},
-                status=429
-            )
+            policy = f'{func.__module__}.{func.__qualname__}'
+            if not limiter.hit(policy, request_identity(request, 'ip'), rate).allowed:
+                return Response(
+                    {'error': 'Too many requests. Please try again later.'},
+                    status=429
+                )
+            return func(request, *args, **kwargs)
         return wrapper
     return decorator
 
@@ -349,10 +347,6 @@ def create_success_response(data: dict, message: str = None, status_code: int =
 # Malicious Activity Detection & Alerting
 # ===========================================
 
-import sentry_sdk
-from django.core.cache import cache
-
-
 class MaliciousActivityDetector:
     """
     Detects and logs suspicious activity patterns.
@@ -367,59 +361,20 @@ class MaliciousActivityDetector:
     - Admin panel probing
     """
     
-    # SQL Injection patterns
-    SQL_INJECTION_PATTERNS = [
-        r"('|\")\s*(or|and)\s*('|\"|\d+)=",
-        r"(union|select|insert|update|delete|drop|create|alter)\s*\(",
-        r"(union|select|insert|update|delete|drop|create|alter).*\s+(from|into|where)",
-        r";\s*(drop|create|alter|delete|update|insert)",
-        r"--\s*$",
-        r"/\*.*\*/",
-        r"xp_",
-        r"sp_",
-    ]
-    
-    # XSS patterns
-    XSS_PATTERNS = [
-        r"<\s*script[^>]*>",
-        r"javascript:",
-        r"on(load|error|click|mouseover|keypress)\s*=",
-        r"<\s*iframe",
-        r"<\s*object",
-        r"<\s*embed",
-        r"<\s*img[^>]*on",
-        r"<\s*svg[^>]*on",
-    ]
-    
-    # Path traversal patterns  
-    PATH_TRAVERSAL_PATTERNS = [
-        r"\.\./",
-        r"\.\.",
-        r"%2e%2e",
-        r"\.\.\\",
-    ]
-    
-    # Suspicious patterns
-    SUSPICIOUS_PATTERNS = {
-        'admin_probe': r"/(admin|manager|administrator|wp-admin|phpmyadmin)/",
-        'config_probe': r"/(config|\.env|\.git|\.hg|\.svn)/",
-        'backup_probe': r"\.(bak|backup|old|tar|zip|rar|gz)$",
-        'shell_probe': r"\.(php|aspx|jsp|py|rb)\?",
-    }
+    # Threat patterns live in api.threats (RULES) and are matched in a
+    # single keyword-prefiltered pass by the shared ThreatScanner
     
     # Cache configuration for rate limiting
     RATE_LIMIT_WINDOW = 3600  # 1 hour
     RATE_LIMIT_THRESHOLD = 100  # requests per window
     
     def __init__(self):
-        """Initialize detector with compiled regex patterns."""
-        self.sql_patterns = [re.compile(p, re.IGNORECASE) for p in self.SQL_INJECTION_PATTERNS]
-        self.xss_patterns = [re.compile(p, re.IGNORECASE) for p in self.XSS_PATTERNS]
-        self.path_patterns = [re.compile(p, re.IGNORECASE) for p in self.PATH_TRAVERSAL_PATTERNS]
-        self.suspicious_patterns = {
-            k: re.compile(v, re.IGNORECASE) 
-            for k, v in self.SUSPICIOUS_PATTERNS.items()
-        }
+        """Initialize detector with the shared threat scanner."""
+        self.scanner = threat_scanner
+        self.max_field_length = getattr(settings, 'SECURITY_SCAN_MAX_FIELD_LENGTH', 8192)
+        self.scan_budget = getattr(settings, 'SECURITY_SCAN_BUDGET_MS', 25) / 1000
+        # The same few User-Agent strings arrive on nearly every request
+        self._scan_user_agent = user_agent_cache('detector')(self._scan_user_agent)
     
     def check_request(self, request) -> dict:
         """
@@ -444,29 +399,17 @@ class MaliciousActivityDetector:
                 'severity': 'HIGH'
             })
         
-        # Check URL for patterns
-        url_threats = self._check_string(request.path, 'URL')
-        threats.extend(url_threats)
-        
-        # Check query string
+        # Fields to scan: URL, query string, POST data and a few headers
+        fields = [('URL', request.path)]
         if request.GET:
-            query_threats = self._check_dict(request.GET.dict(), 'Query Parameter')
-            threats.extend(query_threats)
-        
-        # Check POST data
+            fields.extend((f'Query Parameter: {k}', v) for k, v in request.GET.dict().items())
         if request.method == 'POST' and request.POST:
-            post_threats = self._check_dict(request.POST.dict(), 'POST Parameter')
-            threats.extend(post_threats)
-        
-        # Check headers for suspicious content
-        headers_to_check = ['User-Agent', 'Referer', 'X-Forwarded-For']
-        for header in headers_to_check:
-            header_key = f'HTTP_{header.upper().replace("-", "_")}'
-            if header_key in request.META:
-                header_value = request.META.get(header_key, '')
-                if header_value:
-                    header_threats = self._check_string(header_value, f'Header: {header}')
-                    threats.extend(header_threats)
+            fields.extend((f'POST Parameter: {k}', v) for k, v in request.POST.dict().items())
+        for header in ('User-Agent', 'Referer', 'X-Forwarded-For'):
+            header_value = request.META.get(f'HTTP_{header.upper().replace("-", "_")}', '')
+            if header_value:
+                fields.append((f'Header: {header}', header_value))
+        threats.extend(self._check_fields(fields))
         
         # Determine severity
         severity = 'LOW'
@@ -487,69 +430,79 @@ class MaliciousActivityDetector:
         }
     
     def _check_string(self, value: str, field_name: str) -> list:
-        """Check a string for malicious patterns."""
+        """Check a string for malicious patterns (one threat per category)."""
         threats = []
         
         if not value:
             return threats
         
-        # Check SQL injection
-        for pattern in self.sql_patterns:
-            if pattern.search(value):
-                threats.append({
-                    'type': 'sql_injection',
-                    'field': field_name,
-                    'description': f'Possible SQL injection in {field_name}',
-                    'severity': 'CRITICAL',
-                    'pattern': 'SQL injection detected'
-                })
-                break  # Only report once per field
-        
-        # Check XSS
-        for pattern in self.xss_patterns:
-            if pattern.search(value):
-                threats.append({
-                    'type': 'xss',
-                    'field': field_name,
-                    'description': f'Possible XSS attempt in {field_name}',
-                    'severity': 'CRITICAL',
-                    'pattern': 'XSS payload detected'
-                })
-                break
+        for category in self.scanner.scan(value):
+            details = THREAT_CATEGORIES[category]
+            threats.append({
+                'type': category,
+                'field': field_name,
+                'description': details.description.format(field=field_name),
+                'severity': details.severity,
+                'pattern': details.label
+            })
         
-        # Check path traversal
-        for pattern in self.path_patterns:
-            if pattern.search(value):
+        return threats
+    
+    def _check_fields(self, fields) -> list:
+        """
+        Check (field name, value) pairs within the per-request scan budget.
+
+        Values longer than SECURITY_SCAN_MAX_FIELD_LENGTH characters are
+        scanned at their head and tail only, and a MEDIUM threat records that
+        the middle was not. When scanning takes longer than
+        SECURITY_SCAN_BUDGET_MS, the remaining fields are skipped and a
+        MEDIUM threat records the truncation.
+        """
+        threats = []
+        deadline = time.perf_counter() + self.scan_budget
+        for index, (field_name, value) in enumerate(fields):
+            if not isinstance(value, str) or not value:
+                continue
+            if time.perf_counter() > deadline:
+                SECURITY_SCAN_LIMITED.labels(reason='time_budget').inc()
                 threats.append({
-                    'type': 'path_traversal',
+                    'type': 'scan_budget_exceeded',
                     'field': field_name,
-                    'description': f'Possible path traversal in {field_name}',
-                    'severity': 'HIGH',
-                    'pattern': 'Path traversal detected'
+                    'description': f'Threat scan budget exceeded; {len(fields) - index} field(s) not scanned',
+                    'severity': 'MEDIUM',
+                    'pattern': 'scan_budget_exceeded'
                 })
                 break
-        
-        # Check suspicious patterns
-        for pattern_name, pattern in self.suspicious_patterns.items():
-            if pattern.search(value):
+            if len(value) > self.max_field_length:
+                SECURITY_SCAN_LIMITED.labels(reason='field_length').inc()
                 threats.append({
-                    'type': pattern_name,
+                    'type': 'field_too_long',
                     'field': field_name,
-                    'description': f'Suspicious pattern ({pattern_name}) in {field_name}',
-                    'severity': 'MEDIUM' if pattern_name != 'admin_probe' else 'HIGH',
-                    'pattern': pattern_name
+                    'description': f'{field_name} is {len(value)} characters; only its first and last '
+                                   f'{self.max_field_length} were scanned',
+                    'severity': 'MEDIUM',
+                    'pattern': 'field_too_long'
                 })
-        
+                found = self._check_string(value[:self.max_field_length], field_name)
+                seen = {t['type'] for t in found}
+                found.extend(
+                    t for t in self._check_string(value[-self.max_field_length:], field_name)
+                    if t['type'] not in seen
+                )
+                threats.extend(found)
+            elif field_name == 'Header: User-Agent':
+                threats.extend(self._scan_user_agent(value))
+            else:
+                threats.extend(self._check_string(value, field_name))
         return threats
     
+    def _scan_user_agent(self, user_agent: str) -> tuple:
+        """Check the User-Agent header (memoized per raw value in __init__)."""
+        return tuple(self._check_string(user_agent, 'Header: User-Agent'))
+    
     def _check_dict(self, data: dict, prefix: str) -> list:
         """Check dictionary values for malicious patterns."""
-        threats = []
-        for key, value in data.items():
-            if isinstance(value, str):
-                field_threats = self._check_string(value, f'{prefix}: {key}')
-                threats.extend(field_threats)
-        return threats
+        return self._check_fields([(f'{prefix}: {key}', value) for key, value in data.items()])
     
     def _get_client_ip(self, request) -> str:
         """Get client IP address from request."""
@@ -567,14 +520,8 @@ class MaliciousActivityDetector:
         Returns:
             bool: True if within limit, False if exceeded
         """
-        cache_key = f'malicious_requests:{ip}'
-        count = cache.get(cache_key, 0)
-        
-        if count >= self.RATE_LIMIT_THRESHOLD:
-            return False
-        
-        cache.set(cache_key, count + 1, self.RATE_LIMIT_WINDOW)
-        return True
+        rate = Rate(self.RATE_LIMIT_THRESHOLD, self.RATE_LIMIT_WINDOW)
+        return limiter.hit('detector', ip, rate).allowed
     
     def log_threat(self, detection_result: dict, request=None):
         """
@@ -594,9 +541,16 @@ class MaliciousActivityDetector:
         threat_descriptions = [t['description'] for t in threats]
         message = f"[{severity}] Security Threat Detected: {'; '.join(threat_descriptions)}"
         
-        # Send to Sentry for HIGH/CRITICAL threats
+        # Send to Sentry for HIGH/CRITICAL threats, coalesced off the request thread
         if severity in ['HIGH', 'CRITICAL']:
-            self._send_to_sentry(message, detection_result, severity)
+            alert_dispatcher.submit(message, detection_result, severity)
+        
+        # Repeated threats from one IP raise a SecurityAlert
+        correlator.record(
+            'threat',
+            ip=detection_result['ip'],
+            threat_types=sorted({t['type'] for t in threats}),
+        )
         
         # Log locally
         log_level = 'warning' if severity == 'MEDIUM' else 'error'
@@ -610,27 +564,6 @@ class MaliciousActivityDetector:
                 'request_user': str(request.user) if request and request.user else None,
             }
         )
-    
-    def _send_to_sentry(self, message: str, detection_result: dict, severity: str):
-        """Send security event to Sentry."""
-        with sentry_sdk.push_scope() as scope:
-            scope.set_context('security_threat', {
-                'severity': severity,
-                'threats': str(detection_result['threats']),
-                'ip': detection_result['ip'],
-                'path': detection_result['path'],
-                'method': detection_result['method'],
-            })
-            
-            # Set level based on severity
-            level = 'error' if severity in ['HIGH', 'CRITICAL'] else 'warning'
-            scope.set_level(level)
-            
-            # Add tag for filtering in Sentry
-            scope.set_tag('security_threat', severity.lower())
-            scope.set_tag('threat_detected', 'true')
-            
-            sentry_sdk.capture_message(message, level=level)
 
 
 # Global instance
@@ -648,69 +581,78 @@ class SecurityLogger:
     @staticmethod
     def log_login_attempt(user, ip_address, user_agent, status='failed'):
         """
-        Log a login attempt with device and geolocation information.
+        Log a login attempt with device information.
+
+        The LoginActivity row is written in a batch by api.audit.audit_log,
+        like ActivityLog (inline when AUDIT_LOG_ASYNC is off).
+
+        Returns:
+            bool: False if the record could not be queued
         """
-        from .models import LoginActivity
-        try:
-            from user_agents import parse as parse_user_agent
-        except ImportError:
-            parse_user_agent = None
+        from django.utils import timezone
+        from .audit import audit_log
+        from .user_agent import classify
         
+        user_agent = (user_agent or '')[:1000]  # Truncate long user agents
         try:
-            # Parse user agent when the optional dependency is installed.
-            ua = parse_user_agent(user_agent) if parse_user_agent else None
-            
-            # Create login activity record
-            activity = LoginActivity.objects.create(
-                user=user,
-                status=status,
-                ip_address=ip_address,
-                user_agent=user_agent[:1000],  # Truncate long user agents
-                device_type=(ua.device.family if ua else '') or '',
-                browser=(f"{ua.browser.family or ''} {ua.browser.version_string or ''}".strip() if ua else ''),
-                os=(f"{ua.os.family or ''} {ua.os.version_string or ''}".strip() if ua else ''),
-            )
+            ua = classify(user_agent)
+            queued = audit_log.enqueue({
+                'model': 'login',
+                'user_id': user.pk if user else None,
+                'status': status,
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+                'device_type': ua.device_type.lower() if ua.device_type != 'Unknown' else '',
+                'browser': ua.browser_label,
+                'os': ua.os if ua.os != 'Unknown' else '',
+                'created_at': timezone.now().isoformat(),
+            })
             
             # Log to Python logger
-            browser_family = ua.browser.family if ua else 'unknown-browser'
-            logger.info(f"Login {status.upper()}: {user.email if user else 'Unknown'} from {ip_address} via {browser_family}")
+            logger.info(
+                f"Login {status.upper()}: {user.email if user else 'Unknown'} from {ip_address} via {ua.browser}"
+            )
             
-            # Check for brute force
+            # Correlate: brute force on failures, new countries on success
             if status in ['failed', 'invalid_credentials']:
-                SecurityLogger._check_brute_force(ip_address)
+                correlator.record('login_failed', ip=ip_address, user=user)
+            elif status == 'success':
+                # No geolocation is done at login, so there is no country yet
+                correlator.record('login_success', ip=ip_address, user=user)
             
-            return activity
+            return queued
             
         except Exception as e:
             logger.error(f"Error logging login attempt: {str(e)}", exc_info=True)
-            # Still create a minimal record
-            from .models import LoginActivity
-            return LoginActivity.objects.create(
-                user=user,
-                status=status,
-                ip_address=ip_address,
-                user_agent=user_agent[:1000]
-            )
+            return False
     
     @staticmethod
     def log_activity(user, action, description, object_type=None, object_id=None,
                     ip_address=None, success=True, error_message=None):
         """
         Log a user activity for audit trail.
+
+        The ActivityLog row is written in a batch by api.audit.audit_log
+        (inline when AUDIT_LOG_ASYNC is off).
+
+        Returns:
+            bool: False if the record could not be queued
         """
-        from .models import ActivityLog
+        from django.utils import timezone
+        from .audit import audit_log
         
         try:
-            activity = ActivityLog.objects.create(
-                user=user,
-                action=action,
-                description=description,
-                object_type=object_type or '',
-                object_id=object_id,
-                ip_address=ip_address,
-                success=success,
-                error_message=error_message or ''
-            )
+            queued = audit_log.enqueue({
+                'user_id': user.pk if user else None,
+                'action': action,
+                'description': description,
+                'object_type': object_type or '',
+                'object_id': object_id,
+                'ip_address': ip_address,
+                'success': success,
+                'error_message': error_message or '',
+                'created_at': timezone.now().isoformat(),
+            })
             
             # Log to Python logger
             log_msg = f"{action}: {user.email if user else 'System'} - {description}"
@@ -719,80 +661,41 @@ class SecurityLogger:
             else:
                 logger.warning(f"{log_msg} (Error: {error_message})")
             
-            return activity
-            
-        except Exception as e:
-            logger.error(f"Error logging activity: {str(e)}", exc_info=True)
-    
-    @staticmethod
-    def _check_brute_force(ip_address):
-        """
-        Check for brute force patterns and create alert if detected.
-        """
-        from django.utils import timezone
-        from datetime import timedelta
-        from .models import LoginActivity, SecurityAlert
-        
-        try:
-            five_minutes_ago = timezone.now() - timedelta(minutes=5)
+            correlator.record('activity', ip=ip_address, user=user, action=action)
             
-            # Count failed attempts in last 5 minutes
-            failed_5m = LoginActivity.objects.filter(
-                ip_address=ip_address,
-                status__in=['failed', 'invalid_credentials'],
-                created_at__gte=five_minutes_ago
-            ).count()
+            return queued
             
-            if failed_5m >= 5:
-                # Check if alert already exists for this IP
-                existing = SecurityAlert.objects.filter(
-                    alert_type='brute_force',
-                    evidence__ip=ip_address,
-                    status='open'
-                ).exists()
-                
-                if not existing:
-                    SecurityAlert.objects.create(
-                        alert_type='brute_force',
-                        severity='high' if failed_5m >= 10 else 'medium',
-                        title=f"Brute force attack from {ip_address}",
-                        description=f"{failed_5m} failed login attempts from {ip_address} in 5 minutes",
-                        evidence={'ip': ip_address, 'attempts': failed_5m}
-                    )
-                    logger.warning(f"Brute force alert created for {ip_address}")
-        
         except Exception as e:
-            logger.error(f"Error checking brute force: {str(e)}", exc_info=True)
+            logger.error(f"Error logging activity: {str(e)}", exc_info=True)
+            return False
 
 
 class AnomalyDetector:
     """
     Detect unusual patterns in user behavior.
+
+    Answers come from the streaming counters in api.correlation, which also
+    raise the matching SecurityAlerts as events arrive.
     """
     
     @staticmethod
-    def check_mass_api_requests(user, time_window_minutes=5, threshold=100):
+    def check_mass_api_requests(user, threshold=None):
         """
-        Check if user is making too many API requests.
+        Check if user is making too many API requests (over the
+        mass_api_requests rule window).
         """
-        from django.utils import timezone
-        from datetime import timedelta
-        from .models import ActivityLog
+        from .correlation import RULES
         
         try:
-            time_window = timezone.now() - timedelta(minutes=time_window_minutes)
-            
-            request_count = ActivityLog.objects.filter(
-                user=user,
-                action='api_request',
-                created_at__gte=time_window
-            ).count()
+            rule = next(r for r in RULES if r.name == 'mass_api_requests')
+            threshold = threshold if threshold is not None else rule.levels[0][0]
+            request_count = correlator.count(rule.name, user.pk)
             
             is_abuse = request_count > threshold
             
             if is_abuse:
                 logger.warning(
-                    f"API abuse detected: {user.email} made {request_count} requests in {time_window_minutes} minutes"
+                    f"API abuse detected: {user.email} made {request_count} requests in {rule.window // 60} minutes"
                 )
             
             return is_abuse
@@ -804,39 +707,11 @@ class AnomalyDetector:
     @staticmethod
     def check_unusual_location(user):
         """
-        Check if user logged in from a new or unusual location.
+        Check if user's last successful login came from a new country.
         """
-        from .models import LoginActivity
-        from django.utils import timezone
-        from datetime import timedelta
-        
         try:
-            # Get last successful login
-            last_login = LoginActivity.objects.filter(
-                user=user,
-                status='success'
-            ).order_by('-created_at').first()
-            
-            if not last_login:
-                return False
-            
-            # Get all unique countries from last 30 days
-            thirty_days_ago = timezone.now() - timedelta(days=30)
-            known_countries = LoginActivity.objects.filter(
-                user=user,
-                status='success',
-                created_at__gte=thirty_days_ago
-            ).values_list('country', flat=True).distinct()
-            
-            known_countries = set(c for c in known_countries if c)
-            
-            # If first login or no country data, not unusual
-            if not known_countries:
-                return False
-            
-            # Latest login is unusual if from new country
-            return last_login.country not in known_countries
+            return correlator.is_unusual_location(user)
         
         except Exception as e:
             logger.error(f"Error checking location: {str(e)}", exc_info=True)
-            return False
\ No newline at end of file
+            return False
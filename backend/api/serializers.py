@@ -8,6 +8,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from django.utils.text import get_valid_filename
+from . import hashing
 from .models import MediaUpload, Visitor
 
 logger = logging.getLogger(__name__)
@@ -63,13 +64,15 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        user = User.objects.create_user(
-            email=validated_data['email'],
-            password=validated_data['password'],
+        # Same as User.objects.create_user, with the hashing on the pool
+        user = User(
+            email=User.objects.normalize_email(validated_data['email']),
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', ''),
             user_type='registered',
         )
+        hashing.set_password(user, validated_data['password'])
+        user.save()
         return user
 
 
@@ -98,13 +101,17 @@ class SocialAuthSerializer(serializers.Serializer):
             logger.warning(f"OAuth login attempted without provider_token for provider: {provider}")
             raise serializers.ValidationError("provider_token is required for OAuth authentication.")
         
-        # Verify token and extract user information
-        verified, user_info = self._verify_oauth_token(
-            provider, 
-            provider_token, 
-            attrs.get('provider_id'), 
-            attrs.get('email')
-        )
+        # Verify token and extract user information. Async views verify
+        # before validating and pass the result in as context.
+        verification = self.context.get('oauth_verification')
+        if verification is None:
+            verification = self._verify_oauth_token(
+                provider, 
+                provider_token, 
+                attrs.get('provider_id'), 
+                attrs.get('email')
+            )
+        verified, user_info = verification
         if not verified:
             raise serializers.ValidationError("OAuth token verification failed. Invalid or expired token.")
         
@@ -125,154 +132,13 @@ class SocialAuthSerializer(serializers.Serializer):
 
     def _verify_oauth_token(self, provider, token, expected_id, expected_email):
         """
-        Verify OAuth token with the provider.
+        Verify OAuth token with the provider (api.oauth.verify_oauth_token).
         Returns (True, user_info) if verified, (False, None) otherwise.
-        
-        Uses safe URL parameter passing to prevent injection issues.
-        - Google: https://oauth2.googleapis.com/tokeninfo
-        - Facebook: https://graph.facebook.com/debug_token
         """
-        import requests
-        from django.conf import settings
-        from api.security import OAuthSecurityManager, AuditLogger
-        
-        try:
-            if provider == 'google':
-                # SECURITY: Client ID is REQUIRED - fail closed if not configured
-                client_id = OAuthSecurityManager.get_oauth_client_id('google')
-                if not client_id:
-                    AuditLogger.log_security_event(
-                        'oauth_verification_failed',
-                        'high',
-                        {'provider': 'google', 'reason': 'client_id_not_configured'}
-                    )
-                    return False, None
-                
-                clean_client_id = client_id.strip()
-                
-                # Try ID token verification first (from GoogleLogin component)
-                response = requests.get(
-                    'https://oauth2.googleapis.com/tokeninfo',
-                    params={'id_token': token},
-                    timeout=5
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    token_aud = data.get('aud', '')
-                    if token_aud != clean_client_id:
-                        logger.warning(f"Google token audience mismatch: token_aud={repr(token_aud)} client_id={repr(clean_client_id)}")
-                        return False, None
-                    if expected_id and data.get('sub') != expected_id:
-                        logger.warning("Google token user ID mismatch")
-                        return False, None
-                    if expected_email and data.get('email') != expected_email:
-                        logger.warning("Google token email mismatch")
-                        return False, None
-                    user_info = {
-                        'provider_id': data.get('sub'),
-                        'email': data.get('email'),
-                        'first_name': data.get('given_name'),
-                        'last_name': data.get('family_name'),
-                        'profile_image': data.get('picture')
-                    }
-                    return True, user_info
-                
-                # Fallback: try as access_token via userinfo endpoint (from useGoogleLogin)
-                userinfo_response = requests.get(
-                    'https://www.googleapis.com/oauth2/v3/userinfo',
-                    headers={'Authorization': f'Bearer {token}'},
-                    timeout=5
-                )
-                if userinfo_response.status_code == 200:
-                    data = userinfo_response.json()
-                    if expected_id and data.get('sub') != expected_id:
-                        logger.warning("Google access_token user ID mismatch")
-                        return False, None
-                    if expected_email and data.get('email') != expected_email:
-                        logger.warning("Google access_token email mismatch")
-                        return False, None
-                    user_info = {
-                        'provider_id': data.get('sub'),
-                        'email': data.get('email'),
-                        'first_name': data.get('given_name'),
-                        'last_name': data.get('family_name'),
-                        'profile_image': data.get('picture')
-                    }
-                    return True, user_info
-                
-                logger.warning(f"Google token verification failed (both id_token and access_token)")
-                return False, None
-                    
-            elif provider == 'facebook':
-                # Verify Facebook access token
-                app_id = getattr(settings, 'FACEBOOK_APP_ID', None)
-                app_secret = getattr(settings, 'FACEBOOK_APP_SECRET', None)
-                
-                if not app_id or not app_secret:
-                    logger.error("Facebook app credentials not configured - OAuth verification FAILED")
-                    # Always fail closed - never bypass OAuth verification
-                    return False, None
-                
-                # Build app access token safely to prevent logging of secrets
-                # Facebook requires app access token in format: app_id|app_secret
-                app_access_token = f"{app_id}|{app_secret}"
-                
-                # Use params for safe URL encoding
-                response = requests.get(
-                    'https://graph.facebook.com/debug_token',
-                    params={
-                        'input_token': token,
-                        'access_token': app_access_token
-                    },
-                    timeout=5
-                )
-                if response.status_code == 200:
-                    data = response.json().get('data', {})
-                    if data.get('is_valid', False):
-                        # Verify the user ID matches
-                        if expected_id and str(data.get('user_id')) != str(expected_id):
-                            logger.warning("Facebook token user ID mismatch")
-                            return False, None
-                        # For Facebook, we need to get the user's email from the graph API
-                        # using the access token
-                        user_response = requests.get(
-                            'https://graph.facebook.com/me',
-                            params={
-                                'fields': 'email,name,first_name,last_name,picture',
-                                'access_token': token
-                            },
-                            timeout=5
-                        )
-                        if user_response.status_code == 200:
-                            user_data = user_response.json()
-                            if expected_email and user_data.get('email') != expected_email:
-                                logger.warning("Facebook token email mismatch")
-                                return False, None
-                            # Extract user information from Facebook API
-                            user_info = {
-                                'provider_id': str(data.get('user_id')),
-                                'email': user_data.get('email'),
-                                'first_name': user_data.get('first_name'),
-                                'last_name': user_data.get('last_name'),
-                                'profile_image': user_data.get('picture', {}).get('data', {}).get('url')
-                            }
-                            return True, user_info
-                        else:
-                            logger.warning(f"Facebook email verification failed: {user_response.status_code}")
-                            return False, None
-                logger.warning(f"Facebook token verification failed: {response.status_code}")
-                return False, None
-                
-        except requests.RequestException as e:
-            logger.error(f"OAuth verification request failed: {e}")
-            # Security: Always fail closed on network errors - never bypass OAuth verification
-            return False, None
-        except Exception as e:
-            # Never allow unexpected OAuth parsing/provider issues to bubble up as 500.
-            logger.error(f"OAuth verification unexpected error: {e}", exc_info=True)
-            return False, None
-        
-        return False, None
+        from asgiref.sync import async_to_sync
+        from api.oauth import verify_oauth_token
+
+        return async_to_sync(verify_oauth_token)(provider, token, expected_id, expected_email)
 
     def create_or_get_user(self, validated_data):
         provider = validated_data['provider']
@@ -358,7 +224,7 @@ class AdminUserUpdateSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         
         if password and password.strip():
-            instance.set_password(password)
+            hashing.set_password(instance, password)
         
         instance.save()
         return instance
@@ -377,7 +243,7 @@ class PasswordChangeSerializer(serializers.Serializer):
         # change the password without knowing the original
         if not value:
             raise serializers.ValidationError("Current password is required.")
-        if not user.check_password(value):
+        if not hashing.check_password(user, value):
             raise serializers.ValidationError("Current password is incorrect.")
         return value
 
@@ -395,7 +261,7 @@ class PasswordChangeSerializer(serializers.Serializer):
         # Additional security: ensure new password is different from current
         user = self.context['request'].user
         current_password = attrs.get('current_password')
-        if current_password and user.check_password(new_password):
+        if current_password and hashing.check_password(user, new_password):
             raise serializers.ValidationError({'new_password': 'New password must be different from current password.'})
 
         return attrs
@@ -0,0 +1,1304 @@
+"""
+Tests for API infrastructure (tracking pipeline, metrics, security)
+"""
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import date, timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core import signing
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+import httpx
+from prometheus_client import REGISTRY
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+
+from django.utils import timezone
+
+from .analytics import get_session_stats, get_visitor_stats, rebuild_rollups, upsert_sessions
+from .models import (
+    ActivityLog, LoginActivity, OAuthState, SecurityAlert, Visitor, VisitorConsent, VisitorDailyBreakdown,
+    VisitorDailyStats, VisitorSession,
+)
+from .collectors import reconcile
+from .consent import COOKIE_SALT, read_consent
+from .metrics import _get_client_ip, get_registry
+from . import networks
+from .networks import CIDRMatcher
+from .ratelimit import LocalBackend, Rate, RateLimiter, SharedMemoryBackend, parse_rate
+from .correlation import correlator
+from .security import AnomalyDetector, SecurityLogger, detector
+from .alerts import SecurityAlertDispatcher
+from .authentication import CookieTokenAuthentication, _serialize, token_cache_key
+from .outbound import HTTPClientRegistry, InstrumentedPoolManager, InstrumentedTransport, ThreadedAsyncClient
+from .audit import AuditLogBuffer
+from .hashing import PasswordHashPool, _make, _verify
+from .idtokens import GoogleKeySet, InvalidIDToken, verify_google_id_token
+from .threats import RULES, scanner
+from .partitioning import add_months, ensure_partitions, partition_name, purge_before
+from .tracking import VisitorEventBuffer
+from .uniques import HyperLogLog, count_unique_visitors
+from .user_agent import cache_stats, classify
+
+
+def make_visitor_event(**overrides):
+    event = {
+        'visitor_id': 'visitor-1',
+        'anonymized_ip': '203.0.113.0',
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0) Chrome/120.0',
+        'referrer': '',
+        'path': '/work',
+        'user_id': None,
+        'visit_time': timezone.now(),
+        'device_type': 'Desktop',
+        'browser': 'Chrome',
+        'os': 'Windows',
+    }
+    event.update(overrides)
+    return event
+
+
+class VisitorEventBufferTest(TestCase):
+    """Tests for the buffered visitor write pipeline"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_flush_bulk_creates_visits(self):
+        """Test queued events are written in one batch with uniqueness and consent links"""
+        consent = VisitorConsent.objects.create(
+            session_key='visitor-1', consent_given=True, expires_at=timezone.now() + timedelta(days=90)
+        )
+        buffer = VisitorEventBuffer(max_size=10, batch_size=10, asynchronous=True)
+        buffer._queue.put_nowait(make_visitor_event())
+        buffer._queue.put_nowait(make_visitor_event(path='/about'))
+        buffer._queue.put_nowait(make_visitor_event(visitor_id='visitor-2'))
+
+        self.assertEqual(buffer.flush(), 3)
+
+        visits = Visitor.objects.order_by('id')
+        self.assertEqual([v.is_unique for v in visits], [True, False, False])
+        self.assertEqual([v.consent_record_id for v in visits], [consent.pk, consent.pk, None])
+        self.assertIsNotNone(visits[0].will_delete_at)
+
+    def test_full_buffer_drops_instead_of_blocking(self):
+        """Test events beyond max_size are counted as dropped"""
+        buffer = VisitorEventBuffer(max_size=1, batch_size=10, asynchronous=True)
+        buffer._queue.put_nowait(make_visitor_event())
+
+        self.assertFalse(buffer.enqueue(make_visitor_event()))
+        self.assertEqual(buffer.dropped, 1)
+        self.assertEqual(buffer.qsize(), 1)
+
+    def test_synchronous_mode_writes_inline(self):
+        """Test asynchronous=False writes without a flusher thread"""
+        buffer = VisitorEventBuffer(asynchronous=False)
+        self.assertTrue(buffer.enqueue(make_visitor_event()))
+        self.assertEqual(Visitor.objects.count(), 1)
+        self.assertIsNone(buffer._thread)
+
+
+class VisitorRollupTest(TestCase):
+    """Tests for the incrementally maintained daily rollups"""
+
+    def setUp(self):
+        cache.clear()
+        self.buffer = VisitorEventBuffer(batch_size=10, asynchronous=True)
+
+    def write(self, *events):
+        for event in events:
+            self.buffer._queue.put_nowait(event)
+        self.buffer.flush()
+
+    def test_incremental_rollups_match_rebuild(self):
+        """Test write-time increments agree with a full recompute"""
+        self.write(
+            make_visitor_event(visitor_id='a', path='/'),
+            make_visitor_event(visitor_id='b', path='/', anonymized_ip='198.51.100.0'),
+        )
+        # Second batch turns session "a" from a bounce into a two-page session
+        self.write(make_visitor_event(visitor_id='a', path='/work', browser='Firefox'))
+
+        today = timezone.now().date()
+        incremental = VisitorDailyStats.objects.get(date=today)
+        self.assertEqual(
+            (incremental.visits, incremental.unique_visitors, incremental.sessions, incremental.single_page_sessions),
+            (3, 2, 2, 1),
+        )
+        breakdown = dict(
+            VisitorDailyBreakdown.objects.filter(date=today, dimension='path').values_list('value', 'count')
+        )
+        self.assertEqual(breakdown, {'/': 2, '/work': 1})
+
+        rebuilt = rebuild_rollups(today)
+        self.assertEqual(
+            (rebuilt.visits, rebuilt.unique_visitors, rebuilt.sessions, rebuilt.single_page_sessions),
+            (3, 2, 2, 1),
+        )
+        self.assertEqual(rebuilt.session_seconds, incremental.session_seconds)
+
+    def test_stats_served_from_rollups(self):
+        """Test get_visitor_stats reads totals and distributions from rollups"""
+        self.write(
+            make_visitor_event(visitor_id='a'),
+            make_visitor_event(visitor_id='b', anonymized_ip='198.51.100.0', browser='Firefox'),
+        )
+        stats = get_visitor_stats()
+        self.assertEqual(stats['total_visitors'], 2)
+        self.assertEqual(stats['bounce_rate'], 100.0)
+        self.assertEqual(stats['browser_distribution'], {'Chrome': 1, 'Firefox': 1})
+        self.assertEqual(stats['daily_trend'][-1]['visits'], 2)
+        self.assertEqual(len(stats['daily_trend']), 7)
+
+    def test_sessions_track_duration_and_exit_path(self):
+        """Test VisitorSession upserts feed bounce rate and average duration"""
+        start = timezone.now() - timedelta(minutes=10)
+        self.write(
+            make_visitor_event(visitor_id='a', path='/', visit_time=start),
+            make_visitor_event(visitor_id='b', anonymized_ip='198.51.100.0', visit_time=start),
+        )
+        self.write(make_visitor_event(visitor_id='a', path='/contact', visit_time=start + timedelta(minutes=4)))
+
+        session = VisitorSession.objects.get(session_key=f'a.{int(start.timestamp())}')
+        self.assertEqual((session.page_count, session.entry_path, session.exit_path), (2, '/', '/contact'))
+        self.assertEqual(session.duration, timedelta(minutes=4))
+
+        # Served from the daily rollups, however many sessions there are
+        with self.assertNumQueries(1):
+            stats = get_session_stats()
+        self.assertEqual(stats['bounce_rate'], 50.0)
+        self.assertEqual(stats['average_session_duration'], 120.0)
+
+    def test_session_upserts_add_pages_and_widen_times(self):
+        """Test a session flushed by two batches keeps both page counts and its earliest entry"""
+        start = timezone.now() - timedelta(minutes=10)
+        key = f'a.{int(start.timestamp())}'
+        late = Visitor(session_key=key, path='/contact', visit_time=start + timedelta(minutes=5))
+        early = Visitor(session_key=key, path='/', visit_time=start)
+        upsert_sessions([late])
+        upsert_sessions([early, Visitor(session_key=key, path='/work', visit_time=start + timedelta(minutes=2))])
+
+        session = VisitorSession.objects.get(session_key=key)
+        self.assertEqual(session.page_count, 3)
+        self.assertEqual((session.first_seen, session.last_seen), (start, start + timedelta(minutes=5)))
+        self.assertEqual((session.entry_path, session.exit_path), ('/', '/contact'))
+        # The first flush's one-page session is replaced, not added to, in the rollups
+        stats = get_session_stats()
+        self.assertEqual((stats['sessions'], stats['bounce_rate'], stats['average_session_duration']), (1, 0, 300.0))
+
+    @override_settings(VISITOR_SESSION_IDLE_MINUTES=30)
+    def test_inactivity_starts_a_new_session(self):
+        """Test a returning visitor's visits are split into sessions after 30 idle minutes"""
+        start = timezone.now() - timedelta(hours=2)
+        self.write(
+            make_visitor_event(visitor_id='a', path='/', visit_time=start),
+            make_visitor_event(visitor_id='a', path='/work', visit_time=start + timedelta(minutes=20)),
+        )
+        self.write(make_visitor_event(visitor_id='a', path='/contact', visit_time=start + timedelta(minutes=45)))
+        self.write(make_visitor_event(visitor_id='a', path='/', visit_time=start + timedelta(minutes=90)))
+
+        sessions = list(VisitorSession.objects.order_by('first_seen').values_list('session_key', 'page_count'))
+        self.assertEqual(sessions, [
+            (f'a.{int(start.timestamp())}', 3),
+            (f'a.{int((start + timedelta(minutes=90)).timestamp())}', 1),
+        ])
+        self.assertEqual(get_session_stats()['bounce_rate'], 50.0)
+
+
+class UserAgentClassificationTest(TestCase):
+    """Tests for the shared user-agent classifier"""
+
+    def test_classifies_common_user_agents(self):
+        """Test the more specific browser/OS token wins"""
+        edge = classify(
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+            '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.2210.91'
+        )
+        self.assertEqual((edge.device_type, edge.browser, edge.os), ('Desktop', 'Edge', 'Windows'))
+        self.assertEqual(edge.browser_label, 'Edge 120.0.2210.91')
+
+        iphone = classify(
+            'Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 '
+            '(KHTML, like Gecko) Version/17.1 Mobile/15E148 Safari/604.1'
+        )
+        self.assertEqual((iphone.device_type, iphone.browser, iphone.os), ('Mobile', 'Safari', 'iOS'))
+        self.assertEqual(iphone.browser_version, '17.1')
+
+        self.assertTrue(classify('Googlebot/2.1 (+http://www.google.com/bot.html)').is_bot)
+        self.assertEqual(classify('').browser, 'Unknown')
+
+    def test_repeated_user_agent_hits_cache(self):
+        """Test lookups of the same raw string are served from the LRU"""
+        user_agent = 'Mozilla/5.0 (X11; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0'
+        classify(user_agent)
+        hits = cache_stats()['classify']['hits']
+        self.assertEqual(classify(user_agent).browser, 'Firefox')
+        self.assertEqual(cache_stats()['classify']['hits'], hits + 1)
+
+
+class UniqueVisitorSketchTest(TestCase):
+    """Tests for HyperLogLog unique-visitor counting"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_hyperloglog_estimate_within_error(self):
+        """Test the estimate stays within a few percent and merges as a union"""
+        first, second = HyperLogLog(), HyperLogLog()
+        for i in range(20000):
+            first.add(f'visitor-{i}')
+            second.add(f'visitor-{i + 10000}')
+        self.assertAlmostEqual(first.count(), 20000, delta=20000 * 0.05)
+        first.merge(second)
+        self.assertAlmostEqual(first.count(), 30000, delta=30000 * 0.05)
+
+    def test_batches_update_day_path_and_project_sketches(self):
+        """Test flushed visits are counted per day, path and project"""
+        buffer = VisitorEventBuffer(batch_size=10, asynchronous=True)
+        for event in (
+            make_visitor_event(path='/api/projects/portfolio/'),
+            make_visitor_event(visitor_id='b', anonymized_ip='198.51.100.0', path='/api/projects/portfolio/'),
+            make_visitor_event(visitor_id='c', anonymized_ip='192.0.2.0', path='/work'),
+        ):
+            buffer._queue.put_nowait(event)
+        buffer.flush()
+
+        today = timezone.now().date()
+        self.assertEqual(count_unique_visitors(today, today), 3)
+        self.assertEqual(count_unique_visitors(today, today, path='/work'), 1)
+        self.assertEqual(count_unique_visitors(today, today, project='portfolio'), 2)
+        self.assertEqual(get_visitor_stats()['unique_visitors'], 3)
+
+    def test_dashboard_merges_sketches_once_per_cache_ttl(self):
+        """Test the total and top-page uniques are merged in one store call, then served from the cache"""
+        from .uniques import get_store
+
+        buffer = VisitorEventBuffer(batch_size=10, asynchronous=True)
+        for event in (
+            make_visitor_event(path='/'),
+            make_visitor_event(visitor_id='b', anonymized_ip='198.51.100.0', path='/work'),
+        ):
+            buffer._queue.put_nowait(event)
+        buffer.flush()
+
+        store = get_store()
+        with mock.patch.object(store, 'count_many', wraps=store.count_many) as count_many:
+            first = get_visitor_stats()
+            second = get_visitor_stats()
+
+        self.assertEqual(count_many.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(
+            {page['path']: page['unique_visitors'] for page in first['popular_pages']}, {'/': 1, '/work': 1}
+        )
+        self.assertEqual(first['unique_visitors'], 2)
+
+
+class VisitorConsentCookieTest(TestCase):
+    """Tests for the signed visitor consent cookie"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        # Track synchronously instead of through the global flusher thread
+        patcher = mock.patch('api.middleware.visitor_buffer', VisitorEventBuffer(asynchronous=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_grant_sets_cookie_and_writes_audit_row_once(self):
+        """Test granting consent issues a signed cookie and one VisitorConsent row"""
+        response = self.client.post(reverse('visitor-consent'), {'consent': True}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(settings.VISITOR_CONSENT_COOKIE_NAME, response.cookies)
+        self.assertEqual(VisitorConsent.objects.filter(consent_given=True).count(), 1)
+
+        status = self.client.get(reverse('visitor-consent')).json()
+        self.assertTrue(status['consent'])
+
+        response = self.client.delete(reverse('visitor-consent'))
+        self.assertFalse(response.json()['consent'])
+        self.assertFalse(VisitorConsent.objects.get().consent_given)
+
+    def test_tampered_or_outdated_cookie_is_rejected(self):
+        """Test the cookie is only trusted with a valid signature and current version"""
+        request = RequestFactory().get('/')
+        payload = {'v': 'abc', 'cv': settings.VISITOR_CONSENT_VERSION, 'exp': int(time.time()) + 60}
+        name = settings.VISITOR_CONSENT_COOKIE_NAME
+
+        request.COOKIES[name] = signing.dumps(payload, salt=COOKIE_SALT)
+        self.assertEqual(read_consent(request).visitor_id, 'abc')
+
+        request.COOKIES[name] = signing.dumps(payload, salt=COOKIE_SALT)[:-2] + 'xx'
+        self.assertIsNone(read_consent(request))
+
+        request.COOKIES[name] = signing.dumps(dict(payload, cv='0.9'), salt=COOKIE_SALT)
+        self.assertIsNone(read_consent(request))
+
+        request.COOKIES[name] = signing.dumps(dict(payload, exp=int(time.time()) - 1), salt=COOKIE_SALT)
+        self.assertIsNone(read_consent(request))
+
+    def test_middleware_tracks_only_consented_visitors(self):
+        """Test tracking needs the consent cookie but no session"""
+        self.client.get('/api/projects/')
+        self.assertEqual(Visitor.objects.count(), 0)
+
+        self.client.post(reverse('visitor-consent'), {'consent': True}, format='json')
+        self.client.get('/api/projects/')
+
+        visitor_id = VisitorConsent.objects.get().session_key
+        session_key = Visitor.objects.get().session_key
+        self.assertTrue(session_key.startswith(f'{visitor_id}.'))
+
+    def test_page_views_within_five_minutes_are_one_session(self):
+        """Test a visitor's navigation from one IP is recorded, so the session is not a bounce"""
+        self.client.post(reverse('visitor-consent'), {'consent': True}, format='json')
+        self.client.get('/api/projects/')
+        self.client.get('/api/projects/')  # reload, not a new page view
+        self.client.get('/api/projects/skills/')
+
+        self.assertEqual(Visitor.objects.count(), 2)
+        session = VisitorSession.objects.get()
+        self.assertEqual((session.page_count, session.exit_path), (2, '/api/projects/skills/'))
+        self.assertEqual(get_session_stats()['bounce_rate'], 0)
+
+
+class VisitorListViewTest(TestCase):
+    """Tests for keyset pagination and streaming export of visitors"""
+
+    def setUp(self):
+        cache.clear()
+        admin = get_user_model().objects.create_user(
+            email='admin@example.com', password='adminpass123', user_type='admin'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+        now = timezone.now()
+        # Two rows share a timestamp so paging has to tie-break on id
+        times = [now, now - timedelta(minutes=1), now - timedelta(minutes=1), now - timedelta(minutes=2)]
+        buffer = VisitorEventBuffer(batch_size=10, asynchronous=True)
+        for i, visit_time in enumerate(times):
+            buffer._queue.put_nowait(make_visitor_event(path=f'/page-{i}', visit_time=visit_time))
+        buffer.flush()
+
+    def test_keyset_pages_cover_every_row_once(self):
+        """Test following next links walks all rows newest first without repeats"""
+        url = reverse('visitor-list') + '?page_size=3'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen.extend(row['id'] for row in data['results'])
+            url = data['next']
+        expected = list(Visitor.objects.order_by('-visit_time', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_streaming_exports(self):
+        """Test NDJSON and CSV exports stream every row"""
+        response = self.client.get(reverse('visitor-list'), {'export': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['ip_address'], '203.0.113.0')
+
+        response = self.client.get(reverse('visitor-list'), {'export': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['id', 'ip_address'])
+        self.assertEqual(len(lines), 5)
+
+    async def test_export_streams_under_asgi(self):
+        """Test the ASGI handler gets an async iterator that reads the export in chunks"""
+        from .views import VisitorListView
+
+        admin = await get_user_model().objects.aget(email='admin@example.com')
+        token = await Token.objects.acreate(user=admin)
+        with mock.patch.object(VisitorListView, 'EXPORT_CHUNK_SIZE', 2):
+            response = await self.async_client.get(
+                reverse('visitor-list'), {'export': 'ndjson'}, headers={'Authorization': f'Bearer {token.key}'}
+            )
+            self.assertTrue(response.is_async)
+            chunks = [chunk async for chunk in response.streaming_content]
+
+        self.assertEqual(len(chunks), 2)
+        rows = [json.loads(line) for line in b''.join(chunks).splitlines()]
+        self.assertEqual(len(rows), 4)
+
+
+class PartitionRetentionTest(TestCase):
+    """Tests for partition helpers and the row-batch retention fallback"""
+
+    def test_month_arithmetic_and_names(self):
+        """Test partitions are named and bounded per calendar month"""
+        self.assertEqual(add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(partition_name('api_visitor', date(2027, 2, 1)), 'api_visitor_p202702')
+
+    def test_purge_falls_back_to_batched_deletes(self):
+        """Test retention deletes expired rows in batches without partitions"""
+        now = timezone.now()
+        for days in (400, 380, 10):
+            log = ActivityLog.objects.create(action='login', description='test')
+            ActivityLog.objects.filter(pk=log.pk).update(created_at=now - timedelta(days=days))
+
+        with mock.patch('api.partitioning.DELETE_BATCH_SIZE', 1):
+            result = purge_before(ActivityLog, now - timedelta(days=365))
+
+        self.assertEqual(result, {'partitions': [], 'rows': 2})
+        self.assertEqual(ActivityLog.objects.count(), 1)
+
+    def test_failing_table_does_not_stop_the_others(self):
+        """Test a table whose partitions cannot be created is logged and skipped"""
+        def create(table, month, connection):
+            if table == 'api_activitylog':
+                raise DatabaseError('updated partition constraint for default partition would be violated')
+            return partition_name(table, month)
+
+        with mock.patch('api.partitioning.is_supported', return_value=True), \
+                mock.patch('api.partitioning.is_partitioned', return_value=True), \
+                mock.patch('api.partitioning.create_partition', side_effect=create), \
+                self.assertLogs('api.partitioning', 'ERROR'):
+            names = ensure_partitions([ActivityLog, LoginActivity], months_ahead=0, today=date(2027, 2, 14))
+
+        self.assertEqual(names, ['api_loginactivity_p202702'])
+
+
+class BusinessMetricsCollectorTest(TestCase):
+    """Tests for the counter/rollup-backed Prometheus collector"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_signals_adjust_reconciled_counters(self):
+        """Test write paths move the counters after reconcile() seeds them"""
+        self.assertIsNone(REGISTRY.get_sample_value('django_users_count'))
+        reconcile()
+        self.assertEqual(REGISTRY.get_sample_value('django_users_count'), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user = get_user_model().objects.create_user(email='metrics@example.com', password='pass12345')
+        self.assertEqual(REGISTRY.get_sample_value('django_users_count'), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(REGISTRY.get_sample_value('django_users_count'), 0)
+
+    def test_one_worker_reconciles_per_interval(self):
+        """Test reconciler threads in several workers share one reconcile() per interval"""
+        from .collectors import Reconciler
+
+        workers = [Reconciler(interval=600), Reconciler(interval=600)]
+        with mock.patch('api.collectors.reconcile') as reconcile_mock:
+            self.assertEqual([worker.run_once() for worker in workers], [True, False])
+            self.assertFalse(workers[0].run_once())
+        self.assertEqual(reconcile_mock.call_count, 1)
+
+    def test_visitor_gauges_read_rollups(self):
+        """Test visitor totals and distributions come from the rollup tables"""
+        buffer = VisitorEventBuffer(batch_size=10, asynchronous=True)
+        buffer._queue.put_nowait(make_visitor_event())
+        buffer._queue.put_nowait(make_visitor_event(visitor_id='b', browser='Firefox'))
+        buffer.flush()
+
+        self.assertEqual(REGISTRY.get_sample_value('django_visitors_count'), 2)
+        self.assertEqual(REGISTRY.get_sample_value('django_visitors_by_browser', {'browser': 'Firefox'}), 1)
+
+
+class HttpMetricsRouteLabelTest(TestCase):
+    """Tests for route-template labels on the HTTP request metrics"""
+
+    def setUp(self):
+        cache.clear()
+
+    def _sample(self, name, route, **labels):
+        return REGISTRY.get_sample_value(name, {'method': 'GET', 'route': route, **labels}) or 0
+
+    def test_requests_are_labelled_by_route_template(self):
+        """Test resolved URLs use the route template and the rest share 'unmatched'"""
+        route = 'api/auth/visitors/consent/'
+        before = self._sample('django_http_requests_total', route, status='200')
+        unmatched = self._sample('django_http_requests_total', 'unmatched', status='404')
+        queries = self._sample('django_http_request_db_queries_count', route)
+        sizes = self._sample('django_http_response_size_bytes_count', route)
+
+        self.client.get(reverse('visitor-consent'))
+        self.client.get('/no-such-page/123/')
+        self.client.get('/no-such-page/456/')
+
+        self.assertEqual(self._sample('django_http_requests_total', route, status='200'), before + 1)
+        self.assertEqual(self._sample('django_http_requests_total', 'unmatched', status='404'), unmatched + 2)
+        self.assertEqual(self._sample('django_http_request_db_queries_count', route), queries + 1)
+        self.assertEqual(self._sample('django_http_response_size_bytes_count', route), sizes + 1)
+        self.assertIsNone(REGISTRY.get_sample_value(
+            'django_http_requests_total', {'method': 'GET', 'route': '/no-such-page/123/', 'status': '404'}
+        ))
+
+
+class MultiprocessMetricsTest(TestCase):
+    """Tests for merging worker samples in Prometheus multiprocess mode"""
+
+    WORKER = (
+        "from prometheus_client import Counter\n"
+        "Counter('django_http_requests_total', 'Total HTTP requests', ['method', 'route', 'status'])"
+        ".labels('GET', 'api/health/', '200').inc()\n"
+    )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_registry_sums_samples_from_every_worker(self):
+        """Test /metrics/ reports totals across processes plus the business gauges"""
+        with tempfile.TemporaryDirectory() as path:
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': path}
+            for _worker in range(2):
+                subprocess.run([sys.executable, '-c', self.WORKER], env=env, check=True)
+            reconcile()
+
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': path}):
+                registry = get_registry()
+
+            self.assertIsNot(registry, REGISTRY)
+            labels = {'method': 'GET', 'route': 'api/health/', 'status': '200'}
+            self.assertEqual(registry.get_sample_value('django_http_requests_total', labels), 2)
+            self.assertEqual(registry.get_sample_value('django_users_count'), 0)
+
+
+class QueryInstrumentationTest(TestCase):
+    """Tests for per-request database instrumentation"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_queries_are_counted_and_shown_to_staff(self):
+        """Test query counters move and staff get X-DB-Queries/Server-Timing"""
+        route = 'api/auth/admin/users/'
+        labels = {'route': route, 'operation': 'SELECT'}
+        before = REGISTRY.get_sample_value('django_db_queries_total', labels) or 0
+        staff = get_user_model().objects.create_user(email='staff@example.com', password='pass12345', is_staff=True)
+        member = get_user_model().objects.create_user(email='member@example.com', password='pass12345')
+
+        self.client.force_authenticate(staff)
+        response = self.client.get(reverse('admin-users'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertGreater(REGISTRY.get_sample_value('django_db_queries_total', labels), before)
+
+        self.client.force_authenticate(member)
+        response = self.client.get(reverse('admin-users'))
+        self.assertNotIn('X-DB-Queries', response)
+
+    def test_middleware_chain_is_async_capable(self):
+        """Test no middleware forces async views back onto a thread under ASGI"""
+        from django.utils.module_loading import import_string
+
+        sync_only = [path for path in settings.MIDDLEWARE if not getattr(import_string(path), 'async_capable', False)]
+        self.assertEqual(sync_only, [])
+
+    @override_settings(DEBUG=True)
+    async def test_async_view_queries_are_counted(self):
+        """Test ORM work an async view runs through sync_to_async is counted"""
+        response = await self.async_client.post(
+            reverse('contact-create'),
+            {'name': 'Ada', 'email': 'ada@example.com', 'subject': 'Hello', 'message': 'Hello there'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+
+
+class CIDRMatcherTest(TestCase):
+    """Tests for the precompiled trusted-proxy / metrics allow-lists"""
+
+    def tearDown(self):
+        networks.reload()
+
+    def test_ranges_and_addresses_match(self):
+        """Test IPv4/IPv6 ranges, single addresses and invalid input"""
+        matcher = CIDRMatcher.parse('10.0.0.0/8, 10.1.0.0/16,192.168.1.5,bogus,2001:db8::/32')
+
+        self.assertEqual(matcher.spec, ('10.0.0.0/8', '10.1.0.0/16', '192.168.1.5', '2001:db8::/32'))
+        for ip in ('10.0.0.0', '10.255.255.255', '192.168.1.5', '2001:db8::1', '::ffff:10.9.9.9'):
+            self.assertIn(ip, matcher)
+        for ip in ('9.255.255.255', '11.0.0.0', '192.168.1.6', '2001:db9::1', '', None, 'nope'):
+            self.assertNotIn(ip, matcher)
+
+    def test_reload_picks_up_environment(self):
+        """Test reload() rebuilds the trusted proxies used by _get_client_ip"""
+        request = RequestFactory().get('/', REMOTE_ADDR='203.0.113.7', HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.7')
+        self.assertEqual(_get_client_ip(request), '203.0.113.7')
+
+        with mock.patch.dict(os.environ, {'TRUSTED_PROXY_IPS': '203.0.113.0/24'}):
+            networks.reload()
+        self.assertEqual(_get_client_ip(request), '198.51.100.1')
+
+
+class ThreatScannerTest(TestCase):
+    """Tests for the single-pass threat scanner behind MaliciousActivityDetector"""
+
+    def test_scan_matches_every_rule_individually(self):
+        """Test the keyword prefilter never hides a match the full regexes would find"""
+        values = [
+            '/api/projects/', "' OR '1'='1", 'UNION ALL SELECT a FROM b', '<ScRiPt src=x>',
+            '..env', '/WP-ADMIN/', 'dump.tar', 'index.php?id=1', 'ſelect(1)', 'comment --  ',
+        ]
+        for value in values:
+            expected = []
+            for rule in RULES:
+                if rule.category not in expected and re.search(rule.pattern, value, re.IGNORECASE):
+                    expected.append(rule.category)
+            self.assertEqual(sorted(scanner.scan(value)), sorted(expected), value)
+
+    def test_all_categories_reported_in_one_pass(self):
+        """Test one field can raise several threat types with their severities"""
+        threats = detector._check_string("/admin/../x?q=<script>' or 1=1", 'URL')
+
+        self.assertEqual(
+            [(t['type'], t['severity']) for t in threats],
+            [('sql_injection', 'CRITICAL'), ('xss', 'CRITICAL'), ('path_traversal', 'HIGH'), ('admin_probe', 'HIGH')],
+        )
+        self.assertEqual(threats[0]['description'], 'Possible SQL injection in URL')
+        self.assertEqual(detector._check_string('/api/projects/', 'URL'), [])
+
+    def test_multiline_text_is_not_sql(self):
+        """Test a SQL verb and FROM/INTO/WHERE on different lines of prose do not match"""
+        message = "Hi, please update me.\nI saw your project. Where can I read more?"
+        self.assertEqual(scanner.scan(message), [])
+        self.assertEqual(scanner.scan("Fine.\nupdate users set x=1 where 1"), ['sql_injection'])
+
+
+class ThreatPatternWorstCaseTest(TestCase):
+    """Fuzz the threat rules with backtracking-prone inputs at the field length cap"""
+
+    MAX_MICROSECONDS = 10000
+
+    def _adversarial_inputs(self, rule, length):
+        rng = random.Random(rule.pattern)
+        alphabet = ''.join(rule.keywords) + ' \t\n<>=/*.;-\'"1a'
+        for keyword in rule.keywords:
+            yield keyword * (length // len(keyword))
+            yield (keyword + ' ') * (length // (len(keyword) + 1))
+            yield keyword + ' ' * length
+            yield keyword + '1' * length
+            yield ('<' + keyword + ' ') * (length // (len(keyword) + 2))
+        for _sample in range(5):
+            yield ''.join(rng.choice(alphabet) for _char in range(length))
+
+    def test_no_rule_exceeds_time_bound(self):
+        """Test every rule stays linear on long attacker-controlled values"""
+        length = settings.SECURITY_SCAN_MAX_FIELD_LENGTH
+        for rule, regex in zip(RULES, scanner._regexes):
+            for value in self._adversarial_inputs(rule, length):
+                elapsed = min(timeit.repeat(lambda: regex.search(value), number=1, repeat=3))
+                self.assertLess(
+                    elapsed * 1e6, self.MAX_MICROSECONDS,
+                    f'{rule.pattern!r} took {elapsed * 1e6:.0f}us on {value[:40]!r}...',
+                )
+
+    def test_scan_budget_skips_remaining_fields(self):
+        """Test fields past the time budget are reported instead of scanned"""
+        fields = [('URL', '/api/projects/'), ('Query Parameter: q', "' or 1=1")]
+        with mock.patch.object(detector, 'scan_budget', -1):
+            threats = detector._check_fields(fields)
+
+        self.assertEqual([t['type'] for t in threats], ['scan_budget_exceeded'])
+        self.assertEqual(threats[0]['severity'], 'MEDIUM')
+
+    def test_oversize_field_is_reported_and_its_tail_scanned(self):
+        """Test a payload hidden after the length limit is still found"""
+        padding = 'a' * settings.SECURITY_SCAN_MAX_FIELD_LENGTH
+        threats = detector._check_fields([('POST Parameter: bio', padding + "' or 1=1")])
+
+        types = [t['type'] for t in threats]
+        self.assertEqual(types[0], 'field_too_long')
+        self.assertIn('sql_injection', types)
+
+
+class RateLimiterTest(TestCase):
+    """Tests for the shared GCRA rate limiter and its view adapter"""
+
+    def test_parse_rate_formats(self):
+        """Test django-ratelimit and DRF rate strings"""
+        self.assertEqual(parse_rate('10/m'), Rate(10, 60))
+        self.assertEqual(parse_rate('5/15m'), Rate(5, 900))
+        self.assertEqual(parse_rate('1000/hour'), Rate(1000, 3600))
+        with self.assertRaises(ValueError):
+            parse_rate('ten/m')
+
+    def test_shared_memory_backend_is_shared_between_workers(self):
+        """Test two handles on the same file (two workers) share one bucket"""
+        with tempfile.TemporaryDirectory() as path:
+            worker_a = SharedMemoryBackend(os.path.join(path, 'rl.bin'), slots=64)
+            worker_b = SharedMemoryBackend(os.path.join(path, 'rl.bin'), slots=64)
+            rate = parse_rate('3/m')
+
+            results = [backend.hit('ip:1.2.3.4', rate).allowed for backend in (worker_a, worker_b, worker_a, worker_b)]
+            self.assertEqual(results, [True, True, True, False])
+            self.assertAlmostEqual(worker_a.hit('ip:1.2.3.4', rate).retry_after, 20, delta=1)
+            self.assertTrue(worker_b.hit('ip:5.6.7.8', rate).allowed)
+
+    @override_settings(DEBUG=False)
+    def test_view_decorator_blocks_with_429(self):
+        """Test ratelimit_or_exempt denies past the rate and records decisions"""
+        from django.http import HttpResponse
+        from .utils import ratelimit_or_exempt
+
+        factory = RequestFactory()
+        denied_before = REGISTRY.get_sample_value(
+            'django_ratelimit_decisions_total', {'policy': 'test-view', 'decision': 'denied'}
+        ) or 0
+
+        # The decorator binds the limiter when applied, so apply it under the patch
+        with mock.patch('api.ratelimit.limiter', RateLimiter(LocalBackend())):
+            view = ratelimit_or_exempt(key='ip', rate='2/m', method='POST', group='test-view')(
+                lambda request: HttpResponse('ok')
+            )
+            statuses = [view(factory.post('/', REMOTE_ADDR='198.51.100.9')).status_code for _ in range(3)]
+            response = view(factory.get('/', REMOTE_ADDR='198.51.100.9'))
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'django_ratelimit_decisions_total', {'policy': 'test-view', 'decision': 'denied'}
+        ), denied_before + 1)
+
+    @override_settings(DEBUG=False)
+    def test_async_view_checks_off_the_event_loop(self):
+        """Test async views run the blocking limiter check on a worker thread"""
+        import threading
+        from django.http import HttpResponse
+        from .utils import ratelimit_or_exempt
+
+        backend = LocalBackend()
+        hit_threads = []
+        original_hit = backend.hit
+
+        def hit(*args, **kwargs):
+            hit_threads.append(threading.get_ident())
+            return original_hit(*args, **kwargs)
+
+        async def view(request):
+            return HttpResponse('ok')
+
+        async def call_twice(view):
+            request = RequestFactory().post('/', REMOTE_ADDR='198.51.100.10')
+            return threading.get_ident(), [(await view(request)).status_code for _ in range(2)]
+
+        with mock.patch.object(backend, 'hit', hit), \
+                mock.patch('api.ratelimit.limiter', RateLimiter(backend)):
+            view = ratelimit_or_exempt(key='ip', rate='1/m', group='test-async-view')(view)
+            loop_thread, statuses = asyncio.run(call_twice(view))
+
+        self.assertEqual(statuses, [200, 429])
+        self.assertTrue(hit_threads)
+        self.assertNotIn(loop_thread, hit_threads)
+
+
+class SecurityAlertDispatcherTest(TestCase):
+    """Test security alerts are coalesced and budgeted before reaching Sentry"""
+
+    def setUp(self):
+        cache.clear()
+
+    def _detection(self, ip, path='/api/projects/', threat='sql_injection'):
+        return {'ip': ip, 'path': path, 'method': 'GET', 'threats': [{'type': threat, 'severity': 'CRITICAL'}]}
+
+    def test_identical_threats_are_coalesced(self):
+        """Test repeated hits from one IP become one event carrying the count"""
+        dispatcher = SecurityAlertDispatcher(window=60, asynchronous=False)
+        for i in range(5):
+            dispatcher.submit(
+                '[CRITICAL] Security Threat Detected', self._detection('203.0.113.5', f'/p{i}'), 'CRITICAL'
+            )
+        dispatcher.submit('[CRITICAL] Security Threat Detected', self._detection('203.0.113.6'), 'CRITICAL')
+        self.assertEqual(dispatcher.pending(), 2)
+
+        with mock.patch('api.alerts.sentry_sdk.capture_message') as capture:
+            self.assertEqual(dispatcher.flush(force=True), 2)
+
+        messages = sorted(call.args[0] for call in capture.call_args_list)
+        self.assertEqual(messages, [
+            '[CRITICAL] Security Threat Detected',
+            '[CRITICAL] Security Threat Detected (x5 from 203.0.113.5 in 60s)',
+        ])
+        self.assertEqual(dispatcher.pending(), 0)
+
+    def test_budget_suppresses_excess_events(self):
+        """Test no more than the per-minute budget is sent to Sentry"""
+        dispatcher = SecurityAlertDispatcher(budget_per_minute=3, asynchronous=False)
+        for i in range(5):
+            dispatcher.submit('[HIGH] Security Threat Detected', self._detection(f'203.0.113.{i}'), 'HIGH')
+        suppressed_before = REGISTRY.get_sample_value('django_security_alerts_total', {'outcome': 'suppressed'}) or 0
+
+        with mock.patch('api.alerts.sentry_sdk.capture_message') as capture:
+            self.assertEqual(dispatcher.flush(force=True), 3)
+
+        self.assertEqual(capture.call_count, 3)
+        self.assertEqual(
+            REGISTRY.get_sample_value('django_security_alerts_total', {'outcome': 'suppressed'}),
+            suppressed_before + 2,
+        )
+
+    def test_budget_is_shared_by_workers(self):
+        """Test dispatchers in different workers draw on one budget through the cache"""
+        workers = [SecurityAlertDispatcher(budget_per_minute=3, asynchronous=False) for _ in range(2)]
+        for i, dispatcher in enumerate(workers):
+            for j in range(2):
+                dispatcher.submit('[HIGH] Security Threat Detected', self._detection(f'203.0.113.{i}{j}'), 'HIGH')
+
+        with mock.patch('api.alerts.sentry_sdk.capture_message') as capture:
+            sent = [dispatcher.flush(force=True) for dispatcher in workers]
+
+        self.assertEqual(sent, [2, 1])
+        self.assertEqual(capture.call_count, 3)
+
+
+class AuditLogBufferTest(TestCase):
+    """Test audit records are batched into ActivityLog and spooled until written"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='audit@example.com', password='pass12345')
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+
+    def _record(self, description, created_at=None):
+        return {
+            'user_id': self.user.pk, 'action': 'data_update', 'description': description,
+            'object_type': '', 'object_id': None, 'ip_address': '203.0.113.7',
+            'success': True, 'error_message': '',
+            'created_at': (created_at or timezone.now()).isoformat(),
+        }
+
+    def test_log_activity_keeps_event_time(self):
+        """Test the synchronous mode writes inline with the time of the event"""
+        happened = timezone.now() - timedelta(minutes=5)
+        buffer = AuditLogBuffer(asynchronous=False)
+        buffer.enqueue(self._record('PATCH /api/projects/1/', happened))
+
+        log = ActivityLog.objects.get(description='PATCH /api/projects/1/')
+        self.assertEqual(log.user, self.user)
+        self.assertEqual(log.created_at, happened)
+
+    def test_login_attempts_share_the_batch(self):
+        """Test login attempts are written as LoginActivity rows by the audit buffer"""
+        with mock.patch.object(AuditLogBuffer, '_ensure_started'), \
+                mock.patch('api.audit.audit_log', AuditLogBuffer(spool_dir=self.spool_dir)) as buffer:
+            SecurityLogger.log_login_attempt(self.user, '203.0.113.7', 'Mozilla/5.0', status='success')
+            buffer.enqueue(self._record('POST /api/projects/'))
+            self.assertEqual(LoginActivity.objects.count(), 0)
+            self.assertEqual(buffer.flush(), 2)
+
+        login = LoginActivity.objects.get()
+        self.assertEqual((login.user, login.status), (self.user, 'success'))
+        self.assertEqual(ActivityLog.objects.count(), 1)
+
+    def test_spooled_records_survive_worker_crash(self):
+        """Test another worker replays the spool of a worker that died before flushing"""
+        with mock.patch.object(AuditLogBuffer, '_ensure_started'):
+            crashed = AuditLogBuffer(spool_dir=self.spool_dir)
+            crashed.enqueue(self._record('POST /api/projects/'))
+            crashed.enqueue(self._record('DELETE /api/projects/2/'))
+        # Dying releases the segment's flock without flushing the queue
+        os.close(crashed._spool.seal()[1])
+        self.assertEqual(ActivityLog.objects.count(), 0)
+
+        survivor = AuditLogBuffer(spool_dir=self.spool_dir)
+        survivor.flush()
+
+        self.assertEqual(
+            sorted(ActivityLog.objects.values_list('description', flat=True)),
+            ['DELETE /api/projects/2/', 'POST /api/projects/'],
+        )
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_flush_writes_queue_and_discards_segment(self):
+        """Test a normal flush writes each queued record once and empties the spool"""
+        with mock.patch.object(AuditLogBuffer, '_ensure_started'):
+            buffer = AuditLogBuffer(spool_dir=self.spool_dir)
+            for i in range(3):
+                buffer.enqueue(self._record(f'PUT /api/projects/{i}/'))
+
+        with self.assertNumQueries(4):  # user lookup, SAVEPOINT, one INSERT, RELEASE
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(ActivityLog.objects.count(), 3)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_full_queue_overflows_to_spool(self):
+        """Test records the full queue cannot take are spooled and written, not dropped"""
+        with mock.patch.object(AuditLogBuffer, '_ensure_started'):
+            buffer = AuditLogBuffer(spool_dir=self.spool_dir, max_size=1)
+            self.assertTrue(all(buffer.enqueue(self._record(f'PUT /api/projects/{i}/')) for i in range(3)))
+
+        self.assertEqual(buffer.dropped, 0)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(ActivityLog.objects.count(), 3)
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+
+class SecurityCorrelatorTest(TestCase):
+    """Test sliding-window correlation raises de-duplicated SecurityAlerts"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_failed_logins_escalate_once_per_level(self):
+        """Test brute force from one IP raises medium at 5 and high at 10, once each"""
+        for _ in range(4):
+            with self.assertNumQueries(0):
+                self.assertEqual(correlator.record('login_failed', ip='198.51.100.20'), [])
+
+        raised = [alert for _ in range(5) for alert in correlator.record('login_failed', ip='198.51.100.20')]
+        self.assertEqual([a.severity for a in raised], ['medium'])
+        self.assertEqual(raised[0].evidence['count'], 5)
+
+        raised = [alert for _ in range(3) for alert in correlator.record('login_failed', ip='198.51.100.20')]
+        self.assertEqual([a.severity for a in raised], ['high'])
+        self.assertEqual(SecurityAlert.objects.filter(alert_type='brute_force').count(), 2)
+        self.assertEqual(correlator.record('login_failed', ip='198.51.100.21'), [])
+
+    def test_login_from_new_country_is_flagged(self):
+        """Test a successful login from an unseen country raises unusual_location"""
+        user = get_user_model().objects.create_user(email='traveller@example.com', password='pass12345')
+        self.assertEqual(correlator.record('login_success', ip='198.51.100.30', user=user, country='FR'), [])
+        self.assertFalse(AnomalyDetector.check_unusual_location(user))
+
+        raised = correlator.record('login_success', ip='198.51.100.31', user=user, country='BR')
+        self.assertEqual([a.alert_type for a in raised], ['unusual_location'])
+        self.assertTrue(AnomalyDetector.check_unusual_location(user))
+
+    def test_mass_api_requests_counts_only_api_requests(self):
+        """Test other audited actions do not count toward mass_api_requests"""
+        user = get_user_model().objects.create_user(email='busy@example.com', password='pass12345')
+        for _ in range(3):
+            correlator.record('activity', ip='198.51.100.40', user=user, action='data_update')
+        correlator.record('activity', ip='198.51.100.40', user=user, action='api_request')
+
+        self.assertEqual(correlator.count('mass_api_requests', user.pk), 1)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    """Test token lookups are cached and invalidated when the user or token changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='cached@example.com', password='pass12345')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CookieTokenAuthentication()
+
+    def test_repeat_lookups_skip_the_database(self):
+        """Test the second lookup for a token is served from the cache"""
+        self.auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual((user.pk, user.email, token.key), (self.user.pk, 'cached@example.com', self.token.key))
+        self.assertTrue(user.check_password('pass12345'))
+
+    def test_deactivation_and_logout_invalidate(self):
+        """Test saving the user and deleting the token take effect once committed"""
+        self.auth.authenticate_credentials(self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = True
+            self.user.save()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token.key}')
+        self.assertEqual(client.get(reverse('user-profile')).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post(reverse('logout')).status_code, 200)
+        self.assertEqual(client.get(reverse('user-profile')).status_code, 401)
+
+    def test_deactivation_is_invalidated_after_commit(self):
+        """Test a lookup made before the deactivation commits cannot outlive it"""
+        committed = _serialize(get_user_model().objects.get(pk=self.user.pk), self.token)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.user.is_active = False
+                self.user.save()
+                # A concurrent request still reads the committed, active user and caches it
+                cache.set(token_cache_key(self.token.key), committed)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.authenticate_credentials(self.token.key)
+
+
+class PasswordHashingTest(TestCase):
+    """Test password hashing on the pool, load shedding and hasher upgrades"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='hashing@example.com', password='pass12345')
+        patcher = mock.patch('api.hashing.pool', PasswordHashPool(workers=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _login(self):
+        return APIClient().post(
+            reverse('login'), {'email': 'hashing@example.com', 'password': 'pass12345'}, format='json'
+        )
+
+    def test_login_upgrades_legacy_hash(self):
+        """Test a PBKDF2 hash is replaced by Argon2 on a successful login"""
+        self.user.password = make_password('pass12345', hasher='pbkdf2_sha256')
+        self.user.save()
+
+        self.assertEqual(self._login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$'))
+        self.assertTrue(self.user.check_password('pass12345'))
+
+    def test_saturated_pool_sheds_with_503(self):
+        """Test logins are refused with Retry-After while the pool is full"""
+        busy = PasswordHashPool(workers=1, max_pending=1)
+        busy._slots.acquire()
+        with mock.patch('api.hashing.pool', busy):
+            response = self._login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_saturated_pool_sheds_password_reset_with_503(self):
+        """Test a shed during password reset is a 503, not the view's generic 500"""
+        from .models import PasswordResetToken
+
+        reset_token = PasswordResetToken.create_for_user(self.user)
+        busy = PasswordHashPool(workers=1, max_pending=1)
+        busy._slots.acquire()
+        with mock.patch('api.hashing.pool', busy):
+            response = APIClient().post(reverse('reset-password'), {
+                'token': reset_token.plain_token, 'password': 'newpass12345', 'password_confirm': 'newpass12345',
+            }, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        reset_token.refresh_from_db()
+        self.assertFalse(reset_token.used)
+
+    def test_hashes_on_worker_process(self):
+        """Test the pool hashes and verifies in a separate process"""
+        pool = PasswordHashPool(workers=1, timeout=30)
+        try:
+            encoded = pool.run('make', _make, 's3cret-passw0rd')
+            self.assertEqual(pool.run('check', _verify, 's3cret-passw0rd', encoded), (True, False))
+            self.assertEqual(pool.run('check', _verify, 'wrong', encoded), (False, False))
+        finally:
+            pool.shutdown()
+
+    def test_wsgi_worker_cap_is_below_its_threads(self):
+        """Test gunicorn.conf.py caps hashes in flight below a WSGI worker's threads"""
+        config = os.path.join(settings.BASE_DIR, 'gunicorn.conf.py')
+        environ = {k: v for k, v in os.environ.items() if k not in ('SERVER_MODE', 'PASSWORD_HASH_MAX_PENDING')}
+        with mock.patch.dict(os.environ, environ, clear=True):
+            threads = runpy.run_path(config)['threads']
+            self.assertLess(int(os.environ['PASSWORD_HASH_MAX_PENDING']), threads)
+
+
+@override_settings(GOOGLE_OAUTH2_CLIENT_ID='test-client.apps.googleusercontent.com')
+class AsyncSocialAuthViewTest(TestCase):
+    """Test the async social sign-in view against a stand-in Google"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+        def google(request):
+            self.calls.append(request.url.path)
+            if request.headers.get('Authorization') == 'Bearer good-token':
+                return httpx.Response(200, json={
+                    'sub': '1234', 'email': 'async-oauth@example.com', 'given_name': 'Async',
+                })
+            return httpx.Response(401, json={'error': 'invalid_request'})
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(google))
+        patcher = mock.patch('api.outbound.async_client', lambda: client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_google_sign_in(self):
+        """Test a verified access token signs the user in over ASGI"""
+        response = await self.async_client.post(
+            reverse('social-auth'), {'provider': 'google', 'provider_token': 'good-token'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_new_user'])
+        self.assertIn('auth_token', response.cookies)
+        self.assertTrue(await get_user_model().objects.filter(email='async-oauth@example.com').aexists())
+
+    def test_rejected_token_fails_closed(self):
+        """Test a token Google rejects is refused through the sync handler too"""
+        response = APIClient().post(
+            reverse('social-auth'), {'provider': 'google', 'provider_token': 'bad-token'}, format='json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.calls, ['/oauth2/v3/userinfo'])
+        self.assertFalse(get_user_model().objects.filter(email='async-oauth@example.com').exists())
+
+
+@override_settings(GOOGLE_OAUTH2_CLIENT_ID='test-client.apps.googleusercontent.com')
+class GoogleIDTokenTest(TestCase):
+    """Test local Google ID-token verification against a stand-in JWKS"""
+
+    CLIENT_ID = 'test-client.apps.googleusercontent.com'
+
+    def setUp(self):
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        cache.clear()
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        numbers = self.private_key.public_key().public_numbers()
+        self.jwks = {'keys': [{
+            'kty': 'RSA', 'alg': 'RS256', 'use': 'sig', 'kid': 'key-1',
+            'n': self._b64(numbers.n.to_bytes(256, 'big')), 'e': self._b64(numbers.e.to_bytes(3, 'big')),
+        }]}
+        self.calls = []
+
+        def google(request):
+            self.calls.append(request.url.path)
+            if request.url.path == '/oauth2/v3/certs':
+                return httpx.Response(200, json=self.jwks, headers={'Cache-Control': 'public, max-age=3600'})
+            return httpx.Response(401)
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(google))
+        client_patcher = mock.patch('api.outbound.async_client', lambda: client)
+        client_patcher.start()
+        self.addCleanup(client_patcher.stop)
+        keys_patcher = mock.patch('api.idtokens.google_keys', GoogleKeySet())
+        keys_patcher.start()
+        self.addCleanup(keys_patcher.stop)
+
+    @staticmethod
+    def _b64(data):
+        return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+    def _token(self, kid='key-1', **overrides):
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        now = int(time.time())
+        claims = {
+            'iss': 'https://accounts.google.com', 'aud': self.CLIENT_ID, 'sub': '42',
+            'email': 'id-token@example.com', 'email_verified': True, 'iat': now, 'exp': now + 3600,
+            **overrides,
+        }
+        signing_input = '.'.join(
+            self._b64(json.dumps(part).encode()) for part in ({'alg': 'RS256', 'kid': kid, 'typ': 'JWT'}, claims)
+        )
+        signature = self.private_key.sign(signing_input.encode(), padding.PKCS1v15(), hashes.SHA256())
+        return f'{signing_input}.{self._b64(signature)}'
+
+    def _sign_in(self, token):
+        return APIClient().post(reverse('social-auth'), {'provider': 'google', 'provider_token': token}, format='json')
+
+    def test_sign_in_without_network_and_single_use_nonce(self):
+        """Test ID tokens are verified from cached keys and nonces are consumed"""
+        token = self._token(nonce=OAuthState.create_for_provider('google').nonce)
+        self.assertEqual(self._sign_in(token).status_code, 200)
+        # Replaying the token fails on its already-consumed nonce
+        self.assertEqual(self._sign_in(token).status_code, 400)
+        fresh = self._token(nonce=OAuthState.create_for_provider('google').nonce)
+        self.assertEqual(self._sign_in(fresh).status_code, 200)
+        # One JWKS fetch for all three sign-ins
+        self.assertEqual(self.calls, ['/oauth2/v3/certs'])
+
+    async def test_rejects_invalid_tokens(self):
+        """Test signature, issuer, audience, expiry and email checks"""
+        now = int(time.time())
+        header, payload, signature = self._token().split('.')
+        tampered = self._b64(json.dumps({
+            'iss': 'https://accounts.google.com', 'aud': self.CLIENT_ID, 'sub': '1', 'exp': now + 3600,
+        }).encode())
+        for token in (
+            f'{header}.{tampered}.{signature}',
+            self._token(iss='https://evil.example.com'),
+            self._token(aud='another-client.apps.googleusercontent.com'),
+            self._token(iat=now - 7200, exp=now - 3600),
+            self._token(email_verified=False),
+            self._token(kid='unknown'),
+        ):
+            with self.assertRaises(InvalidIDToken):
+                await verify_google_id_token(token, self.CLIENT_ID)
+        claims = await verify_google_id_token(self._token(), self.CLIENT_ID)
+        self.assertEqual(claims['sub'], '42')
+        # Initial load plus one forced refresh for the unknown kid
+        self.assertEqual(self.calls, ['/oauth2/v3/certs'] * 2)
+
+    async def test_workers_share_keys_and_fetch_once(self):
+        """Test concurrent refreshes are single-flight and other workers reuse the cached set"""
+        keys = GoogleKeySet()
+        await asyncio.gather(*(keys.get('key-1') for _ in range(10)))
+        self.assertEqual(len(self.calls), 1)
+        # Another process starts with an empty memory cache
+        await GoogleKeySet().get('key-1')
+        self.assertEqual(len(self.calls), 1)
+
+
+class OutboundHTTPTest(TestCase):
+    """Test the pooled outbound HTTP clients"""
+
+    def test_host_timeouts_and_metrics(self):
+        """Test per-host timeouts are applied and each request is counted"""
+        outbound = HTTPClientRegistry(timeout=10, host_timeouts={'slow.example.com': 120, 'cdn.example.com': 60})
+        timeouts = {}
+
+        def upstream(request):
+            timeouts[request.url.host] = request.extensions['timeout']['read']
+            return httpx.Response(200 if request.url.host == 'slow.example.com' else 503)
+
+        transport = InstrumentedTransport('test', outbound, httpx.MockTransport(upstream))
+        with httpx.Client(transport=transport, timeout=outbound.timeout) as client:
+            client.get('https://slow.example.com/upload')
+            client.get('https://api.example.com/status')
+            client.get('https://cdn.example.com/upload', timeout=30)  # the caller's timeout wins
+
+        self.assertEqual(timeouts, {'slow.example.com': 120, 'api.example.com': 10, 'cdn.example.com': 30})
+        for host, outcome in (('slow.example.com', '2xx'), ('api.example.com', '5xx')):
+            self.assertEqual(REGISTRY.get_sample_value(
+                'django_outbound_http_requests_total', {'client': 'test', 'host': host, 'outcome': outcome}
+            ), 1)
+
+    def test_clients_are_shared(self):
+        """Test one client per process (and per long-lived event loop) and a pooled Cloudinary manager"""
+        import cloudinary.uploader
+        from cloudinary.api_client import call_api
+
+        outbound = HTTPClientRegistry(max_keepalive=4)
+        self.addCleanup(outbound.close)
+        self.assertIs(outbound.client(), outbound.client())
+
+        # Short-lived loops (WSGI) send through the pooled sync client
+        outbound._client = httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(204)))
+        self.assertIsInstance(outbound.async_client(), ThreadedAsyncClient)
+        self.assertEqual(asyncio.run(outbound.async_client().get('https://example.com/')).status_code, 204)
+
+        async def same_loop():
+            client = outbound.async_client()
+            return isinstance(client, httpx.AsyncClient) and client is outbound.async_client()
+
+        outbound.use_event_loop_clients()
+        self.assertTrue(asyncio.run(same_loop()))
+
+        originals = cloudinary.uploader._http, call_api._http
+        self.addCleanup(setattr, cloudinary.uploader, '_http', originals[0])
+        self.addCleanup(setattr, call_api, '_http', originals[1])
+        manager = outbound.install_cloudinary()
+        self.assertIsInstance(manager, InstrumentedPoolManager)
+        self.assertIs(cloudinary.uploader._http, manager)
+        self.assertIs(call_api._http, manager)
+        self.assertEqual(manager.connection_pool_kw['maxsize'], 4)
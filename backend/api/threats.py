@@ -0,0 +1,137 @@
+"""
+Single-pass threat pattern scanning for MaliciousActivityDetector.
+
+Every rule is a regex plus the literal keywords that any match of it must
+contain (e.g. a UNION-based injection must contain "union"). A scan:
+
+1. Lower-cases the value once and looks up every keyword in it with plain
+   substring search, which is far cheaper than a regex pass.
+2. Maps the keywords found to candidate rules.
+3. Runs only those rules' full regexes, stopping at the first match per
+   category.
+
+Benign input rarely contains a keyword, so most values never reach a regex,
+and each category is reported once. The keyword prefilter is used for ASCII
+values only. Non-ASCII values go straight to every regex, because
+str.lower() and re.IGNORECASE disagree on a few characters (e.g. "ſ").
+"""
+import re
+from typing import NamedTuple
+
+
+class ThreatRule(NamedTuple):
+    category: str
+    pattern: str
+    keywords: tuple
+
+
+class ThreatCategory(NamedTuple):
+    severity: str
+    label: str
+    description: str  # formatted with field=<field name>
+
+
+# Category -> severity, detection label and description, in reporting order
+CATEGORIES = {
+    'sql_injection': ThreatCategory('CRITICAL', 'SQL injection detected', 'Possible SQL injection in {field}'),
+    'xss': ThreatCategory('CRITICAL', 'XSS payload detected', 'Possible XSS attempt in {field}'),
+    'path_traversal': ThreatCategory('HIGH', 'Path traversal detected', 'Possible path traversal in {field}'),
+    'admin_probe': ThreatCategory('HIGH', 'admin_probe', 'Suspicious pattern (admin_probe) in {field}'),
+    'config_probe': ThreatCategory('MEDIUM', 'config_probe', 'Suspicious pattern (config_probe) in {field}'),
+    'backup_probe': ThreatCategory('MEDIUM', 'backup_probe', 'Suspicious pattern (backup_probe) in {field}'),
+    'shell_probe': ThreatCategory('MEDIUM', 'shell_probe', 'Suspicious pattern (shell_probe) in {field}'),
+}
+
+# Every pattern runs in time linear in the value. Possessive quantifiers
+# (*+, ++) stop backtracking over whitespace and digit runs. Rules that used
+# to retry a ".*" or "[^>]*" scan from every occurrence of their keyword are
+# anchored to the start of the value or of a tag chunk (after ">"). An atomic
+# group then commits to the first occurrence, so the value is scanned once.
+# Python 3.11+ is required for atomic groups and possessive quantifiers.
+_SQL_VERBS = ('union', 'select', 'insert', 'update', 'delete', 'drop', 'create', 'alter')
+
+RULES = (
+    # SQL injection
+    ThreatRule('sql_injection', r"['\"]\s*+(?:or|and)\s*+(?:['\"]|\d++)=", ("'", '"')),
+    ThreatRule('sql_injection', r"(?:union|select|insert|update|delete|drop|create|alter)\s*+\(", _SQL_VERBS),
+    # A verb followed later on its line by whitespace and FROM/INTO/WHERE
+    # (which may start the next line). Checked once per line: only the
+    # line's first verb needs checking, as any later match also follows it
+    ThreatRule(
+        'sql_injection',
+        r"(?m)^(?>.*?(?:union|select|insert|update|delete|drop|create|alter)).*\s(?:from|into|where)",
+        _SQL_VERBS,
+    ),
+    ThreatRule('sql_injection', r";\s*+(?:drop|create|alter|delete|update|insert)", (';',)),
+    ThreatRule('sql_injection', r"--\s*+$", ('--',)),
+    # A comment opened and closed on the same line, checked once per line
+    ThreatRule('sql_injection', r"(?m)^(?>.*?/\*).*\*/", ('/*',)),
+    ThreatRule('sql_injection', r"xp_", ('xp_',)),
+    ThreatRule('sql_injection', r"sp_", ('sp_',)),
+    # XSS; tag rules look at the first opening tag in each ">"-delimited chunk
+    ThreatRule('xss', r"(?:\A|>)(?>[^>]*?<\s*+script)[^>]*+>", ('script',)),
+    ThreatRule('xss', r"javascript:", ('javascript:',)),
+    ThreatRule('xss', r"on(?:load|error|click|mouseover|keypress)\s*+=",
+               ('onload', 'onerror', 'onclick', 'onmouseover', 'onkeypress')),
+    ThreatRule('xss', r"<\s*+iframe", ('iframe',)),
+    ThreatRule('xss', r"<\s*+object", ('object',)),
+    ThreatRule('xss', r"<\s*+embed", ('embed',)),
+    ThreatRule('xss', r"(?:\A|>)(?>[^>]*?<\s*+img)[^>]*?on", ('img',)),
+    ThreatRule('xss', r"(?:\A|>)(?>[^>]*?<\s*+svg)[^>]*?on", ('svg',)),
+    # Path traversal ("\.\./" and "\.\.\\" are covered by "\.\.")
+    ThreatRule('path_traversal', r"\.\.", ('..',)),
+    ThreatRule('path_traversal', r"%2e%2e", ('%2e%2e',)),
+    # Probes
+    ThreatRule('admin_probe', r"/(?:admin|manager|administrator|wp-admin|phpmyadmin)/", ('admin', 'manager')),
+    ThreatRule('config_probe', r"/(?:config|\.env|\.git|\.hg|\.svn)/", ('config', '.env', '.git', '.hg', '.svn')),
+    ThreatRule('backup_probe', r"\.(?:bak|backup|old|tar|zip|rar|gz)$",
+               ('.bak', '.old', '.tar', '.zip', '.rar', '.gz')),
+    ThreatRule('shell_probe', r"\.(?:php|aspx|jsp|py|rb)\?", ('.php', '.aspx', '.jsp', '.py', '.rb')),
+)
+
+
+class ThreatScanner:
+    """Keyword-prefiltered matcher over a fixed set of ThreatRules."""
+
+    def __init__(self, rules=RULES, flags=re.IGNORECASE):
+        self.rules = tuple(rules)
+        self.categories = list(dict.fromkeys(rule.category for rule in self.rules))
+        self._regexes = [re.compile(rule.pattern, flags) for rule in self.rules]
+
+        keywords = {}
+        for index, rule in enumerate(self.rules):
+            if not rule.keywords:
+                raise ValueError(f'Rule {rule.pattern!r} needs at least one keyword')
+            for keyword in rule.keywords:
+                keywords.setdefault(keyword.lower(), set()).add(index)
+        self._keywords = tuple((keyword, frozenset(rules)) for keyword, rules in keywords.items())
+        self._all_rules = frozenset(range(len(self.rules)))
+
+    def candidates(self, value: str) -> set:
+        """Indexes of the rules whose keywords occur in ``value``."""
+        if not value.isascii():
+            return self._all_rules
+        lowered = value.lower()
+        found = set()
+        for keyword, rules in self._keywords:
+            if keyword in lowered:
+                found |= rules
+        return found
+
+    def scan(self, value: str) -> list:
+        """Return the categories matched by ``value``, in CATEGORIES order."""
+        if not value:
+            return []
+        candidates = self.candidates(value)
+        if not candidates:
+            return []
+        matched = set()
+        for index in sorted(candidates):
+            category = self.rules[index].category
+            if category not in matched and self._regexes[index].search(value):
+                matched.add(category)
+        return [category for category in self.categories if category in matched]
+
+
+# Global instance
+scanner = ThreatScanner()
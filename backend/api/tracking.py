@@ -0,0 +1,157 @@
+"""
+Visitor tracking write pipeline.
+
+VisitorTrackingMiddleware only builds an event dict (for visitors holding a
+valid signed consent cookie, see api.consent) and queues it here; the
+consent audit-row lookup, the daily uniqueness check, the Visitor inserts,
+the daily rollup increments and the VisitorSession upserts (api.analytics)
+all happen in batches on the flusher thread. Unique-visitor sketches (api.uniques) are
+updated from the same batches.
+
+The consent cookie's visitor ID lasts for months, so it is not the session.
+Each visitor's events are split into sessions that end after
+VISITOR_SESSION_IDLE_MINUTES without a tracked request. A session's key,
+stored as Visitor.session_key and VisitorSession.session_key, is
+"<visitor id>.<session start, epoch seconds>".
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .analytics import increment_rollups, upsert_sessions
+from .buffering import BufferedWriter
+from .uniques import record_visits
+
+logger = logging.getLogger(__name__)
+
+# GDPR retention for visitor records and consents
+RETENTION_DAYS = 90
+
+
+class VisitorEventBuffer(BufferedWriter):
+    """Batches visitor events into Visitor rows (see VisitorTrackingMiddleware)."""
+
+    name = 'visitor'
+    CACHE_PREFIX = 'visitor_tracking'
+
+    def write_batch(self, events):
+        from .models import Visitor
+
+        consents = self._resolve_consents(events)
+        unique_keys = self._resolve_uniques(events)
+        session_keys = self._resolve_sessions(events)
+
+        visitors = []
+        for event, session_key in zip(events, session_keys):
+            consent = consents.get(event['visitor_id'])
+            visit_time = event['visit_time']
+            unique_key = (event['anonymized_ip'], visit_time.date())
+            visitors.append(Visitor(
+                anonymized_ip=event['anonymized_ip'],
+                user_agent=event['user_agent'],
+                referrer=event['referrer'],
+                path=event['path'],
+                session_key=session_key,
+                user_id=event['user_id'],
+                visit_time=visit_time,
+                is_unique=unique_key in unique_keys,
+                device_type=event['device_type'],
+                browser=event['browser'],
+                os=event['os'],
+                consent_record=consent,
+                # bulk_create bypasses Visitor.save(), so set retention here
+                will_delete_at=visit_time + timedelta(days=RETENTION_DAYS),
+            ))
+            # Later events for the same IP/day are not unique
+            unique_keys.discard(unique_key)
+
+        if not visitors:
+            return
+        with transaction.atomic():
+            Visitor.objects.bulk_create(visitors, batch_size=self.batch_size)
+            increment_rollups(visitors)
+            upsert_sessions(visitors)
+        try:
+            record_visits(visitors)
+        except Exception as e:
+            # Sketches are approximate anyway; never lose the batch over them
+            logger.error(f"Error updating unique visitor sketches: {e}", exc_info=True)
+
+    def _resolve_consents(self, events):
+        """
+        Fetch the consent audit rows for the batch's visitor IDs.
+
+        Events only reach the buffer with a valid signed consent cookie, so
+        a missing row (e.g. already purged) just leaves consent_record empty.
+        """
+        from .models import VisitorConsent
+
+        visitor_ids = {e['visitor_id'] for e in events}
+        return {
+            c.session_key: c
+            for c in VisitorConsent.objects.filter(session_key__in=visitor_ids)
+        }
+
+    def _resolve_sessions(self, events):
+        """
+        Return the session key of each event, in order.
+
+        A visitor's open session (key and last activity) is kept in the
+        cache for as long as it can still be continued, so no database
+        lookup is made. Losing the entry only starts a new session early.
+        """
+        idle = timedelta(minutes=getattr(settings, 'VISITOR_SESSION_IDLE_MINUTES', 30))
+        cache_keys = {e['visitor_id']: f"{self.CACHE_PREFIX}:session:{e['visitor_id']}" for e in events}
+        cached = cache.get_many(list(cache_keys.values()))
+        sessions = {
+            visitor_id: cached[key] for visitor_id, key in cache_keys.items() if key in cached
+        }  # visitor_id -> (session_key, last_seen)
+
+        session_keys = [None] * len(events)
+        for index in sorted(range(len(events)), key=lambda i: events[i]['visit_time']):
+            visitor_id, visit_time = events[index]['visitor_id'], events[index]['visit_time']
+            session_key, last_seen = sessions.get(visitor_id, (None, None))
+            if session_key is None or visit_time - last_seen > idle:
+                session_key, last_seen = f'{visitor_id}.{int(visit_time.timestamp())}', visit_time
+            sessions[visitor_id] = (session_key, max(last_seen, visit_time))
+            session_keys[index] = session_key
+
+        cache.set_many(
+            {cache_keys[visitor_id]: session for visitor_id, session in sessions.items()},
+            int(idle.total_seconds()),
+        )
+        return session_keys
+
+    def _resolve_uniques(self, events):
+        """
+        Return the (anonymized_ip, date) pairs in this batch that are the
+        first visit of the day.
+
+        cache.add() is atomic on Redis, so only one worker claims each pair;
+        no database lookup is made. Unique counts themselves come from the
+        HyperLogLog sketches in api.uniques.
+        """
+        unique_keys = set()
+        for event in events:
+            ip, day = event['anonymized_ip'], event['visit_time'].date()
+            if (ip, day) in unique_keys:
+                continue
+            # Mark as seen for the rest of the day (24 hours)
+            if cache.add(self._unique_cache_key(ip, day), True, 86400):
+                unique_keys.add((ip, day))
+        return unique_keys
+
+    def _unique_cache_key(self, ip, day):
+        return f"{self.CACHE_PREFIX}:unique:{ip}:{day}"
+
+
+# Global instance
+visitor_buffer = VisitorEventBuffer(
+    max_size=getattr(settings, 'VISITOR_BUFFER_MAX_SIZE', 10000),
+    batch_size=getattr(settings, 'VISITOR_BUFFER_BATCH_SIZE', 200),
+    flush_interval=getattr(settings, 'VISITOR_BUFFER_FLUSH_INTERVAL', 5.0),
+    asynchronous=getattr(settings, 'VISITOR_BUFFER_ASYNC', True),
+)
@@ -40,6 +40,7 @@ urlpatterns = [
     
     # Visitor Tracking
     path('visitors/stats/', views.VisitorStatsView.as_view(), name='visitor-stats'),
+    path('visitors/consent/', views.VisitorConsentView.as_view(), name='visitor-consent'),
     path('visitors/', views.VisitorListView.as_view(), name='visitor-list'),
     
     # Prometheus Metrics
@@ -0,0 +1,174 @@
+"""
+User-agent classification.
+
+One pass over the lower-cased UA string yields device type, browser (with
+version), OS and a bot flag. Results are memoized in a bounded LRU keyed on
+the raw header value, since a handful of UA strings account for nearly all
+traffic. Hit/miss counters for every UA cache are exported to Prometheus
+(`django_user_agent_cache`) and available from cache_stats(). In
+multiprocess mode the gauges cannot read the caches at scrape time, so
+publish_cache_stats() copies the figures in periodically instead.
+"""
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .metrics import USER_AGENT_CACHE, multiprocess_dir
+
+# Browser tokens in priority order: Edge and Opera also advertise Chrome and
+# Safari, and Chrome advertises Safari, so the more specific token wins.
+BROWSER_TOKENS = (
+    ('edg/', 'Edge'),
+    ('edge/', 'Edge'),
+    ('edga/', 'Edge'),
+    ('edgios/', 'Edge'),
+    ('opr/', 'Opera'),
+    ('opera/', 'Opera'),
+    ('firefox/', 'Firefox'),
+    ('fxios/', 'Firefox'),
+    ('chrome/', 'Chrome'),
+    ('crios/', 'Chrome'),
+    ('safari/', 'Safari'),
+)
+
+# OS tokens in priority order: Android UAs contain "Linux" and iOS UAs
+# contain "like Mac OS X".
+OS_TOKENS = (
+    ('android', 'Android'),
+    ('iphone', 'iOS'),
+    ('ipad', 'iOS'),
+    ('ipod', 'iOS'),
+    ('windows', 'Windows'),
+    ('mac os', 'macOS'),
+    ('macintosh', 'macOS'),
+    ('cros', 'Linux'),
+    ('linux', 'Linux'),
+)
+
+BOT_TOKENS = (
+    'bot', 'crawl', 'spider', 'slurp', 'fetcher', 'scraper', 'headless',
+    'curl/', 'wget/', 'python-requests', 'python-urllib', 'httpclient',
+    'go-http-client', 'okhttp', 'facebookexternalhit', 'lighthouse',
+)
+
+_VERSION_RE = re.compile(r'[\d.]+')
+
+
+class UserAgentInfo(NamedTuple):
+    device_type: str
+    browser: str
+    browser_version: str
+    os: str
+    is_bot: bool
+
+    @property
+    def browser_label(self) -> str:
+        """Browser with version, e.g. "Chrome 120.0.0.0"."""
+        if self.browser == 'Unknown':
+            return ''
+        return f'{self.browser} {self.browser_version}'.strip()
+
+
+UNKNOWN = UserAgentInfo('Unknown', 'Unknown', '', 'Unknown', False)
+
+# name -> lru_cache-wrapped function, for stats
+_caches = {}
+
+
+def _stat(name: str, field: str):
+    return lambda: getattr(_caches[name].cache_info(), field)
+
+
+def user_agent_cache(name: str, maxsize: int = None):
+    """
+    Memoize a one-argument function of the raw User-Agent string.
+
+    The cache is bounded to USER_AGENT_CACHE_SIZE entries (LRU eviction) and
+    its hits, misses and size are exported under ``cache=<name>``.
+    """
+    if maxsize is None:
+        maxsize = getattr(settings, 'USER_AGENT_CACHE_SIZE', 4096)
+
+    def decorator(func):
+        cached = lru_cache(maxsize=maxsize)(func)
+        _caches[name] = cached
+        if not multiprocess_dir():
+            USER_AGENT_CACHE.labels(cache=name, stat='hits').set_function(_stat(name, 'hits'))
+            USER_AGENT_CACHE.labels(cache=name, stat='misses').set_function(_stat(name, 'misses'))
+            USER_AGENT_CACHE.labels(cache=name, stat='size').set_function(_stat(name, 'currsize'))
+        USER_AGENT_CACHE.labels(cache=name, stat='maxsize').set(maxsize)
+        return cached
+
+    return decorator
+
+
+def _version_after(ua: str, token: str) -> str:
+    index = ua.find(token)
+    if index == -1:
+        return ''
+    match = _VERSION_RE.match(ua, index + len(token))
+    return match.group(0).strip('.') if match else ''
+
+
+@user_agent_cache('classify')
+def classify(user_agent: str) -> UserAgentInfo:
+    """
+    Classify a raw User-Agent header.
+
+    Labels match the values stored on Visitor ('Mobile'/'Tablet'/'Desktop',
+    'Chrome'/'Firefox'/..., 'Windows'/'macOS'/...), 'Unknown' otherwise.
+    """
+    if not user_agent:
+        return UNKNOWN
+    ua = user_agent.lower()
+
+    browser, browser_version = 'Unknown', ''
+    for token, name in BROWSER_TOKENS:
+        if token in ua:
+            browser = name
+            # Safari reports its own version as "Version/x"
+            browser_version = _version_after(ua, 'version/' if name == 'Safari' else token)
+            break
+
+    os_name = 'Unknown'
+    for token, name in OS_TOKENS:
+        if token in ua:
+            os_name = name
+            break
+
+    if 'ipad' in ua or 'tablet' in ua or ('android' in ua and 'mobile' not in ua):
+        device_type = 'Tablet'
+    elif 'mobi' in ua or 'iphone' in ua or 'ipod' in ua:
+        device_type = 'Mobile'
+    else:
+        device_type = 'Desktop'
+
+    is_bot = any(token in ua for token in BOT_TOKENS)
+    return UserAgentInfo(device_type, browser, browser_version, os_name, is_bot)
+
+
+def publish_cache_stats():
+    """Copy current hit/miss/size figures into the (multiprocess) gauges."""
+    for name, cached in _caches.items():
+        info = cached.cache_info()
+        USER_AGENT_CACHE.labels(cache=name, stat='hits').set(info.hits)
+        USER_AGENT_CACHE.labels(cache=name, stat='misses').set(info.misses)
+        USER_AGENT_CACHE.labels(cache=name, stat='size').set(info.currsize)
+
+
+def cache_stats() -> dict:
+    """Hit/miss/size figures for every registered UA cache."""
+    stats = {}
+    for name, cached in _caches.items():
+        info = cached.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'maxsize': info.maxsize,
+            'hit_ratio': round(info.hits / lookups, 4) if lookups else 0,
+        }
+    return stats
@@ -2,8 +2,10 @@
 Utility functions for encrypting and decrypting sensitive data
 """
 import logging
+import math
 from functools import wraps
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from cryptography.fernet import Fernet
 from django.conf import settings
 
@@ -41,43 +43,81 @@ def decrypt(value):
 
 # ============= Rate Limiting Utilities =============
 
-def ratelimit_or_exempt(key, rate, method=None, block=True):
+def ratelimit_or_exempt(key, rate, method=None, block=True, group=None):
     """
-    Wrapper around django-ratelimit decorator that disables rate limiting in DEBUG mode.
+    Rate limit a view with the shared limiter (api.ratelimit), disabled in DEBUG mode.
     
     Useful for development where you want to test without hitting rate limits.
+    Keeps django-ratelimit's arguments: ``key`` is 'ip' or 'user', ``method``
+    limits only those HTTP methods, and ``block=False`` only sets
+    ``request.limited``. Blocked requests get a 429 with Retry-After. The
+    policy (bucket and metrics label) defaults to the resolved view name.
+    Async views (``async def dispatch``) get an async wrapper.
     
     Usage:
         @method_decorator(ratelimit_or_exempt(key='user', rate='100/h', method='POST'), name='dispatch')
         class MyView(APIView):
             pass
     """
-    try:
-        from django_ratelimit.decorators import ratelimit as django_ratelimit
-    except Exception:
-        # Fail open when ratelimit dependency is unavailable in runtime.
-        def no_op_decorator(func):
-            return func
-        return no_op_decorator
-    
     # In development mode, bypass rate limiting
     if settings.DEBUG:
         # Return a no-op decorator
         def no_op_decorator(func):
             return func
         return no_op_decorator
-    
-    # In production, use actual rate limiting with a safe fallback.
+
+    from django.http import HttpRequest, JsonResponse
+    from .ratelimit import limiter, parse_rate, request_identity
+
+    parsed_rate = parse_rate(rate)
+    methods = None
+    if method is not None:
+        methods = {method.upper()} if isinstance(method, str) else {m.upper() for m in method}
+
+    def check(func, args):
+        """Return a 429 response if the request is over the limit, else None."""
+        # Plain views get (request, ...); method_decorator'd ones may get (self, request, ...)
+        request = args[0] if isinstance(args[0], HttpRequest) else args[1]
+        if methods is not None and request.method not in methods:
+            return None
+
+        match = getattr(request, 'resolver_match', None)
+        policy = group or (match.view_name if match and match.view_name else func.__qualname__)
+        try:
+            decision = limiter.hit(policy, request_identity(request, key), parsed_rate)
+        except Exception as exc:
+            # Fail open when the rate limit backend is unavailable
+            logger.error("Rate limit backend failed, bypassing check: %s", exc, exc_info=True)
+            return None
+
+        request.limited = getattr(request, 'limited', False) or not decision.allowed
+        if not decision.allowed and block:
+            response = JsonResponse(
+                {'detail': 'Rate limit exceeded. Please try again later.'}, status=429
+            )
+            response['Retry-After'] = str(max(1, math.ceil(decision.retry_after)))
+            return response
+        return None
+
     def decorator(func):
-        decorated = django_ratelimit(key=key, rate=rate, method=method, block=block)(func)
+        if iscoroutinefunction(func):
+            # Async views (AsyncAPIView): the limiter backend (EVALSHA, flock)
+            # and a lazy request.user load block, so check on a worker thread
+            @wraps(func)
+            async def async_wrapped(*args, **kwargs):
+                response = await sync_to_async(check)(func, args)
+                if response is not None:
+                    return response
+                return await func(*args, **kwargs)
+
+            return async_wrapped
 
         @wraps(func)
         def wrapped(*args, **kwargs):
-            try:
-                return decorated(*args, **kwargs)
-            except Exception as exc:
-                logger.error("Rate limit backend failed, bypassing check: %s", exc, exc_info=True)
-                return func(*args, **kwargs)
+            response = check(func, args)
+            if response is not None:
+                return response
+            return func(*args, **kwargs)
 
         return wrapped
 
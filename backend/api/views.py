@@ -2,15 +2,27 @@
 API Views - Authentication and User Management
 Handles auth, user management, media uploads, and visitor tracking
 """
+import base64
+import binascii
+import csv
+import json
 import logging
 import os
-from rest_framework import generics, status, permissions, serializers
+from datetime import datetime
+from itertools import islice
+
+from rest_framework import generics, status, permissions, serializers, pagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django_ratelimit.decorators import ratelimit
+from django.http import StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from django.conf import settings
 
@@ -19,7 +31,14 @@ from .serializers import (
     AdminUserUpdateSerializer, PasswordChangeSerializer, MediaUploadSerializer,
     VisitorSerializer, VisitorStatsSerializer
 )
-from .models import MediaUpload, Visitor, RefreshToken, OAuthState
+from .models import MediaUpload, Visitor, VisitorConsent, RefreshToken, OAuthState
+from . import hashing
+from .asyncviews import AsyncAPIView
+from .analytics import get_visitor_stats
+from .consent import clear_consent, issue_consent, read_consent
+from .error_handling import ServiceUnavailableError
+from .metrics import _get_client_ip
+from .oauth import verify_oauth_token
 from api.permissions import IsAdminUser
 from api.utils import ratelimit_or_exempt
 
@@ -111,7 +130,7 @@ class LoginView(APIView):
             }, status=status.HTTP_401_UNAUTHORIZED)
         
         # Check password only if user exists, but always return same error message
-        if not user or not user.check_password(password):
+        if not user or not hashing.check_password(user, password):
             # Log failed login attempt
             SecurityLogger.log_login_attempt(
                 user=user,
@@ -245,11 +264,11 @@ class OAuthStateView(APIView):
 
 
 @method_decorator(ratelimit_or_exempt(key='ip', rate='10/m', block=True), name='dispatch')
-class SocialAuthView(APIView):
+class SocialAuthView(AsyncAPIView):
     permission_classes = [permissions.AllowAny]
     authentication_classes = []  # Skip auth so stale cookies don't cause 401
 
-    def post(self, request):
+    async def post(self, request):
         """
         Authenticate user via OAuth provider.
         
@@ -269,8 +288,10 @@ class SocialAuthView(APIView):
         
         SECURITY: State parameter prevents CSRF attacks for code flow.
         For Google ID token flow, we skip state check since token is directly verified.
+
+        The provider round trip is awaited on the event loop; only the
+        state check and the account/token writes run on a thread.
         """
-        from .security import SecurityLogger
         state = request.data.get('state')
         provider = request.data.get('provider', '').lower()
         provider_token = request.data.get('provider_token')
@@ -287,14 +308,19 @@ class SocialAuthView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
         else:
             # Verify and consume state (one-time use)
-            oauth_state = OAuthState.verify_and_consume(state, provider)
+            oauth_state = await sync_to_async(OAuthState.verify_and_consume)(state, provider)
             if not oauth_state:
                 return Response({
                     'error': 'Invalid or expired state token'
                 }, status=status.HTTP_403_FORBIDDEN)
         
         # State is valid (or Google ID token flow), proceed with OAuth
-        serializer = SocialAuthSerializer(data=request.data)
+        verification = None
+        if provider_token:
+            verification = await verify_oauth_token(
+                provider, provider_token, request.data.get('provider_id'), request.data.get('email')
+            )
+        serializer = SocialAuthSerializer(data=request.data, context={'oauth_verification': verification})
         if not serializer.is_valid():
             # Flatten DRF validation errors to a single readable message
             errors = serializer.errors
@@ -307,6 +333,11 @@ class SocialAuthView(APIView):
                 {'error': msg or 'OAuth verification failed.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        return await sync_to_async(self._sign_in)(serializer, provider, ip_address)
+
+    def _sign_in(self, serializer, provider, ip_address):
+        """Find or create the user, issue tokens and set the auth cookies."""
+        from .security import SecurityLogger
         try:
             user, created = serializer.create_or_get_user(serializer.validated_data)
         except serializers.ValidationError as e:
@@ -526,7 +557,7 @@ class PasswordChangeView(APIView):
     def post(self, request):
         serializer = PasswordChangeSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        request.user.set_password(serializer.validated_data['new_password'])
+        hashing.set_password(request.user, serializer.validated_data['new_password'])
         # Clear the requires_password_change flag after successful password change
         request.user.requires_password_change = False
         request.user.save()
@@ -604,90 +635,165 @@ class VisitorStatsView(APIView):
         if request.user.user_type != 'admin':
             return Response({'error': 'Not authorized'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Calculate statistics
-        total_visitors = Visitor.objects.count()
-        unique_visitors = Visitor.objects.filter(is_unique=True).count()
-        page_views = total_visitors
-        
-        # Calculate bounce rate (simplified: single-page sessions)
-        single_page_sessions = 0
-        session_visits = Visitor.objects.values('session_key').annotate(count=models.Count('id'))
-        for visit in session_visits:
-            if visit['count'] == 1:
-                single_page_sessions += 1
-        
-        bounce_rate = (single_page_sessions / len(session_visits)) * 100 if session_visits else 0
-        
-        # Calculate average session duration (simplified)
-        average_session_duration = 0  # This would need more complex session tracking
-        
-        # Get popular pages
-        popular_pages = list(
-            Visitor.objects.values('path')
-            .annotate(count=models.Count('id'))
-            .order_by('-count')[:10]
-        )
-        
-        # Get device distribution
-        device_distribution = list(
-            Visitor.objects.values('device_type')
-            .annotate(count=models.Count('id'))
-            .order_by('-count')
-        )
-        
-        # Get browser distribution
-        browser_distribution = list(
-            Visitor.objects.values('browser')
-            .annotate(count=models.Count('id'))
-            .order_by('-count')
-        )
-        
-        # Get OS distribution
-        os_distribution = list(
-            Visitor.objects.values('os')
-            .annotate(count=models.Count('id'))
-            .order_by('-count')
-        )
-        
-        # Get daily trend (last 7 days)
-        from django.utils import timezone
-        daily_trend = []
-        today = timezone.now().date()
-        for i in range(7):
-            date = today - timezone.timedelta(days=i)
-            day_visits = Visitor.objects.filter(visit_time__date=date).count()
-            daily_trend.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'visits': day_visits
-            })
-        
-        # Reverse to show oldest to newest
-        daily_trend = list(reversed(daily_trend))
-        
-        # Prepare response
-        stats = {
-            'total_visitors': total_visitors,
-            'unique_visitors': unique_visitors,
-            'page_views': page_views,
-            'bounce_rate': round(bounce_rate, 2),
-            'average_session_duration': average_session_duration,
-            'popular_pages': popular_pages,
-            'device_distribution': {d['device_type']: d['count'] for d in device_distribution},
-            'browser_distribution': {d['browser']: d['count'] for d in browser_distribution},
-            'os_distribution': {d['os']: d['count'] for d in os_distribution},
-            'daily_trend': daily_trend
-        }
+        # Served from the daily rollup tables (see api.analytics) so the cost
+        # does not grow with the Visitor table
+        stats = get_visitor_stats()
         
         serializer = VisitorStatsSerializer(stats)
         return Response(serializer.data)
 
 
+@method_decorator(ratelimit_or_exempt(key='ip', rate='30/m', block=True), name='dispatch')
+class VisitorConsentView(APIView):
+    """
+    Read, grant or withdraw analytics consent.
+
+    Granting consent sets the signed visitor cookie (see api.consent) and
+    writes the VisitorConsent audit row; this is the only time tracking
+    consent touches the database.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []  # Anonymous visitors; skip auth so stale cookies don't cause 401
+
+    def get(self, request):
+        token = read_consent(request)
+        return Response({
+            'consent': token is not None,
+            'consent_version': token.consent_version if token else None,
+            'expires_at': token.expires_at if token else None,
+        })
+
+    def post(self, request):
+        if request.data.get('consent') not in (True, 'true', 'accepted'):
+            return self.delete(request)
+
+        response = Response(status=status.HTTP_201_CREATED)
+        token = issue_consent(response)
+        VisitorConsent.objects.create(
+            session_key=token.visitor_id,
+            ip_address=_get_client_ip(request) or None,
+            consent_given=True,
+            consent_version=token.consent_version,
+            expires_at=token.expires_at,
+        )
+        response.data = {
+            'consent': True,
+            'consent_version': token.consent_version,
+            'expires_at': token.expires_at,
+        }
+        return response
+
+    def delete(self, request):
+        token = read_consent(request)
+        if token is not None:
+            # Keep the audit row but record the withdrawal
+            VisitorConsent.objects.filter(session_key=token.visitor_id).update(consent_given=False)
+        response = Response({'consent': False, 'consent_version': None, 'expires_at': None})
+        clear_consent(response)
+        return response
+
+
+class VisitorKeysetPagination(pagination.BasePagination):
+    """
+    Keyset pagination on (visit_time, id), newest first.
+
+    The cursor encodes the last row of the previous page, so each page is a
+    single indexed range query no matter how deep the client pages, and rows
+    inserted meanwhile never shift pages. Responses carry no total count.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def _get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def _encode_cursor(self, visitor):
+        raw = f'{visitor.visit_time.isoformat()}|{visitor.pk}'
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def _decode_cursor(self, cursor):
+        try:
+            visit_time, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(visit_time), int(pk)
+        except (ValueError, UnicodeDecodeError, binascii.Error):
+            raise NotFound('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self._get_page_size(request)
+        queryset = queryset.order_by('-visit_time', '-id')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            visit_time, pk = self._decode_cursor(cursor)
+            queryset = queryset.filter(
+                models.Q(visit_time__lt=visit_time) | models.Q(visit_time=visit_time, id__lt=pk)
+            )
+
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_cursor = self._encode_cursor(page[-1]) if self.has_next else None
+        return page
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+
+class Echo:
+    """File-like object whose write() just returns the value, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
 class VisitorListView(generics.ListAPIView):
-    """View to list all visitors (admin only)."""
+    """
+    View to list visitors (admin only).
+
+    JSON responses are keyset-paginated (see VisitorKeysetPagination).
+    ``?export=ndjson`` or ``?export=csv`` streams every matching row instead,
+    reading plain dicts in chunks so the table is never held in memory, under
+    WSGI and ASGI alike.
+    """
     queryset = Visitor.objects.all().order_by('-visit_time')
     serializer_class = VisitorSerializer
     permission_classes = [permissions.IsAuthenticated]
-    pagination_class = None
+    pagination_class = VisitorKeysetPagination
+
+    # Visitor fields exported, mapped to the names VisitorSerializer uses
+    EXPORT_FIELDS = {
+        'id': 'id',
+        'anonymized_ip': 'ip_address',
+        'user_agent': 'user_agent',
+        'referrer': 'referrer',
+        'path': 'path',
+        'session_key': 'session_key',
+        'user_id': 'user',
+        'visit_time': 'visit_time',
+        'is_unique': 'is_unique',
+        'country': 'country',
+        'city': 'city',
+        'device_type': 'device_type',
+        'browser': 'browser',
+        'os': 'os',
+    }
+    EXPORT_CHUNK_SIZE = 2000
 
     def get_queryset(self):
         if self.request.user.user_type != 'admin':
@@ -696,7 +802,7 @@ class VisitorListView(generics.ListAPIView):
         # Filter by date range if provided
         start_date = self.request.query_params.get('start_date')
         end_date = self.request.query_params.get('end_date')
-        queryset = Visitor.objects.all().order_by('-visit_time')
+        queryset = Visitor.objects.all().order_by('-visit_time', '-id')
         
         if start_date:
             queryset = queryset.filter(visit_time__date__gte=start_date)
@@ -705,6 +811,49 @@ class VisitorListView(generics.ListAPIView):
         
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        export = request.query_params.get('export')
+        if export is None:
+            return super().list(request, *args, **kwargs)
+        if export not in ('ndjson', 'csv'):
+            return Response(
+                {'error': 'export must be "ndjson" or "csv"'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rows = self._export_rows()
+        if export == 'csv':
+            content, content_type = self._stream_csv(rows), 'text/csv'
+        else:
+            content, content_type = self._stream_ndjson(rows), 'application/x-ndjson'
+        if isinstance(request._request, ASGIRequest):
+            # Django drains a sync iterator into a list before sending it
+            # under ASGI, so hand it an async one that reads a chunk at a time
+            content = self._stream_async(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="visitors.{export}"'
+        return response
+
+    def _export_rows(self):
+        rows = self.get_queryset().values(*self.EXPORT_FIELDS).iterator(chunk_size=self.EXPORT_CHUNK_SIZE)
+        for row in rows:
+            yield {self.EXPORT_FIELDS[field]: value for field, value in row.items()}
+
+    async def _stream_async(self, lines):
+        next_chunk = sync_to_async(lambda: ''.join(islice(lines, self.EXPORT_CHUNK_SIZE)))
+        while chunk := await next_chunk():
+            yield chunk
+
+    def _stream_ndjson(self, rows):
+        for row in rows:
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+    def _stream_csv(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.EXPORT_FIELDS.values())
+        for row in rows:
+            yield writer.writerow(row.values())
+
 
 # ============================================================================
 # SECURITY & LOGGING VIEWS
@@ -914,7 +1063,7 @@ class ResetPasswordView(APIView):
         try:
             # Update password
             user = reset_token.user
-            user.set_password(password)
+            hashing.set_password(user, password)
             user.save()
             
             # Mark token as used
@@ -931,6 +1080,9 @@ class ResetPasswordView(APIView):
                 'message': 'Password has been reset successfully. You can now log in with your new password.'
             }, status=status.HTTP_200_OK)
         
+        except ServiceUnavailableError:
+            # Hash pool is shedding load; answer 503 + Retry-After, not 500
+            raise
         except Exception as e:
             logger.error(f"Error resetting password: {str(e)}")
             return Response({
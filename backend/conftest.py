@@ -20,34 +20,6 @@ User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
-def pytest_configure(config):
-    """
-    Pytest hook that runs before test collection.
-    Disables rate limiting globally for all tests.
-    """
-    # Import here to avoid import errors before Django is set up
-    from unittest.mock import patch
-    
-    # Create a mock decorator that does nothing (no-op)
-    def mock_ratelimit(*args, **kwargs):
-        """Mock ratelimit decorator that bypasses rate limiting"""
-        def decorator(func):
-            return func
-        return decorator
-    
-    # Patch django_ratelimit.decorators.ratelimit globally
-    import django_ratelimit.decorators
-    django_ratelimit.decorators.ratelimit = mock_ratelimit
-    
-    # Also patch the imported versions in each module
-    import sys
-    for module_name in list(sys.modules.keys()):
-        if module_name.startswith(('api', 'projects', 'content')):
-            module = sys.modules.get(module_name)
-            if module and hasattr(module, 'ratelimit'):
-                setattr(module, 'ratelimit', mock_ratelimit)
-
-
 @pytest.fixture(scope='session', autouse=True)
 def create_log_directories():
     """
@@ -85,6 +57,18 @@ def enable_db_access_for_all_tests(db):
     pass
 
 
+@pytest.fixture(autouse=True)
+def reset_rate_limiter():
+    """
+    Start every test with empty rate limit buckets. The global limiter lives
+    for the whole session, so one test's hits would otherwise count against
+    the next test from the same client IP.
+    """
+    from api.ratelimit import limiter
+    limiter.reset()
+    yield
+
+
 @pytest.fixture(autouse=True)
 def disable_ssl_redirect(settings):
     """
@@ -8,8 +8,7 @@ from django.shortcuts import get_object_or_404
 from django.db.models import Q
 from django.contrib.auth import get_user_model
 from django.utils.decorators import method_decorator
-from django_ratelimit.decorators import ratelimit
-from django_ratelimit.exceptions import Ratelimited
+from asgiref.sync import sync_to_async
 import os
 
 from .models import SiteSettings, About, ContactMessage, EmailSubscription
@@ -17,7 +16,9 @@ from .serializers import (
     SiteSettingsSerializer, SiteSettingsPublicSerializer, AboutSerializer,
     ContactMessageSerializer, EmailSubscriptionSerializer, SubscribeSerializer, UnsubscribeSerializer
 )
+from api.asyncviews import AsyncAPIView
 from api.permissions import IsAdminUser, IsAdminOrReadOnly
+from api.utils import ratelimit_or_exempt
 
 User = get_user_model()
 
@@ -76,26 +77,27 @@ class AboutRetrieveUpdateDestroy(generics.RetrieveUpdateDestroyAPIView):
 
 # ============ Contact Views ============
 
-@method_decorator(ratelimit(key='ip', rate=os.environ.get('CONTACT_RATE_LIMIT', '5/h'), method='POST', block=True), name='dispatch')
-class ContactMessageCreate(generics.CreateAPIView):
+@method_decorator(ratelimit_or_exempt(key='ip', rate=os.environ.get('CONTACT_RATE_LIMIT', '5/h'), method='POST', block=True), name='dispatch')
+class ContactMessageCreate(AsyncAPIView, generics.CreateAPIView):
     queryset = ContactMessage.objects.all()
     serializer_class = ContactMessageSerializer
     permission_classes = [permissions.AllowAny]
-    
-    def handle_exception(self, exc):
-        if isinstance(exc, Ratelimited):
-            return Response(
-                {'detail': 'Rate limit exceeded. Please try again later.'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-        return super().handle_exception(exc)
-    
+
+    async def post(self, request, *args, **kwargs):
+        # The SMTP round trip runs off the event loop and without holding
+        # a worker; only the inserts hop to the ORM thread
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        await sync_to_async(self.perform_create)(serializer)
+        await self._send_notification_email(serializer.instance)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
     def perform_create(self, serializer):
         if self.request.user.is_authenticated:
             instance = serializer.save(user=self.request.user)
         else:
             instance = serializer.save()
-        self._send_notification_email(instance)
         self._create_admin_notification(instance)
 
     def _create_admin_notification(self, message):
@@ -116,20 +118,31 @@ class ContactMessageCreate(generics.CreateAPIView):
             # Notifications are best-effort and should not break contact message creation.
             pass
 
-    def _send_notification_email(self, message):
+    @staticmethod
+    def _notification_addresses():
+        """(from_email, admin_email) for contact notifications, or None if unset."""
+        from django.conf import settings as django_settings
+        from content.models import SiteSettings
+
+        site = SiteSettings.get_settings()
+        from_email = site.default_from_email or site.email_host_user or django_settings.DEFAULT_FROM_EMAIL or django_settings.EMAIL_HOST_USER
+        admin_email = site.contact_email or site.email_host_user or django_settings.DEFAULT_FROM_EMAIL
+        if not from_email or not admin_email:
+            return None
+        return from_email, admin_email
+
+    async def _send_notification_email(self, message):
         """Send email notification to admin when a contact message is received."""
         try:
             from django.core.mail import send_mail
-            from django.conf import settings as django_settings
-            from content.models import SiteSettings
 
-            site = SiteSettings.get_settings()
-            from_email = site.default_from_email or site.email_host_user or django_settings.DEFAULT_FROM_EMAIL or django_settings.EMAIL_HOST_USER
-            admin_email = site.contact_email or site.email_host_user or django_settings.DEFAULT_FROM_EMAIL
-            if not from_email or not admin_email:
+            addresses = await sync_to_async(self._notification_addresses)()
+            if addresses is None:
                 return
+            from_email, admin_email = addresses
 
-            send_mail(
+            # No ORM access, so any pool thread will do
+            await sync_to_async(send_mail, thread_sensitive=False)(
                 subject=f'Nouveau message de contact: {message.subject}',
                 message=(
                     f'Nom: {message.name}\n'
@@ -260,20 +273,12 @@ class ContactMessageReplyView(APIView):
 
 # ============ Email Subscription Views ============
 
-@method_decorator(ratelimit(key='ip', rate=os.environ.get('SUBSCRIPTION_RATE_LIMIT', '5/h'), method='POST', block=True), name='dispatch')
+@method_decorator(ratelimit_or_exempt(key='ip', rate=os.environ.get('SUBSCRIPTION_RATE_LIMIT', '5/h'), method='POST', block=True), name='dispatch')
 class EmailSubscriptionView(generics.CreateAPIView):
     queryset = EmailSubscription.objects.all()
     serializer_class = EmailSubscriptionSerializer
     permission_classes = [permissions.AllowAny]
     
-    def handle_exception(self, exc):
-        if isinstance(exc, Ratelimited):
-            return Response(
-                {'detail': 'Rate limit exceeded. Please try again later.'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-        return super().handle_exception(exc)
-
     def create(self, request, *args, **kwargs):
         serializer = SubscribeSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -292,18 +297,10 @@ class EmailSubscriptionView(generics.CreateAPIView):
         return Response({'message': 'Subscribed successfully'}, status=status.HTTP_201_CREATED)
 
 
-@method_decorator(ratelimit(key='ip', rate=os.environ.get('UNSUBSCRIBE_RATE_LIMIT', '5/h'), method='POST', block=True), name='dispatch')
+@method_decorator(ratelimit_or_exempt(key='ip', rate=os.environ.get('UNSUBSCRIBE_RATE_LIMIT', '5/h'), method='POST', block=True), name='dispatch')
 class UnsubscribeView(APIView):
     permission_classes = [permissions.AllowAny]
     
-    def handle_exception(self, exc):
-        if isinstance(exc, Ratelimited):
-            return Response(
-                {'detail': 'Rate limit exceeded. Please try again later.'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-        return super().handle_exception(exc)
-
     def post(self, request):
         serializer = UnsubscribeSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
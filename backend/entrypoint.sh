@@ -18,6 +18,12 @@ python manage.py fix_localhost_urls || true
 echo "Fixing bad /auto/upload/ Cloudinary URLs in DB (idempotent)..."
 python manage.py fix_cloudinary_auto_urls --apply || true
 
+echo "Creating upcoming event table partitions and dropping expired ones (idempotent)..."
+python manage.py manage_partitions --purge || true
+
+echo "Seeding Prometheus business counters..."
+python manage.py reconcile_metrics || true
+
 # Auto-promote or create admin from env vars (runs on every deploy, idempotent)
 if [ -n "$ADMIN_EMAIL" ]; then
   echo "Ensuring admin user: $ADMIN_EMAIL"
@@ -1,7 +1,33 @@
+import os
+import shutil
+
+# SERVER_MODE selects the serving stack:
+#   wsgi (default) - sync workers, 2 threads each; every request holds a
+#                    thread for its full duration, outbound calls included.
+#   asgi           - uvicorn workers on portfolio.asgi. Async views
+#                    (api.asyncviews.AsyncAPIView: social sign-in, contact
+#                    form) wait on Google/SMTP without holding a thread, and
+#                    sync views run on per-request threads. Persistent DB
+#                    connections are off in this mode, as Django requires.
+# Start with `gunicorn -c gunicorn.conf.py` (no app argument) so the mode
+# picks the application. `manage.py loadtest` compares the two.
+server_mode = os.environ.get("SERVER_MODE", "wsgi").lower()
+if server_mode not in ("wsgi", "asgi"):
+    raise RuntimeError(f"SERVER_MODE must be 'wsgi' or 'asgi', not {server_mode!r}")
+
 bind = "0.0.0.0:8000"
 workers = 3
-worker_class = "sync"
-threads = 2
+if server_mode == "asgi":
+    wsgi_app = "portfolio.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+    os.environ.setdefault("DB_CONN_MAX_AGE", "0")
+else:
+    wsgi_app = "portfolio.wsgi:application"
+    worker_class = "sync"
+    threads = 2
+    # Shed password hashes (api.hashing) once all but one of the worker's
+    # threads are waiting on one, so a login burst never takes every thread
+    os.environ.setdefault("PASSWORD_HASH_MAX_PENDING", str(max(1, threads - 1)))
 timeout = 60
 graceful_timeout = 30
 max_requests = 1000
@@ -9,3 +35,38 @@ max_requests_jitter = 50
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
+
+# Prometheus multiprocess mode: workers write metric samples to mmap'd files
+# here and /metrics/ merges them, so scrapes see totals for the whole server
+# rather than whichever worker answered. Set before any worker imports
+# prometheus_client.
+prometheus_multiproc_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc"
+)
+
+
+def on_starting(server):
+    """Start from an empty metrics directory so stale worker files never count."""
+    shutil.rmtree(prometheus_multiproc_dir, ignore_errors=True)
+    os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+
+
+def worker_exit(server, worker):
+    """Drain in-process write buffers and pending alerts, stop the hashing pool
+    and close pooled outbound connections."""
+    from api.alerts import alert_dispatcher
+    from api.audit import audit_log
+    from api.hashing import pool as password_hash_pool
+    from api.outbound import registry as outbound_http
+    from api.tracking import visitor_buffer
+    visitor_buffer.shutdown()
+    audit_log.shutdown()
+    alert_dispatcher.shutdown()
+    password_hash_pool.shutdown()
+    outbound_http.close()
+
+
+def child_exit(server, worker):
+    """Drop the exited worker's live gauges (counters and histograms persist)."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
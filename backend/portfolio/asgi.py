@@ -13,3 +13,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'portfolio.settings.prod')
 
 application = get_asgi_application()
+
+# Every request is served on the worker's long-lived event loop, so outbound
+# async clients can keep their connections alive across requests
+from api.outbound import registry as outbound_http  # noqa: E402
+outbound_http.use_event_loop_clients()
@@ -1,3 +1,3 @@
 # Settings are loaded via DJANGO_SETTINGS_MODULE env var.
 # Do NOT import dev/prod here to avoid double-loading.
-# Set DJANGO_SETTINGS_MODULE=portfolio.settings.dev (or .prod) in your env.
+# Set DJANGO_SETTINGS_MODULE=portfolio.settings.dev (or .prod, .test) in your env.
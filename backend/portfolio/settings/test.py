@@ -0,0 +1,15 @@
+from .dev import *
+
+# Test suite settings (pytest.ini). No state may outlive a test run.
+
+# Per-process rate limiter buckets instead of the host-wide mmap file, which
+# would carry state from one run (or one test) to the next.
+RATELIMIT_SHARED_FILE = ''
+
+# Write audit records, visitor events and security alerts inline. Background
+# flushers would outlive the test database and fail at exit, and the audit
+# spool would replay one run's records into the next.
+AUDIT_LOG_ASYNC = False
+AUDIT_LOG_SPOOL_DIR = ''
+VISITOR_BUFFER_ASYNC = False
+SECURITY_ALERT_ASYNC = False
@@ -5,10 +5,36 @@ import os
 from urllib.parse import urlparse
 from rest_framework import serializers
 from django.conf import settings
+from django.db.models import Q
 from .models import Project, MediaItem, Skill, ProjectRegistration
 from interactions.models import Like
 
 
+def resolve_liked_ids(user, projects):
+    """
+    Serializer context with the ids of ``projects`` and of their media that
+    ``user`` has liked, fetched in a single query. Media must be prefetched.
+    """
+    liked = {'liked_project_ids': set(), 'liked_media_ids': set()}
+    if not (user and user.is_authenticated):
+        return liked
+    project_ids = [project.pk for project in projects]
+    media_ids = [media.pk for project in projects for media in project.media.all()]
+    if not project_ids:
+        return liked
+
+    likes = Like.objects.filter(user=user).filter(
+        Q(content_type='project', project_id__in=project_ids)
+        | Q(content_type='media', media_id__in=media_ids)
+    ).values_list('content_type', 'project_id', 'media_id')
+    for content_type, project_id, media_id in likes:
+        if content_type == 'project':
+            liked['liked_project_ids'].add(project_id)
+        else:
+            liked['liked_media_ids'].add(media_id)
+    return liked
+
+
 class MediaItemCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating media items for a project"""
     project = serializers.SlugRelatedField(
@@ -129,12 +155,16 @@ class MediaItemSerializer(serializers.ModelSerializer):
         return None
     
     def get_is_liked(self, obj):
+        # Project views resolve the whole page's likes up front (resolve_liked_ids)
+        liked_media_ids = self.context.get('liked_media_ids')
+        if liked_media_ids is not None:
+            return obj.id in liked_media_ids
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.is_authenticated:
             # Check if we have already annotated the liked status
             if hasattr(obj, 'is_liked'):
                 return obj.is_liked
-            # Fallback to query if not annotated (shouldn't happen with our view changes)
+            # Fallback to query when serialized on its own (e.g. after upload)
             return Like.objects.filter(user=request.user, media=obj).exists()
         return False
 
@@ -154,36 +184,18 @@ class ProjectSerializer(serializers.ModelSerializer):
         }
     
     def get_is_liked(self, obj):
+        liked_project_ids = self.context.get('liked_project_ids')
+        if liked_project_ids is not None:
+            return obj.id in liked_project_ids
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            # Check if we have already annotated the liked status
-            if hasattr(obj, 'is_liked'):
-                return obj.is_liked
-            # Fallback to query if not annotated (shouldn't happen with our view changes)
+            # Fallback to query when the view did not resolve likes (e.g. after an update)
             return Like.objects.filter(user=request.user, project=obj).exists()
         return False
     
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         
-        # For media items, we need to handle liked status efficiently
-        request = self.context.get('request')
-        if request and hasattr(request, 'user') and request.user.is_authenticated:
-            from interactions.models import Like
-            
-            # Get all liked media IDs for this user in one query
-            media_ids = [media.id for media in instance.media.all()]
-            liked_media_ids = Like.objects.filter(
-                user=request.user,
-                media_id__in=media_ids,
-                content_type='media'
-            ).values_list('media_id', flat=True)
-            
-            # Update each media item's is_liked field
-            if 'media' in representation:
-                for media in representation['media']:
-                    media['is_liked'] = media['id'] in liked_media_ids
-        
         # Ensure category is properly encoded when sending to frontend
         if 'category' in representation:
             # Ensure category is properly UTF-8 encoded
@@ -0,0 +1,68 @@
+"""
+Tests for project API endpoints
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from interactions.models import Like
+from .models import MediaItem, Project
+
+User = get_user_model()
+
+
+class ProjectLikedStatusTest(TestCase):
+    """Test liked status is resolved once per page, not per project or media item"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='liker@example.com', password='password123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.projects = []
+        for i in range(8):
+            project = Project.objects.create(title=f'Project {i}', description='Test project')
+            for order in range(3):
+                MediaItem.objects.create(
+                    project=project, external_url=f'https://example.com/{i}/{order}.jpg', order=order
+                )
+            self.projects.append(project)
+
+        self.liked_project = self.projects[0]
+        self.liked_media = self.projects[1].media.first()
+        Like.objects.create(
+            user=self.user, project=self.liked_project, content_type='project', content_id=self.liked_project.id
+        )
+        Like.objects.create(
+            user=self.user, media=self.liked_media, content_type='media', content_id=self.liked_media.id
+        )
+
+    def _list(self, page_size):
+        return self.client.get(reverse('project-list-create'), {'page_size': page_size})
+
+    def test_list_query_count_is_constant(self):
+        """Test the list endpoint issues the same queries for 2 and 8 projects"""
+        with CaptureQueriesContext(connection) as small_page:
+            self.assertEqual(self._list(2).status_code, 200)
+        with self.assertNumQueries(len(small_page)):
+            response = self._list(8)
+        self.assertEqual(len(response.json()['results']), 8)
+
+    def test_liked_status(self):
+        """Test liked projects and media are flagged in the list and detail views"""
+        results = {project['id']: project for project in self._list(8).json()['results']}
+        self.assertEqual(
+            {pk for pk, project in results.items() if project['is_liked']}, {self.liked_project.id}
+        )
+        liked_media = {
+            media['id'] for project in results.values() for media in project['media'] if media['is_liked']
+        }
+        self.assertEqual(liked_media, {self.liked_media.id})
+
+        detail = self.client.get(reverse('project-detail', args=[self.projects[1].slug])).json()
+        self.assertFalse(detail['is_liked'])
+        self.assertEqual([media['id'] for media in detail['media'] if media['is_liked']], [self.liked_media.id])
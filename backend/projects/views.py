@@ -6,15 +6,15 @@ from rest_framework import generics, permissions, pagination, status
 from rest_framework.response import Response
 from django.views.decorators.cache import cache_page
 from django.utils.decorators import method_decorator
-from django_ratelimit.decorators import ratelimit
-from django_ratelimit.exceptions import Ratelimited
 from django.conf import settings
 import os
 
 logger = logging.getLogger(__name__)
 
 from .models import Project, Skill, MediaItem, ProjectRegistration
-from .serializers import ProjectSerializer, SkillSerializer, MediaItemCreateSerializer, ProjectRegistrationSerializer
+from .serializers import (
+    ProjectSerializer, SkillSerializer, MediaItemCreateSerializer, ProjectRegistrationSerializer, resolve_liked_ids,
+)
 from api.permissions import IsAdminUser, IsAdminOrReadOnly
 from api.utils import ratelimit_or_exempt
 
@@ -29,8 +29,24 @@ class StandardResultsSetPagination(pagination.PageNumberPagination):
 
 # ============ Project Views ============
 
+class LikedStatusMixin:
+    """
+    Resolves which of the serialized projects and media the user liked in one
+    query per response (see resolve_liked_ids), instead of one per project
+    or media item.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        if args and self.request.method == 'GET':
+            projects = args[0] if kwargs.get('many') else [args[0]]
+            context = self.get_serializer_context()
+            context.update(resolve_liked_ids(self.request.user, projects))
+            kwargs['context'] = context
+        return super().get_serializer(*args, **kwargs)
+
+
 @method_decorator(ratelimit_or_exempt(key='user', rate=os.environ.get('PROJECT_CREATE_RATE_LIMIT', '100/h'), method='POST', block=True), name='dispatch')
-class ProjectListCreate(generics.ListCreateAPIView):
+class ProjectListCreate(LikedStatusMixin, generics.ListCreateAPIView):
     serializer_class = ProjectSerializer
     pagination_class = StandardResultsSetPagination
     
@@ -38,35 +54,11 @@ class ProjectListCreate(generics.ListCreateAPIView):
         # Only return active projects for anonymous users or non-admin users
         queryset = Project.objects.select_related('created_by').prefetch_related('media')
         
-        # For authenticated users, annotate with liked information to avoid N+1 queries
-        if self.request.user.is_authenticated:
-            from django.db.models import Exists, OuterRef
-            from interactions.models import Like
-            
-            # Annotate projects with is_liked
-            project_likes = Like.objects.filter(
-                user=self.request.user,
-                project=OuterRef('pk'),
-                content_type='project'
-            )
-            queryset = queryset.annotate(is_liked=Exists(project_likes))
-            
-            # For media items, we need to handle it differently since it's a related field
-            # We'll prefetch media items and annotate them in the serializer
-            
         if not (self.request.user.is_authenticated and self.request.user.is_admin()):
             queryset = queryset.filter(is_active=True)
             
         return queryset
     
-    def handle_exception(self, exc):
-        if isinstance(exc, Ratelimited):
-            return Response(
-                {'detail': 'Rate limit exceeded. Please try again later.'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-        return super().handle_exception(exc)
-
     def get_permissions(self):
         if self.request.method == 'POST':
             return [IsAdminUser()]
@@ -79,7 +71,7 @@ class ProjectListCreate(generics.ListCreateAPIView):
 @method_decorator(ratelimit_or_exempt(key='user', rate=os.environ.get('PROJECT_CREATE_RATE_LIMIT', '100/h'), method='POST', block=True), name='dispatch')
 @method_decorator(ratelimit_or_exempt(key='user', rate=os.environ.get('PROJECT_UPDATE_RATE_LIMIT', '50/h'), method=['PUT', 'PATCH'], block=True), name='dispatch')
 @method_decorator(ratelimit_or_exempt(key='user', rate=os.environ.get('PROJECT_DELETE_RATE_LIMIT', '20/h'), method='DELETE', block=True), name='dispatch')
-class ProjectRetrieveUpdateDestroy(generics.RetrieveUpdateDestroyAPIView):
+class ProjectRetrieveUpdateDestroy(LikedStatusMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ProjectSerializer
     lookup_field = 'slug'
 
@@ -87,22 +79,6 @@ class ProjectRetrieveUpdateDestroy(generics.RetrieveUpdateDestroyAPIView):
         # Only return active projects for anonymous users or non-admin users
         queryset = Project.objects.select_related('created_by').prefetch_related('media')
         
-        # For authenticated users, annotate with liked information to avoid N+1 queries
-        if self.request.user.is_authenticated:
-            from django.db.models import Exists, OuterRef
-            from interactions.models import Like
-            
-            # Annotate projects with is_liked
-            project_likes = Like.objects.filter(
-                user=self.request.user,
-                project=OuterRef('pk'),
-                content_type='project'
-            )
-            queryset = queryset.annotate(is_liked=Exists(project_likes))
-            
-            # For media items, we need to handle it differently since it's a related field
-            # We'll prefetch media items and annotate them in the serializer
-            
         if not (self.request.user.is_authenticated and self.request.user.is_admin()):
             queryset = queryset.filter(is_active=True)
             
@@ -153,14 +129,6 @@ class MediaItemCreate(generics.CreateAPIView):
     serializer_class = MediaItemCreateSerializer
     permission_classes = [IsAdminUser]
     
-    def handle_exception(self, exc):
-        if isinstance(exc, Ratelimited):
-            return Response(
-                {'detail': 'Rate limit exceeded. Please try again later.'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-        return super().handle_exception(exc)
-    
     def perform_create(self, serializer):
         # Return the saved instance
         return serializer.save()
@@ -189,14 +157,6 @@ class MediaItemDelete(generics.DestroyAPIView):
     """View for deleting media items from a project"""
     queryset = MediaItem.objects.all()
     permission_classes = [IsAdminUser]
-    
-    def handle_exception(self, exc):
-        if isinstance(exc, Ratelimited):
-            return Response(
-                {'detail': 'Rate limit exceeded. Please try again later.'},
-                status=status.HTTP_429_TOO_MANY_REQUESTS
-            )
-        return super().handle_exception(exc)
 
 
 # ============ Project Registration Views ============